@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+会话存档吞吐量压测
+使用纯Python的替代SDK生成加密消息，经WecomChatArchiver完成解密、去重与入库，统计每秒处理的消息数
+
+请使用本地测试数据库，压测消息的msgid以bench_开头，结束后自动删除
+用法(在仓库根目录下):
+    python benchmarks/archiver/bench_archiver.py --db-url postgresql+psycopg2://localhost/wecom_bench --messages 5000
+    python benchmarks/archiver/bench_archiver.py --db-url ... --media   # 同时压测图片拉取与保存
+    media_workers=4 python benchmarks/archiver/bench_archiver.py --db-url ... --media   # 经SDK实例池并行拉取图片
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+from collections import defaultdict
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from sqlalchemy import text
+from save_chat import WecomChatArchiver
+from fake_finance_sdk import FakeFinanceSdk, generate_keypair
+
+
+class BenchArchiver(WecomChatArchiver):
+    """
+    记录各阶段耗时的存档服务，群聊名称查询不访问企业微信接口
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.timings = defaultdict(float)
+        super().__init__(*args, **kwargs)
+
+    def _get_access_token(self):
+        return "bench"
+
+    def _get_chat_name(self, roomid):
+        return f"压测群{roomid}", True
+
+    def _timed(self, stage, func, *args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.timings[stage] += time.perf_counter() - start_time
+
+    def initialize_sdk(self):
+        ok = super().initialize_sdk()
+        decrypt_data = self.sdk.decrypt_data
+        self.sdk.decrypt_data = lambda *args: self._timed("decrypt", decrypt_data, *args)
+        return ok
+
+    def is_message_exists(self, msgid, msgtype):
+        return self._timed("dedup", super().is_message_exists, msgid, msgtype)
+
+    def save_to_database(self, *args, **kwargs):
+        return self._timed("insert", super().save_to_database, *args, **kwargs)
+
+    def process_message_by_type(self, data_details, sdk=None):
+        return self._timed("media", super().process_message_by_type, data_details, sdk)
+
+
+def ensure_schema(engine):
+    with engine.begin() as con:
+        if con.execute(text("SELECT to_regclass('wecom_messages')")).scalar() is None:
+            with open(os.path.join(ROOT, "messages.sql"), encoding="utf-8") as sql_file:
+                for statement in sql_file.read().split(";"):
+                    if statement.strip():
+                        con.execute(text(statement))
+
+
+def run(args):
+    private_key = generate_keypair()
+    prikey_file = tempfile.NamedTemporaryFile("wb", suffix=".pem", delete=False)
+    prikey_file.write(private_key.export_key())
+    prikey_file.close()
+    # 图片保存在当前目录，压测时切换到临时目录
+    workdir = tempfile.TemporaryDirectory()
+    os.chdir(workdir.name)
+
+    print(f"生成 {args.messages} 条加密消息...")
+    fake_sdk = FakeFinanceSdk(private_key.publickey(), total_messages=args.messages, image_ratio=args.image_ratio)
+    archiver = BenchArchiver(corp_id="bench", corp_key="bench", prikey_path=prikey_file.name,
+                             db_url=args.db_url, sdk_factory=lambda corp_id, corp_key: fake_sdk)
+    ensure_schema(archiver.sql_db)
+    if not archiver.initialize_sdk():
+        raise RuntimeError("SDK初始化失败")
+
+    try:
+        results = {}
+        # 第一轮全部为新消息，第二轮全部命中去重
+        for phase in ("insert", "dedup"):
+            archiver.timings.clear()
+            seq, processed = 0, 0
+            start_time = time.perf_counter()
+            while True:
+                seq, count = archiver._timed("pull", archiver.pull_once, seq, args.limit)
+                if count == 0:
+                    break
+                processed += count
+            elapsed = time.perf_counter() - start_time
+            results[phase] = (processed, elapsed, dict(archiver.timings))
+        if args.media:
+            archiver.timings.clear()
+            start_time = time.perf_counter()
+            if archiver.media_executor:
+                # 设置了media_workers时经SDK实例池并行拉取
+                futures = [archiver.media_executor.submit(archiver._pull_media, msg) for msg in fake_sdk.media_messages]
+                for future in futures:
+                    future.result()
+            else:
+                for msg in fake_sdk.media_messages:
+                    archiver.process_message_by_type(msg)
+            results["media"] = (len(fake_sdk.media_messages), time.perf_counter() - start_time, dict(archiver.timings))
+    finally:
+        with archiver.sql_db.begin() as con:
+            con.execute(text("DELETE FROM wecom_messages WHERE msgid LIKE 'bench\\_%'"))
+        os.remove(prikey_file.name)
+        os.chdir(ROOT)
+        workdir.cleanup()
+
+    for phase, (processed, elapsed, timings) in results.items():
+        print(f"[{phase}] {processed} 条, 耗时 {elapsed:.2f}秒, {processed / elapsed:.1f} 条/秒")
+        for stage in ("decrypt", "dedup", "insert", "media"):
+            if stage in timings:
+                print(f"    {stage:>8}: {timings[stage]:.2f}秒 ({timings[stage] / elapsed * 100:.0f}%)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="会话存档吞吐量压测")
+    parser.add_argument("--db-url", default=os.getenv("bench_db_url"), required=os.getenv("bench_db_url") is None,
+                        help="本地测试数据库连接URL")
+    parser.add_argument("--messages", type=int, default=5000, help="压测消息数量")
+    parser.add_argument("--limit", type=int, default=100, help="每页拉取的消息数量")
+    parser.add_argument("--image-ratio", type=float, default=0.1, help="图片消息占比")
+    parser.add_argument("--media", action="store_true", help="压测图片消息的媒体拉取与保存")
+    run(parser.parse_args())
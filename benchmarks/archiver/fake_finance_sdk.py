@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+企业微信会话存档SDK的纯Python替代实现
+与WeWorkFinanceSdk接口一致，生成与真实数据结构相同的加密chatdata分页与媒体分片，用于离线压测
+"""
+import json
+import random
+import base64
+import hashlib
+import os
+import string
+from Crypto.Cipher import AES, PKCS1_v1_5
+from Crypto.PublicKey import RSA
+from Crypto.Util.Padding import pad, unpad
+
+# 与原生SDK一致，媒体文件每次最多拉取512k
+MEDIA_CHUNK_SIZE = 512 * 1024
+SAMPLE_TEXTS = [
+    "SPD系统今天下午两点升级，期间暂停使用",
+    "骨科识别仪的参数表已经上传到群文件，请查收",
+    "请各科室在周五前提交本月耗材盘点结果",
+    "收到，我这边马上处理",
+    "医疗器械管理条例第三章的培训安排在下周一",
+]
+
+
+def generate_keypair(bits=2048):
+    """
+    生成压测用的RSA密钥对
+
+    Returns:
+        RSA.RsaKey: 私钥，publickey()为对应公钥
+    """
+    return RSA.generate(bits)
+
+
+def _random_key():
+    return "".join(random.choices(string.ascii_letters + string.digits, k=32))
+
+
+def _encrypt_msg(random_key, plain):
+    key = random_key.encode()
+    cipher = AES.new(key, AES.MODE_CBC, key[:16])
+    return base64.b64encode(cipher.encrypt(pad(plain, AES.block_size))).decode()
+
+
+class FakeFinanceSdk:
+    """
+    会话存档SDK替代实现
+    初始化时预先生成全部加密消息，拉取时只做分页，不计入被测代码的耗时
+    """
+
+    def __init__(self, public_key, total_messages=10000, rooms=20, users=200, image_ratio=0.1,
+                 media_size=600 * 1024, msgid_prefix="bench_", publickey_ver=1):
+        """
+        初始化替代SDK
+
+        Args:
+            public_key: 用于加密encrypt_random_key的RSA公钥
+            total_messages (int): 生成的消息数量
+            rooms (int): 群聊数量
+            users (int): 成员数量
+            image_ratio (float): 图片消息占比
+            media_size (int): 每个媒体文件的大小(字节)
+            msgid_prefix (str): 消息id前缀，便于压测后清理
+            publickey_ver (int): 公钥版本
+        """
+        self.rsa = PKCS1_v1_5.new(public_key)
+        self.media_size = media_size
+        self.media = {}
+        # 图片消息的明文，用于单独压测媒体拉取
+        self.media_messages = []
+        self.chatdata = []
+        now_ms = 1762000000000
+        for seq in range(1, total_messages + 1):
+            user = f"user{random.randrange(users)}"
+            roomid = f"wr_bench_{random.randrange(rooms)}"
+            msg = {
+                "msgid": f"{msgid_prefix}{seq}",
+                "action": "send",
+                "from": user,
+                "tolist": [f"user{random.randrange(users)}" for _ in range(3)],
+                "roomid": roomid,
+                "msgtime": now_ms + seq * 1000,
+            }
+            if random.random() < image_ratio:
+                sdkfileid = base64.b64encode(os.urandom(48)).decode()
+                self.media[sdkfileid] = None
+                msg.update({"msgtype": "image", "image": {
+                    "md5sum": hashlib.md5(sdkfileid.encode()).hexdigest(),
+                    "filesize": media_size,
+                    "sdkfileid": sdkfileid,
+                }})
+                self.media_messages.append(msg)
+            else:
+                msg.update({"msgtype": "text", "text": {"content": random.choice(SAMPLE_TEXTS)}})
+            random_key = _random_key()
+            self.chatdata.append({
+                "seq": seq,
+                "msgid": msg["msgid"],
+                "publickey_ver": publickey_ver,
+                "encrypt_random_key": base64.b64encode(self.rsa.encrypt(random_key.encode())).decode(),
+                "encrypt_chat_msg": _encrypt_msg(random_key, json.dumps(msg, ensure_ascii=False).encode()),
+            })
+
+    def get_chat_data(self, seq, limit, proxy="", passwd="", timeout=30, max_retries=3):
+        """返回seq之后最多limit条消息，格式与GetChatData一致"""
+        page = [item for item in self.chatdata[seq:seq + limit]]
+        data = json.dumps({"errcode": 0, "errmsg": "ok", "chatdata": page}).encode()
+        return data, len(data)
+
+    @staticmethod
+    def decrypt_data(encrypt_key, encrypt_chat_msg):
+        """解密encrypt_chat_msg，格式与DecryptData一致"""
+        key = encrypt_key.encode()
+        cipher = AES.new(key, AES.MODE_CBC, key[:16])
+        data = unpad(cipher.decrypt(base64.b64decode(encrypt_chat_msg)), AES.block_size)
+        return data, len(data)
+
+    def _media_chunks(self, file_id):
+        # 每个文件的内容按需生成一次
+        content = self.media.get(file_id)
+        if content is None:
+            content = os.urandom(self.media_size)
+            self.media[file_id] = content
+        for offset in range(0, len(content), MEDIA_CHUNK_SIZE):
+            yield content[offset:offset + MEDIA_CHUNK_SIZE]
+
+    def pull_media_file(self, file_id, proxy="", passwd="", timeout=30, max_retries=3):
+        """按512k分片拉取媒体文件到内存"""
+        total_data = bytearray()
+        for chunk in self._media_chunks(file_id):
+            total_data.extend(chunk)
+        return bytes(total_data), len(total_data)
+
+    def download_media_file(self, file_id, file_save_path, md5sum="", proxy="", passwd="", timeout=30, max_retries=3):
+        """按512k分片拉取媒体文件并写入文件"""
+        with open(file_save_path, "wb") as dstf:
+            for chunk in self._media_chunks(file_id):
+                dstf.write(chunk)
+        return True
+
+    def destroy_sdk(self):
+        self.media.clear()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+机器人回调链路压测
+启动模拟Dify与机器人服务，多个模拟企业微信用户并发提问，输出吞吐量、首个内容耗时p50/p99与服务内存曲线
+
+用法(在仓库根目录下):
+    python benchmarks/loadtest/driver.py --users 20 --duration 60 --tokens 200 --rate 50
+"""
+import os
+import sys
+import json
+import time
+import base64
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_dify import start_fake_dify
+from fake_wecom import FakeWeComClient
+
+QUESTIONS = ["SPD系统如何登录", "我国医疗器械管理条例介绍", "骨科识别仪的参数", "SPD系统如何修改密码"]
+
+
+def percentile(values, pct):
+    """计算百分位数，values为空时返回None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def read_rss_mb(pid):
+    """读取进程常驻内存(MB)，仅支持Linux"""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with socket.socket() as sock:
+            if sock.connect_ex(("127.0.0.1", port)) == 0:
+                return True
+        time.sleep(0.2)
+    return False
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run(args):
+    dify = start_fake_dify(tokens=args.tokens, rate=args.rate, first_token_delay=args.first_token_delay)
+    token = "loadtest"
+    encoding_aes_key = base64.b64encode(os.urandom(32)).decode()[:-1]
+    port = args.port or free_port()
+    env = dict(
+        os.environ,
+        Token=token,
+        EncodingAESKey=encoding_aes_key,
+        dify_url=f"http://127.0.0.1:{dify.server_address[1]}",
+        dify_key="app-loadtest",
+        port=str(port)
+    )
+    serve_app = os.path.join(os.path.dirname(os.path.abspath(__file__)), "serve_app.py")
+    # 服务在临时目录中运行，重复请求检测文件不写入仓库
+    app_process = subprocess.Popen([sys.executable, serve_app], env=env, cwd=tempfile.mkdtemp(prefix="wecom_loadtest_"),
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_for_port(port):
+            raise RuntimeError("机器人服务启动超时")
+
+        # 每秒采样一次服务内存
+        rss_samples = []
+        stop = threading.Event()
+        def sample_rss():
+            start_time = time.time()
+            while not stop.is_set():
+                rss_samples.append((round(time.time() - start_time, 1), read_rss_mb(app_process.pid)))
+                stop.wait(1)
+        threading.Thread(target=sample_rss, daemon=True).start()
+
+        results = []
+        results_lock = threading.Lock()
+        deadline = time.time() + args.duration
+        def user_loop(index):
+            client = FakeWeComClient(f"http://127.0.0.1:{port}", token, encoding_aes_key, poll_interval=args.poll_interval)
+            count = 0
+            while time.time() < deadline:
+                question = QUESTIONS[(index + count) % len(QUESTIONS)]
+                try:
+                    stats = client.ask(question, from_user=f"user{index}", chatid=f"chat{index % args.chats}")
+                except Exception as e:
+                    stats = {"error": str(e), "finished": False}
+                with results_lock:
+                    results.append(stats)
+                count += 1
+
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=args.users) as executor:
+            list(executor.map(user_loop, range(args.users)))
+        elapsed = time.time() - start_time
+        stop.set()
+    finally:
+        app_process.terminate()
+        app_process.wait(timeout=10)
+        dify.shutdown()
+
+    finished = [item for item in results if item.get("finished")]
+    first_chunks = [item["first_chunk"] for item in finished if item.get("first_chunk") is not None]
+    totals = [item["total"] for item in finished]
+    rss_values = [rss for _, rss in rss_samples if rss is not None]
+    return {
+        "users": args.users,
+        "duration": round(elapsed, 1),
+        "answers": len(finished),
+        "failed": len(results) - len(finished),
+        "throughput": round(len(finished) / elapsed, 2) if elapsed else 0,
+        "first_chunk_p50": percentile(first_chunks, 50),
+        "first_chunk_p99": percentile(first_chunks, 99),
+        "total_p50": percentile(totals, 50),
+        "total_p99": percentile(totals, 99),
+        "polls_mean": round(sum(item["polls"] for item in finished) / len(finished), 1) if finished else None,
+        "rss_start_mb": rss_values[0] if rss_values else None,
+        "rss_max_mb": max(rss_values) if rss_values else None,
+        "rss_end_mb": rss_values[-1] if rss_values else None,
+        "rss_samples": rss_samples,
+        "dify_requests": dify.requests_served,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="机器人回调链路压测")
+    parser.add_argument("--users", type=int, default=10, help="并发用户数")
+    parser.add_argument("--chats", type=int, default=5, help="用户分布的群聊数")
+    parser.add_argument("--duration", type=float, default=30, help="压测时长(秒)")
+    parser.add_argument("--tokens", type=int, default=200, help="每个回答的token数")
+    parser.add_argument("--rate", type=float, default=50.0, help="模拟Dify每秒输出的token数")
+    parser.add_argument("--first-token-delay", type=float, default=0.5, help="模拟Dify首个token的等待时间(秒)")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="企业微信轮询间隔(秒)")
+    parser.add_argument("--port", type=int, default=0, help="机器人服务端口，0为随机端口")
+    parser.add_argument("--json", help="将完整结果写入该文件")
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.json:
+        with open(args.json, "w") as result_file:
+            json.dump(report, result_file, ensure_ascii=False, indent=2)
+    def fmt(value):
+        return "-" if value is None else f"{value:.3f}" if isinstance(value, float) else str(value)
+    for key, value in report.items():
+        if key != "rss_samples":
+            print(f"{key:>18}: {fmt(value)}")
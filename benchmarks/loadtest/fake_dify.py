@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Dify聊天流接口模拟服务
+按可配置的速率以SSE格式逐个输出token，用于压测时替代真实的Dify
+
+用法:
+    python fake_dify.py --port 5001 --tokens 200 --rate 50
+"""
+import json
+import time
+import uuid
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_ANSWER = "SPD系统登录步骤：打开SPD系统首页，输入工号与密码，点击登录即可进入系统。"
+
+
+class FakeDifyHandler(BaseHTTPRequestHandler):
+    """
+    /chat-messages 流式接口
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if not self.path.startswith("/chat-messages"):
+            self.send_error(404)
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        server = self.server
+        # 首个token之前的等待时间模拟检索与模型排队
+        time.sleep(server.first_token_delay)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        conversation_id = payload.get("conversation_id") or str(uuid.uuid4())
+        message_id = str(uuid.uuid4())
+        answer = server.answer
+        interval = 1.0 / server.rate if server.rate > 0 else 0
+        try:
+            for i in range(server.tokens):
+                token = answer[i % len(answer)]
+                event = {"event": "message", "answer": token, "conversation_id": conversation_id, "message_id": message_id}
+                self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                if interval:
+                    time.sleep(interval)
+            end = {"event": "message_end", "conversation_id": conversation_id, "message_id": message_id}
+            self.wfile.write(f"data: {json.dumps(end)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        with server.lock:
+            server.requests_served += 1
+
+
+def start_fake_dify(port=0, tokens=200, rate=50.0, first_token_delay=0.5, answer=DEFAULT_ANSWER):
+    """
+    在后台线程中启动模拟服务
+
+    Args:
+        port (int): 监听端口，0为随机端口
+        tokens (int): 每个回答输出的token数
+        rate (float): 每秒输出的token数
+        first_token_delay (float): 首个token之前的等待时间(秒)
+        answer (str): 循环输出的回答文本
+
+    Returns:
+        ThreadingHTTPServer: 服务实例，server_address[1]为实际端口
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeDifyHandler)
+    server.daemon_threads = True
+    server.tokens = tokens
+    server.rate = rate
+    server.first_token_delay = first_token_delay
+    server.answer = answer
+    server.lock = threading.Lock()
+    server.requests_served = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dify聊天流接口模拟服务")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=50.0, help="每秒输出的token数")
+    parser.add_argument("--first-token-delay", type=float, default=0.5)
+    args = parser.parse_args()
+    server = start_fake_dify(args.port, args.tokens, args.rate, args.first_token_delay)
+    print(f"fake dify listening on http://127.0.0.1:{server.server_address[1]}/chat-messages")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
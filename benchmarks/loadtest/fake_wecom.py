@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+企业微信智能机器人客户端模拟
+使用WXBizJsonMsgCrypt加密消息，按企业微信的节奏轮询/wechat/callback/chatBot直到流式消息结束
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src"))
+from utils.WXBizJsonMsgCrypt import WXBizJsonMsgCrypt
+
+THINKING_PREFIX = "米小度正在思考中"
+
+
+class FakeWeComClient:
+    """
+    模拟企业微信向机器人回调地址推送消息并轮询流式回复
+    """
+
+    def __init__(self, base_url, token, encoding_aes_key, poll_interval=1.0, timeout=120):
+        """
+        初始化模拟客户端
+
+        Args:
+            base_url (str): 服务地址，例如http://127.0.0.1:3456
+            token (str): 机器人Token，与服务端一致
+            encoding_aes_key (str): 机器人EncodingAESKey，与服务端一致
+            poll_interval (float): 轮询间隔(秒)
+            timeout (float): 单个问题的最长等待时间(秒)
+        """
+        self.url = f"{base_url}/wechat/callback/chatBot"
+        # 机器人回调的receiveid为空
+        self.crypt = WXBizJsonMsgCrypt(token, encoding_aes_key, "")
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def _post(self, message):
+        nonce = str(random.randint(100000, 999999))
+        timestamp = str(int(time.time()))
+        ret, encrypted = self.crypt.EncryptMsg(json.dumps(message, ensure_ascii=False), nonce, timestamp)
+        if ret != 0:
+            raise RuntimeError(f"加密失败: {ret}")
+        encrypted = json.loads(encrypted)
+        response = self.session.post(
+            self.url,
+            params={"msg_signature": encrypted["msgsignature"], "timestamp": timestamp, "nonce": nonce},
+            data=json.dumps({"encrypt": encrypted["encrypt"]}),
+            timeout=30
+        )
+        response.raise_for_status()
+        return self._decrypt_reply(response.text)
+
+    def _decrypt_reply(self, body):
+        try:
+            reply = json.loads(body)
+        except ValueError:
+            return None
+        if "encrypt" not in reply:
+            return None
+        ret, plain = self.crypt.DecryptMsg(body, reply["msgsignature"], reply["timestamp"], reply["nonce"])
+        if ret != 0:
+            raise RuntimeError(f"解密回复失败: {ret}")
+        return json.loads(plain)
+
+    def ask(self, content, from_user="loadtest_user", chatid="loadtest_chat"):
+        """
+        发送文本消息并轮询直到回答结束
+
+        Args:
+            content (str): 问题内容
+            from_user (str): 发送者userid
+            chatid (str): 会话id
+
+        Returns:
+            dict: 统计信息，包含first_chunk(首个非思考内容的耗时)/total/polls/length/finished
+        """
+        start_time = time.perf_counter()
+        reply = self._post({
+            "msgid": uuid.uuid4().hex,
+            "aibotid": "loadtest_bot",
+            "chatid": chatid,
+            "chattype": "group",
+            "from": {"userid": from_user},
+            "msgtype": "text",
+            "text": {"content": f"@米小度 {content}"}
+        })
+        stream_id = reply["stream"]["id"]
+        stats = {"first_chunk": None, "total": None, "polls": 0, "length": 0, "finished": False}
+        while time.perf_counter() - start_time < self.timeout:
+            time.sleep(self.poll_interval)
+            reply = self._post({
+                "msgid": uuid.uuid4().hex,
+                "aibotid": "loadtest_bot",
+                "chatid": chatid,
+                "chattype": "group",
+                "from": {"userid": from_user},
+                "msgtype": "stream",
+                "stream": {"id": stream_id}
+            })
+            stats["polls"] += 1
+            if reply is None:
+                continue
+            stream = reply.get("stream", {})
+            stream_content = stream.get("content", "")
+            if stats["first_chunk"] is None and stream_content and not stream_content.startswith(THINKING_PREFIX):
+                stats["first_chunk"] = time.perf_counter() - start_time
+            if stream.get("finish"):
+                stats["total"] = time.perf_counter() - start_time
+                stats["length"] = len(stream_content)
+                stats["finished"] = True
+                break
+        return stats
@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+压测用的服务入口
+只启动Flask应用(机器人回调与/metrics)，不启动会话存档子进程与定时任务
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src"))
+from run import app
+
+if __name__ == "__main__":
+    app.run(debug=False, host="127.0.0.1", port=int(os.getenv("port", 3456)), threaded=True)
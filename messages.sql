@@ -24,4 +24,43 @@ COMMENT ON COLUMN wecom_messages.roomid IS '群聊消息的群id。如果是单
 COMMENT ON COLUMN wecom_messages.chat_name IS '群聊名称，单聊则为用户名';
 COMMENT ON COLUMN wecom_messages.msgtime IS '消息发送时间戳，utc时间，ms单位';
 COMMENT ON COLUMN wecom_messages.msgtype IS '消息类型';
-COMMENT ON COLUMN wecom_messages.content IS '消息内容，json格式';
\ No newline at end of file
+COMMENT ON COLUMN wecom_messages.content IS '消息内容，json格式';
+
+CREATE TABLE wecom_summary_checkpoints(
+    chat_key varchar(255) NOT NULL,
+    key_type varchar(20) NOT NULL,
+    summary text NOT NULL,
+    first_msgtime bigint NOT NULL,
+    last_msgtime bigint NOT NULL,
+    updated_at timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (chat_key, key_type)
+);
+COMMENT ON TABLE wecom_summary_checkpoints IS '群聊总结检查点表，存储每个群聊的滚动总结，新的汇总请求只总结检查点之后的消息';
+COMMENT ON COLUMN wecom_summary_checkpoints.chat_key IS '群聊id或群聊名称';
+COMMENT ON COLUMN wecom_summary_checkpoints.key_type IS '检查点键类型，roomid(群聊id)/chat_name(群聊名称)';
+COMMENT ON COLUMN wecom_summary_checkpoints.summary IS '截至last_msgtime的总结内容';
+COMMENT ON COLUMN wecom_summary_checkpoints.first_msgtime IS '总结覆盖的第一条消息时间戳，utc时间，ms单位';
+COMMENT ON COLUMN wecom_summary_checkpoints.last_msgtime IS '总结覆盖的最后一条消息时间戳，utc时间，ms单位';
+COMMENT ON COLUMN wecom_summary_checkpoints.updated_at IS '检查点更新时间';
+
+CREATE TABLE wecom_answer_cache(
+    query_key char(40) NOT NULL,
+    kb_version varchar(50) NOT NULL,
+    query text NOT NULL,
+    answer text NOT NULL,
+    hits integer NOT NULL DEFAULT 0,
+    created_at timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_hit_at timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    expires_at timestamp NOT NULL,
+    PRIMARY KEY (query_key, kb_version)
+);
+CREATE INDEX idx_wecom_answer_cache_last_hit_at ON wecom_answer_cache USING btree (last_hit_at);
+COMMENT ON TABLE wecom_answer_cache IS '知识库问答缓存表，按归一化问题与知识库版本缓存回答';
+COMMENT ON COLUMN wecom_answer_cache.query_key IS '归一化问题的sha1';
+COMMENT ON COLUMN wecom_answer_cache.kb_version IS '知识库版本';
+COMMENT ON COLUMN wecom_answer_cache.query IS '归一化后的问题';
+COMMENT ON COLUMN wecom_answer_cache.answer IS '缓存的完整回答';
+COMMENT ON COLUMN wecom_answer_cache.hits IS '命中次数';
+COMMENT ON COLUMN wecom_answer_cache.created_at IS '回答生成时间';
+COMMENT ON COLUMN wecom_answer_cache.last_hit_at IS '最近命中时间，超出数量上限时按此淘汰';
+COMMENT ON COLUMN wecom_answer_cache.expires_at IS '过期时间';
@@ -1,38 +1,59 @@
 import requests
-import json
 import os
+import re
 import time
-import sqlalchemy
 from datetime import datetime
-from logging import handlers, getLogger,Formatter,INFO
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy import text
 from dotenv import load_dotenv
+from utils.cache_utils import TTLCache
+from utils.logger import logger
+from utils.db import get_engine
+from utils.env_utils import env_flag
+from utils.single_flight import SingleFlight, normalize_query
+from utils.answer_cache import create_answer_cache
+from utils.dify_client import DifyClient, parse_endpoints
+from utils.job_scheduler import llm_scheduler, PRIORITY_SUMMARY
+from utils.metrics import registry, DIFY_FIRST_TOKEN_SECONDS, DIFY_CHUNKS_PER_SECOND, DIFY_RESPONSE_SECONDS, DIFY_COALESCED_REQUESTS, ANSWER_CACHE_HITS
 
 load_dotenv()
-# 配置日志记录到文件
-logger = getLogger('WeComBot')
-logger.setLevel(INFO)
-for handler in logger.handlers[:]:
-    logger.removeHandler(handler)
-
-# 获取项目根目录
-project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-# 使用相对路径
-log_file_path = os.path.join(project_root, 'log/WeComBot.log')
-log_dir = os.path.dirname(log_file_path)
-os.makedirs(log_dir, exist_ok=True)
-
-handler = handlers.RotatingFileHandler(
-    filename=log_file_path,
-    maxBytes=1024*1024*20,  # 最多存储20MB日志
-    backupCount=5,
-    encoding='utf-8'
+
+# 汇总时并发查询发送者名称的线程数，查询失败的名称只缓存较短时间(秒)
+SENDER_LOOKUP_WORKERS = int(os.getenv('sender_lookup_workers', 8))
+SENDER_NAME_FAILURE_TTL = int(os.getenv('sender_name_failure_ttl', 300))
+
+# 汇总时各消息类型在content(jsonb)中的文本投影，在数据库侧提取纯文本，其余类型不参与汇总
+SUMMARY_TEXT_PROJECTIONS = {
+    "text": "content->'text'->>'content'",
+    "markdown": "content->'info'->>'content'",
+    "link": "concat_ws(' ', content->'link'->>'title', content->'link'->>'description')",
+    "weapp": "concat_ws(' ', content->'weapp'->>'title', content->'weapp'->>'description')",
+    "location": "concat_ws(' ', content->'location'->>'title', content->'location'->>'address')",
+}
+
+# 追问的特征: 以"追问"等词开头，或指代上文内容；只有追问才复用Dify会话，其余问题走问答缓存与合并查询
+FOLLOW_UP_PATTERN = re.compile(
+    r'^\s*(追问|继续|接着|还有|另外|那么?|然后|如果是)'
+    r'|这个|那个|这些|那些|上面|上述|刚才|刚刚|之前|前面|你说的|第[一二三四五六七八九十\d]+(步|点|条|项|个)'
+    r'|呢[？?]?\s*$'
 )
 
-# 设置日志格式
-formatter = Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-handler.setFormatter(formatter)
-logger.addHandler(handler)
+def is_follow_up(query):
+    """
+    判断问题是否为依赖上文的追问
+
+    Args:
+        query (str): 用户问题
+
+    Returns:
+        bool: 是否为追问
+    """
+    return bool(FOLLOW_UP_PATTERN.search(query or ""))
+
+def _summary_text_sql():
+    """根据SUMMARY_TEXT_PROJECTIONS生成按msgtype提取文本的CASE表达式"""
+    cases = " ".join(f"WHEN '{msgtype}' THEN {expr}" for msgtype, expr in SUMMARY_TEXT_PROJECTIONS.items())
+    return f"CASE msgtype {cases} END"
 
 class Wecom_Bot:
     def __init__(self, api_key="",base_url= os.getenv('dify_url'),db_url=os.getenv('db_url')):
@@ -40,14 +61,83 @@ class Wecom_Bot:
         初始化企业微信机器人
         
         Args:
-            api_key (str): dify服务的API密钥
+            api_key (str): dify服务的API密钥，多个节点时逗号分隔
+            base_url (str): dify服务地址，多个节点时逗号分隔
         """
         self.api_key = api_key
         self.base_url = base_url
+        # dify_url/dify_key可配置逗号分隔的多个节点
+        self.dify = DifyClient(
+            parse_endpoints(base_url, api_key),
+            failure_threshold=int(os.getenv('dify_failure_threshold', 3)),
+            cooldown=float(os.getenv('dify_cooldown', 30)),
+            hedge_after=float(os.getenv('dify_hedge_after', 0)),
+            read_timeout=float(os.getenv('dify_read_timeout', 120))
+        )
         self.db_url = db_url
-        self.sql_db = sqlalchemy.create_engine(self.db_url)
+        # 发送者id到显示名称的缓存
+        self.sender_names = TTLCache(maxsize=5000, ttl=24 * 60 * 60)
+        self._access_token = TTLCache(maxsize=1, ttl=7000)
+        # 相同问题的并发查询合并为一次Dify调用
+        self.rag_flights = SingleFlight()
+        self.single_flight = env_flag('rag_single_flight', '1')
+        # 高频知识库问题的回答缓存，answer_cache_ttl为0时为None
+        self.answer_cache = create_answer_cache(lambda: self.sql_db)
+        # (chatid, userid)到Dify会话id的缓存，只有追问才复用，空闲超过conversation_ttl后开始新会话
+        conversation_ttl = int(os.getenv('conversation_ttl', 5 * 60))
+        self.conversations = TTLCache(
+            maxsize=int(os.getenv('conversation_cache_size', 4096)), ttl=conversation_ttl, refresh_on_get=True
+        ) if conversation_ttl > 0 else None
     
-    def Rag_Query(self, query,stream, stream_id="",debug=False,full_response = [],user_id=""):
+    @property
+    def sql_db(self):
+        """共享的数据库引擎，首次使用时创建"""
+        return get_engine(self.db_url)
+
+    def _stream_chat(self, payload, stream, stream_id, full_response, user_id="", debug=False, on_message_end=None):
+        """
+        调用Dify聊天流接口，逐块回调流式输出
+
+        Args:
+            payload (dict): 请求体
+            stream (callable): 流式输出回调函数，接收每个chunk的内容
+            stream_id (str): 流式输出ID
+            full_response (list): 用于存储响应内容的列表
+            user_id (str): 用户id
+            on_message_end (callable, optional): 收到message_end事件时以事件内容调用
+
+        Returns:
+            str: 拼接后的完整回答
+        """
+        start_time = time.perf_counter()
+        first_token_time = None
+        chunk_count = 0
+        for json_chunk in self.dify.stream_events(payload, user_id=user_id):
+            if debug:
+                logger.info("Raw chunk: %s", json_chunk)
+            try:
+                if json_chunk.get('event') == 'message':
+                    chunk_str = json_chunk.get('answer', '')
+                    if chunk_str:
+                        if first_token_time is None:
+                            first_token_time = time.perf_counter()
+                            DIFY_FIRST_TOKEN_SECONDS.observe(first_token_time - start_time)
+                        chunk_count += 1
+                        # 将内容添加到完整响应中
+                        full_response.append(chunk_str)
+                        stream(stream_id,chunk_str)
+                elif json_chunk.get('event') == 'message_end' and on_message_end:
+                    on_message_end(json_chunk)
+            except Exception as e:
+                if debug:
+                    logger.error(f"Error processing chunk: {e}")
+        end_time = time.perf_counter()
+        DIFY_RESPONSE_SECONDS.observe(end_time - start_time)
+        if chunk_count > 1 and end_time > first_token_time:
+            DIFY_CHUNKS_PER_SECOND.observe((chunk_count - 1) / (end_time - first_token_time))
+        return ''.join(full_response)
+
+    def Rag_Query(self, query,stream, stream_id="",debug=False,full_response = [],user_id="",chat_id=""):
         """
         处理用户查询传给Dify服务生成回答 - 支持流式输出
         
@@ -57,66 +147,264 @@ class Wecom_Bot:
             stream (callable, optional): 流式输出回调函数，接收每个chunk的内容
             stream_id (str): 流式输出ID，用于标识不同的流式输出请求
             full_response (list): 用于存储响应内容的列表
+            user_id (str): 用户id
+            chat_id (str): 会话id，与user_id一起确定复用的Dify会话
             
         Returns:
             str: 生成的完整回答
         """
+        conversation_key = (chat_id, user_id)
+        if self.conversations is not None:
+            if is_follow_up(query):
+                conversation_id = self.conversations.get(conversation_key)
+                if conversation_id:
+                    # 追问依赖会话上下文，不使用问答缓存，也不与其他用户的相同问题合并
+                    return self._rag_query(query, stream, stream_id, debug, full_response, user_id, conversation_key, conversation_id)
+            else:
+                # 不依赖上文的新问题开始新会话，可以命中问答缓存或与相同问题合并
+                self.conversations.pop(conversation_key)
+        if self.answer_cache is not None:
+            cached = self.answer_cache.get(query)
+            if cached is not None:
+                # 命中缓存时一次性输出完整回答，不再调用Dify
+                ANSWER_CACHE_HITS.inc()
+                logger.info("问答缓存命中: 响应长度=%d", len(cached))
+                full_response.append(cached)
+                stream(stream_id, cached)
+                return cached
+        if not self.single_flight:
+            return self._rag_query(query, stream, stream_id, debug, full_response, user_id, conversation_key)
+        # 归一化后相同的并发问题共享一次生成，输出分发给每个stream_id
+        return self.rag_flights.run(
+            ("RAG", normalize_query(query)), stream, stream_id,
+            lambda emit: self._rag_query(query, emit, stream_id, debug, full_response, user_id, conversation_key),
+            on_join=DIFY_COALESCED_REQUESTS.inc
+        )
+
+    def join_rag_query(self, query, stream, stream_id, user_id="", chat_id=""):
+        """
+        加入其他用户正在进行的相同问题，不单独调用Dify
+        调用时立即完成订阅，返回的函数可以在其他线程中等待回答，不需要经过大模型任务调度器
+
+        Args:
+            query (str): 用户查询的问题
+            stream (callable): 流式输出回调函数
+            stream_id (str): 流式输出ID
+            user_id (str): 用户id
+            chat_id (str): 会话id
+
+        Returns:
+            callable: 无参数，等待并返回完整回答；需要单独调用Dify时返回None
+        """
+        if not self.single_flight:
+            return None
+        conversation_key = (chat_id, user_id)
+        if self.conversations is not None and is_follow_up(query) and self.conversations.get(conversation_key):
+            # 追问依赖会话上下文，由Rag_Query单独调用Dify
+            return None
+        wait = self.rag_flights.join(("RAG", normalize_query(query)), stream, stream_id, on_join=DIFY_COALESCED_REQUESTS.inc)
+        if wait is not None and self.conversations is not None:
+            # 与Rag_Query一致，不依赖上文的新问题开始新会话
+            self.conversations.pop(conversation_key)
+        return wait
+
+    def _rag_query(self, query, stream, stream_id, debug, full_response, user_id, conversation_key=None, conversation_id=""):
+        """
+        调用Dify生成RAG回答，其余参数同Rag_Query
+
+        Args:
+            conversation_key (tuple, optional): (chatid, userid)，用于记录本次回答所在的Dify会话
+            conversation_id (str): 复用的Dify会话id，为空时开始新会话
+        """
         data_template = {
             "inputs": {
                 "intention": "RAG"
             },
             "query": query,
             "response_mode": "streaming",
-            "conversation_id": "",
+            "conversation_id": conversation_id,
             "user": user_id
         }
+
+        def remember_conversation(event):
+            if self.conversations is not None and conversation_key is not None and event.get('conversation_id'):
+                self.conversations.set(conversation_key, event['conversation_id'])
+
         try:
             start_time = time.time()
-            response = requests.post(
-                f"{self.base_url}/chat-messages?user={user_id}",
-                headers={
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json"
-                },
-                json=data_template,
-                stream=True
-            )
-            if response.status_code == 200:
-                for chunk in response.iter_lines():
-                    if chunk:
-                        try:
-                            chunk = chunk.decode('utf-8')
-                            if chunk.startswith("data: "):
-                                chunk = chunk.replace("data: ", "")
-                            if debug:
-                                logger.info(f"Raw chunk: {chunk}")
-
-                            json_chunk = json.loads(chunk)
-                            if json_chunk.get('event') == 'message':
-                                chunk_str = json_chunk.get('answer', '')
-                                if chunk_str:
-                                    # 将内容添加到完整响应中
-                                    full_response.append(chunk_str)
-                                    stream(stream_id,chunk_str)
-                        except json.JSONDecodeError as e:
-                            if debug:
-                                logger.error(f"JSON decode error: {e}, chunk: {chunk}")
-                        except Exception as e:
-                            if debug:
-                                logger.error(f"Error processing chunk: {e}")
-                full_response_str = ''.join(full_response)
-                logger.info(f"回答结束: 响应长度={len(full_response_str)}, 耗时: {(time.time() - start_time):.2f}秒")
-            return full_response_str
+            try:
+                full_response_str = self._stream_chat(data_template, stream, stream_id, full_response, user_id=user_id,
+                                                      debug=debug, on_message_end=remember_conversation)
+            except Exception as e:
+                if not conversation_id or full_response:
+                    raise
+                # 会话可能已在Dify侧过期或被删除，丢弃后开始新会话重试一次
+                logger.warning(f"复用Dify会话失败，开始新会话: {str(e)}")
+                self.conversations.pop(conversation_key)
+                data_template["conversation_id"] = conversation_id = ""
+                full_response_str = self._stream_chat(data_template, stream, stream_id, full_response, user_id=user_id,
+                                                      debug=debug, on_message_end=remember_conversation)
+            logger.info("回答结束: 响应长度=%d, 耗时: %.2f秒", len(full_response_str), time.time() - start_time)
         except Exception as e:
             logger.error(f"查询工作流调用错误: {str(e)}")
             # 发生错误时返回默认消息
             error_message = "查询工作流调用错误"  
             stream(stream_id, error_message)
             return error_message
-        
+        # 只缓存不依赖会话上下文、成功生成的回答
+        if self.answer_cache is not None and full_response_str and not conversation_id:
+            self.answer_cache.set(query, full_response_str)
+        return full_response_str
+
+    def _load_summary_checkpoint(self, chat_key, key_type):
+        """
+        读取群聊总结检查点
+
+        Args:
+            chat_key (str): 群聊id或群聊名称
+            key_type (str): roomid/chat_name
+
+        Returns:
+            dict: 检查点信息，不存在时返回None
+        """
+        try:
+            with self.sql_db.connect() as con:
+                row = con.execute(
+                    text("SELECT summary, first_msgtime, last_msgtime FROM wecom_summary_checkpoints "
+                         "WHERE chat_key = :chat_key AND key_type = :key_type"),
+                    {"chat_key": chat_key, "key_type": key_type}
+                ).fetchone()
+            if row is None:
+                return None
+            return {"summary": row[0], "first_msgtime": row[1], "last_msgtime": row[2]}
+        except Exception as e:
+            logger.error(f"读取总结检查点失败: {str(e)}")
+            return None
+
+    def _save_summary_checkpoint(self, chat_key, key_type, summary, first_msgtime, last_msgtime):
+        """
+        保存群聊总结检查点，记录总结内容及其覆盖到的最后一条消息时间
+
+        Args:
+            chat_key (str): 群聊id或群聊名称
+            key_type (str): roomid/chat_name
+            summary (str): 总结内容
+            first_msgtime (int): 总结覆盖的第一条消息时间戳
+            last_msgtime (int): 总结覆盖的最后一条消息时间戳
+        """
+        try:
+            with self.sql_db.begin() as con:
+                con.execute(
+                    text("INSERT INTO wecom_summary_checkpoints (chat_key, key_type, summary, first_msgtime, last_msgtime, updated_at) "
+                         "VALUES (:chat_key, :key_type, :summary, :first_msgtime, :last_msgtime, CURRENT_TIMESTAMP) "
+                         "ON CONFLICT (chat_key, key_type) DO UPDATE SET summary = EXCLUDED.summary, "
+                         "first_msgtime = EXCLUDED.first_msgtime, last_msgtime = EXCLUDED.last_msgtime, updated_at = EXCLUDED.updated_at"),
+                    {
+                        "chat_key": chat_key,
+                        "key_type": key_type,
+                        "summary": summary,
+                        "first_msgtime": first_msgtime,
+                        "last_msgtime": last_msgtime
+                    }
+                )
+        except Exception as e:
+            logger.error(f"保存总结检查点失败: {str(e)}")
+
+    def _get_access_token(self):
+        """
+        获取企微后台接口的access_token，有效期内复用
+
+        Returns:
+            str: 企业微信的access_token，失败时返回None
+        """
+        access_token = self._access_token.get("token")
+        if access_token:
+            return access_token
+        try:
+            corp_id = os.getenv('corpid', '')
+            corp_secret = os.getenv('contact_secret') or os.getenv('secret', '')
+            response = requests.get(
+                f"https://qyapi.weixin.qq.com/cgi-bin/gettoken?corpid={corp_id}&corpsecret={corp_secret}",
+                timeout=5
+            )
+            response.raise_for_status()
+            access_token = response.json().get("access_token")
+            if access_token:
+                self._access_token.set("token", access_token)
+            return access_token
+        except requests.RequestException as e:
+            logger.error(f"获取access_token时出错: {e}")
+            return None
+
+    def _lookup_sender_name(self, userid, access_token):
+        """
+        调用企业微信接口查询发送者名称
+
+        Args:
+            userid (str): 企业成员userid或外部联系人external_userid
+            access_token (str): 企业微信access_token
+
+        Returns:
+            str: 显示名称，查询失败时返回None
+        """
+        try:
+            # 外部联系人id以wo/wm开头
+            if userid.startswith(("wo", "wm")):
+                response = requests.get(
+                    f"https://qyapi.weixin.qq.com/cgi-bin/externalcontact/get?access_token={access_token}&external_userid={userid}",
+                    timeout=5
+                )
+                return response.json().get("external_contact", {}).get("name")
+            response = requests.get(
+                f"https://qyapi.weixin.qq.com/cgi-bin/user/get?access_token={access_token}&userid={userid}",
+                timeout=5
+            )
+            return response.json().get("name")
+        except Exception as e:
+            logger.error(f"获取发送者名称时出错: {e}")
+            return None
+
+    def _get_sender_names(self, userids):
+        """
+        批量获取消息发送者的显示名称，未缓存的发送者并发查询，查询失败时使用userid
+
+        Args:
+            userids (iterable): 企业成员userid或外部联系人external_userid
+
+        Returns:
+            dict: userid到显示名称的映射
+        """
+        names = {}
+        missing = []
+        for userid in dict.fromkeys(userids):
+            name = self.sender_names.get(userid)
+            if name:
+                names[userid] = name
+            else:
+                missing.append(userid)
+        if not missing:
+            return names
+        access_token = self._get_access_token()
+        if access_token:
+            with ThreadPoolExecutor(max_workers=min(len(missing), SENDER_LOOKUP_WORKERS), thread_name_prefix="sender_name") as executor:
+                resolved = dict(zip(missing, executor.map(lambda userid: self._lookup_sender_name(userid, access_token), missing)))
+        else:
+            resolved = {}
+        for userid in missing:
+            name = resolved.get(userid)
+            if name:
+                self.sender_names.set(userid, name)
+            else:
+                # 查询失败短时间缓存，避免同一发送者重复请求，也不会长时间只显示userid
+                name = userid
+                self.sender_names.set(userid, name, ttl=SENDER_NAME_FAILURE_TTL)
+            names[userid] = name
+        return names
+
     def SummarizeChat(self,chat_name,stream,stream_id,full_response = [],useid = False,user_id="",debug=False):
         """
         对某一聊天群的对话内容进行总结，提取关键信息。
+        已有总结检查点时，只总结检查点之后的新消息并与已有总结合并。
         
         Args:
             chat_name (str): 聊天群名称,单聊则为用户id
@@ -129,35 +417,49 @@ class Wecom_Bot:
         Returns:
             str: 生成的总结内容
         """
-        #查表获取会话内容
-        if useid: # 传进来的是群聊id
-            if debug:
-                logger.info(f"传入群聊id:{chat_name}")
-            with self.sql_db.connect() as con:
-                records = con.execute(
-                    text("SELECT content,msgtime FROM wecom_messages WHERE roomid = :chat_name"),
-                    {"chat_name": chat_name}
-                ).fetchall()
+        # 传进来的是群聊id或群聊名称
+        key_type = "roomid" if useid else "chat_name"
+        if debug:
+            logger.info(f"传入{key_type}:{chat_name}")
+        checkpoint = self._load_summary_checkpoint(chat_name, key_type)
+        last_msgtime = checkpoint["last_msgtime"] if checkpoint else 0
 
-        if not useid: # 传进来的是群聊名称
-            if debug:
-                logger.info(f"传入群聊名称:{chat_name}")
-            with self.sql_db.connect() as con:
-                records = con.execute(
-                    text("SELECT content,msgtime FROM wecom_messages WHERE chat_name = :chat_name"),
-                    {"chat_name": chat_name}
-                ).fetchall()
+        #查表获取检查点之后的会话内容，只取可汇总的文本
+        msgtypes = ", ".join(f"'{msgtype}'" for msgtype in SUMMARY_TEXT_PROJECTIONS)
+        with self.sql_db.connect() as con:
+            records = con.execute(
+                text(f"SELECT msgtime, sender, message FROM ("
+                     f"SELECT msgtime, \"from\" AS sender, {_summary_text_sql()} AS message FROM wecom_messages "
+                     f"WHERE {key_type} = :chat_name AND msgtime > :last_msgtime AND action = 'send' AND msgtype IN ({msgtypes})"
+                     ") AS t WHERE message IS NOT NULL AND message <> '' ORDER BY msgtime"),
+                {"chat_name": chat_name, "last_msgtime": last_msgtime}
+            ).fetchall()
+
+        if not records and not checkpoint:
+            error_message = "暂无可汇总的聊天记录"
+            stream(stream_id, error_message)
+            return error_message
 
-        content_list = [item[0] for item in records]
-        timestamp_list = [item[1] for item in records]
+        first_msgtime = checkpoint["first_msgtime"] if checkpoint else records[0][0]
+        end_msgtime = records[-1][0] if records else last_msgtime
         # 转换时间格式
-        timestamp_list = [datetime.fromtimestamp(int(timestamp / 1000)).strftime("%Y-%m-%d %H:%M:%S") for timestamp in timestamp_list]
-        time_range = f"时间范围: {timestamp_list[0]} 至 {timestamp_list[-1]}\n"
+        start_str, end_str = [datetime.fromtimestamp(int(timestamp / 1000)).strftime("%Y-%m-%d %H:%M:%S") for timestamp in (first_msgtime, end_msgtime)]
+        time_range = f"时间范围: {start_str} 至 {end_str}\n"
         stream(stream_id,time_range)
-        message_count = 0
-        for i, message in enumerate(content_list):
-            message_prompt += f"聊天记录{i+1}\n{message}\n\n" 
-            message_count += 1
+
+        # 检查点之后没有新消息，直接返回已有总结
+        if not records:
+            logger.info(f"命中总结检查点: {key_type}={chat_name}")
+            stream(stream_id, checkpoint["summary"])
+            return f"{time_range}{checkpoint['summary']}"
+
+        message_prompt = ""
+        if checkpoint:
+            message_prompt += f"已有总结:\n{checkpoint['summary']}\n\n以下是已有总结之后的新增聊天记录，请将其与已有总结合并，输出更新后的完整总结。\n\n"
+        sender_names = self._get_sender_names(sender for _, sender, _ in records)
+        for msgtime, sender, message in records:
+            send_time = datetime.fromtimestamp(int(msgtime / 1000)).strftime("%m-%d %H:%M")
+            message_prompt += f"[{send_time}] {sender_names[sender]}: {message}\n"
         summary_template = {
             "inputs": {
                 "intention": "Summarize"
@@ -168,43 +470,14 @@ class Wecom_Bot:
             "user": user_id
         }
         # 调用模型生成总结
-        logger.info("群聊消息智能汇总中...")
+        logger.info(f"群聊消息智能汇总中... 新增消息数: {len(records)}, 增量合并: {checkpoint is not None}")
         try:
             start_time = time.time()
-            response = requests.post(
-                f"{self.base_url}/chat-messages?user={user_id}",
-                headers={
-                    "Authorization": f"Bearer {self.api_key}",
-                    "Content-Type": "application/json"
-                },
-                json=summary_template,
-                stream=True
-            )
-            # 处理流式响应
-            for chunk in response.iter_lines():
-                if chunk:
-                    try:
-                        chunk = chunk.decode('utf-8')
-                        if chunk.startswith("data: "):
-                            chunk = chunk.replace("data: ", "")
-                        if debug:
-                            logger.info(f"Raw chunk: {chunk}")
-
-                        json_chunk = json.loads(chunk)
-                        if json_chunk.get('event') == 'message':
-                            chunk_str = json_chunk.get('answer', '')
-                            if chunk_str:
-                                # 将内容添加到完整响应中
-                                full_response.append(chunk_str)
-                                stream(stream_id,chunk_str)
-                    except json.JSONDecodeError as e:
-                        if debug:
-                            logger.error(f"JSON decode error: {e}, chunk: {chunk}")
-                    except Exception as e:
-                        if debug:
-                            logger.error(f"Error processing chunk: {e}")
-            full_response_str = f"{time_range}{''.join(full_response).lstrip('\n')}"
-            logger.info(f"回答结束: 响应长度={len(full_response_str)}, 耗时: {(time.time() - start_time):.2f}秒")
+            summary = self._stream_chat(summary_template, stream, stream_id, full_response, user_id=user_id, debug=debug).lstrip('\n')
+            if summary:
+                self._save_summary_checkpoint(chat_name, key_type, summary, first_msgtime, end_msgtime)
+            full_response_str = f"{time_range}{summary}"
+            logger.info("回答结束: 响应长度=%d, 耗时: %.2f秒", len(full_response_str), time.time() - start_time)
             return full_response_str
         except Exception as e:
             logger.error(f"查询工作流调用错误: {str(e)}")
@@ -212,11 +485,41 @@ class Wecom_Bot:
             error_message = "查询工作流调用错误"  
             stream(stream_id, error_message)
             return error_message
+
+    def AdvanceSummaryCheckpoints(self, user_id="summary_schedule"):
+        """
+        推进所有已有的群聊总结检查点，供低峰期定时任务调用
+        每个群聊依次以汇总优先级提交到大模型任务调度器并等待完成，不与问答争抢Dify
+
+        Args:
+            user_id (str): 调用Dify时使用的用户id
+
+        Returns:
+            int: 推进的检查点数量
+        """
+        with self.sql_db.connect() as con:
+            checkpoints = con.execute(
+                text("SELECT c.chat_key, c.key_type FROM wecom_summary_checkpoints c WHERE EXISTS ("
+                     "SELECT 1 FROM wecom_messages m WHERE m.msgtime > c.last_msgtime AND "
+                     "((c.key_type = 'roomid' AND m.roomid = c.chat_key) OR (c.key_type = 'chat_name' AND m.chat_name = c.chat_key)))")
+            ).fetchall()
+        advanced_count = 0
+        for chat_key, key_type in checkpoints:
+            reject_reason = llm_scheduler.run(
+                lambda: self.SummarizeChat(chat_key, lambda *args: None, "", full_response=[], useid=(key_type == "roomid"), user_id=user_id),
+                PRIORITY_SUMMARY, user_id
+            )
+            if reject_reason:
+                logger.warning(f"推进总结检查点被拒绝: {chat_key}, {reject_reason}")
+                continue
+            advanced_count += 1
+        return advanced_count
         
 
 Bot = Wecom_Bot(
     api_key=os.getenv("dify_key")
     )      
+registry.gauge("dify_open_circuits", "处于熔断状态的Dify节点数", lambda: Bot.dify.open_circuits())
 # 示例用法
 if __name__ == "__main__":
     query = input("请输入查询内容: ")
@@ -15,7 +15,7 @@ from sqlalchemy import text
 from utils.WXBizJsonMsgCrypt import WXBizJsonMsgCrypt
 from utils.WXBizMsgCrypt import WXBizMsgCrypt
 from Crypto.Cipher import AES
-from chatBot import logger
+from utils.logger import logger
 
 # 导入环境配置
 from dotenv import load_dotenv
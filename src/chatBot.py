@@ -17,11 +17,19 @@ from utils.WXBizJsonMsgCrypt import WXBizJsonMsgCrypt
 
 # 导入自定义模块
 from WeCom_Bot import Bot,logger
-from utils.stream_utils import MakeMixedStream,MakeTextStream,EncryptMessage, stream_manager
+from utils.stream_utils import MakeTextStream,EncryptMessage, stream_manager, ChunkCoalescer
+from utils.cache_utils import TTLCache
+from utils.job_scheduler import llm_scheduler, PRIORITY_QA, PRIORITY_SUMMARY
+from utils.metrics import CALLBACK_DECRYPT_SECONDS, CALLBACK_PARSE_SECONDS, STREAM_CREATE_SECONDS, DUPLICATE_MESSAGES
 from dotenv import load_dotenv
 
 load_dotenv()
 
+THINKING_MESSAGE = "米小度正在思考中,请稍候..."
+QUEUED_MESSAGE = "米小度正在思考中,前面还有{position}个问题在排队,请稍候..."
+# 已处理的文本消息msgid -> stream_id，企业微信超时重试同一msgid时返回原流式任务
+recent_msgids = TTLCache(maxsize=int(os.getenv('msgid_cache_size', 4096)), ttl=int(os.getenv('msgid_ttl', 600)))
+
 # 辅助函数定义
 def get_json_wechat_crypt(if_bot = False):
     """获取企业微信加密工具实例"""
@@ -71,14 +79,16 @@ def chatBot_callback():
                 logger.error("加密工具未初始化")
                 return 'Encryption tool not initialized', 500
             
-            ret, decrypted_msg = bot_wxcrypt.DecryptMsg(encrypt_msg, msg_signature, timestamp, nonce)
+            with CALLBACK_DECRYPT_SECONDS.time():
+                ret, decrypted_msg = bot_wxcrypt.DecryptMsg(encrypt_msg, msg_signature, timestamp, nonce)
             if ret != 0:
                 logger.error(f"消息解密失败，错误码: {ret}")
                 return 'Decryption failed', 400
             
             # logger.info(f"解密后的消息: {decrypted_msg}")
             
-            message_info = parse_message(decrypted_msg)
+            with CALLBACK_PARSE_SECONDS.time():
+                message_info = parse_message(decrypted_msg)
             if not message_info:
                 logger.error("消息解析失败")
                 return 'Parse failed', 400
@@ -94,18 +104,33 @@ def chatBot_callback():
                 content = message_info['content']
                 # logger.info(f"收到文本消息: {content}")
 
-                # 生成stream_id
+                # 生成stream_id，同一msgid的重试复用已创建的流式任务
+                msg_id = message_info.get('msg_id', '')
                 stream_id = str(uuid.uuid4())
+                if msg_id:
+                    stream_id, created = recent_msgids.setdefault(msg_id, stream_id)
+                    if not created:
+                        DUPLICATE_MESSAGES.inc()
+                        logger.info("收到重复消息，返回原流式任务: msgid=%s, stream_id=%s", msg_id, stream_id)
+                        stream = MakeTextStream(stream_id, THINKING_MESSAGE, finish=False)
+                        resp = EncryptMessage(bot_wxcrypt,nonce, timestamp, stream)
+                        if resp:
+                            return Response(response=resp, mimetype="text/plain")
+                        else:
+                            return 'Encryption failed', 500
                 # 存储完整响应
                 full_res = []
                 # 创建流式任务（立即启动独立线程处理）
-                stream_success = stream_manager.create_stream(
-                    stream_id, content, from_user, 
-                    msgid=message_info.get('msg_id', ''), 
-                    chatid=chatid,
-                    accumulated_content=full_res
-                )
+                with STREAM_CREATE_SECONDS.time():
+                    stream_success = stream_manager.create_stream(
+                        stream_id, content, from_user, 
+                        msgid=msg_id, 
+                        chatid=chatid,
+                        accumulated_content=full_res
+                    )
                 if not stream_success:
+                    # 创建失败时允许重试重新创建
+                    recent_msgids.pop(msg_id)
                     error_message = "创建思考任务失败"
                     stream = MakeTextStream(stream_id, error_message, finish=True)
                     resp = EncryptMessage(bot_wxcrypt,nonce, timestamp, stream)
@@ -113,10 +138,14 @@ def chatBot_callback():
                         return Response(response=resp, mimetype="text/plain")
                     else:
                         return 'Encryption failed', 500
+                # 排队位置与拒绝原因，大模型任务交给调度器执行
+                position, reject_reason = 0, None
                 # 这是汇总消息功能
                 if content.startswith("汇总消息") and stream_success:
                 # 两种情况：1. 汇总消息（默认本群） 2. 汇总消息：群聊名  
                     def process_chat_summary():
+                        # 合并逐token的输出，按时间或字符数批量写入流
+                        coalescer = ChunkCoalescer()
                         try:
                             # 确定要汇总的群聊
                             match = re.match(r'^汇总消息[：:]\s*(.*)', content)
@@ -126,15 +155,16 @@ def chatBot_callback():
                             else:
                                 chatname = chatid
                                 useid = True
-                            response = Bot.SummarizeChat(chatname, stream_manager.add_stream_chunk, stream_id, 
+                            response = Bot.SummarizeChat(chatname, coalescer, stream_id, 
                                                         full_response=full_res, useid=useid,user_id=from_user)
+                            coalescer.flush()
                             stream_manager.update_stream_message(stream_id, response)
-                            stream_manager.add_stream_chunk(stream_id, "", True)
+                            coalescer(stream_id, "", True)
                         except Exception as e:
                             logger.error(f"大模型生成时出错: {str(e)}")
                             error_msg = "处理您的请求时出错，请稍后重试。"
-                            stream_manager.add_stream_chunk(stream_id, error_msg, True)
-                    threading.Thread(target=process_chat_summary, daemon=True).start()
+                            coalescer(stream_id, error_msg, True)
+                    position, reject_reason = llm_scheduler.submit(process_chat_summary, PRIORITY_SUMMARY, from_user, chatid, job_key=stream_id)
                 # 这是查询功能
                 else:
                     if stream_success:
@@ -149,22 +179,38 @@ def chatBot_callback():
                             '''
                             stream_manager.add_stream_chunk(stream_id, welcom_str, True)
                         else:    
+                            # 合并逐token的输出，按时间或字符数批量写入流
+                            coalescer = ChunkCoalescer()
+                            # 其他用户正在问相同的问题时直接订阅其输出，不调用Dify，也不占用调度器的并发与配额
+                            wait_shared = Bot.join_rag_query(content, coalescer, stream_id, user_id=from_user, chat_id=chatid)
                             def process_model_query():
                                 try:
-                                    # 调用Bot的Rag_Query进行查询
-                                    response = Bot.Rag_Query(content,stream_manager.add_stream_chunk,stream_id,full_response=full_res,user_id=from_user)
+                                    if wait_shared is not None:
+                                        response = wait_shared()
+                                    else:
+                                        # 调用Bot的Rag_Query进行查询
+                                        response = Bot.Rag_Query(content,coalescer,stream_id,full_response=full_res,user_id=from_user,chat_id=chatid)
                                     
                                     # 更新完整消息
+                                    coalescer.flush()
                                     stream_manager.update_stream_message(stream_id, response)
-                                    stream_manager.add_stream_chunk(stream_id, "", True)
+                                    coalescer(stream_id, "", True)
                                 except Exception as e:
                                     logger.error(f"大模型生成时出错: {str(e)}")
                                     error_msg = "处理您的请求时出错，请稍后重试。"
-                                    stream_manager.add_stream_chunk(stream_id, error_msg, True)
-                            threading.Thread(target=process_model_query, daemon=True).start()
+                                    coalescer(stream_id, error_msg, True)
+                            if wait_shared is not None:
+                                threading.Thread(target=process_model_query, daemon=True, name="llm_shared").start()
+                            else:
+                                position, reject_reason = llm_scheduler.submit(process_model_query, PRIORITY_QA, from_user, chatid, job_key=stream_id)
 
-                thinking_message = "米小度正在思考中,请稍候..."
-                stream = MakeTextStream(stream_id, thinking_message, finish=False)
+                if reject_reason:
+                    stream_manager.add_stream_chunk(stream_id, reject_reason, True)
+                    stream = MakeTextStream(stream_id, reject_reason, finish=True)
+                elif position:
+                    stream = MakeTextStream(stream_id, QUEUED_MESSAGE.format(position=position), finish=False)
+                else:
+                    stream = MakeTextStream(stream_id, THINKING_MESSAGE, finish=False)
                 resp = EncryptMessage(bot_wxcrypt,nonce, timestamp, stream)
                 if resp:
                     return Response(response=resp, mimetype="text/plain")
@@ -215,25 +261,29 @@ def chatBot_callback():
                         logger.error(f"重复请求检测失败: {e}")
                     try:
                         # 流式推送
-                        response_stream_id, content, is_finished = stream_manager.get_next_unread_message(stream_id)
+                        response_stream_id, content, is_finished, version = stream_manager.get_next_unread(stream_id)
                         if response_stream_id is None:
                             # 流式任务不存在，使用更低级别日志而非警告
-                            logger.debug(f"流式任务不存在: {stream_id}")
+                            logger.debug("流式任务不存在: %s", stream_id)
                             return Response(response="success", mimetype="text/plain")
-                        # 当内容存在，任务未完成时，生成流式文本消息
-                        if not is_finished:
-                            stream = MakeTextStream(stream_id, content, finish=is_finished)
-                            # logger.info(f"生成流式消息: {stream[:100]}..." if isinstance(stream, str) else f"生成流式消息对象")
-                        # 当内容存在，且任务完成时，生成图文混合消息
-                        if is_finished:
-                            full_content = stream_manager.get_full_content(stream_id)
-                            stream = MakeMixedStream(stream_id, full_content, finish=is_finished)
+                        def make_stream():
+                            # 当内容存在，任务未完成时，生成流式文本消息
+                            if not is_finished:
+                                if not content:
+                                    # 还没有输出时按调度器中当前的排队位置提示，排到后显示思考中
+                                    position = llm_scheduler.position(stream_id)
+                                    waiting = QUEUED_MESSAGE.format(position=position) if position else THINKING_MESSAGE
+                                    return MakeTextStream(stream_id, waiting, finish=False)
+                                return MakeTextStream(stream_id, content, finish=is_finished)
+                            # 当内容存在，且任务完成时，返回已构建的图文混合消息
+                            return stream_manager.get_final_payload(stream_id)
                         if wxcrypt_stream:
-                            ret, resp = wxcrypt_stream.EncryptMsg(stream, nonce, timestamp)
+                            # 内容版本未变化时复用已加密的消息体，只重新计算签名
+                            ret, resp = stream_manager.encrypt_reply(stream_id, version, is_finished, make_stream, wxcrypt_stream, nonce, timestamp)
                             if ret != 0:
                                 logger.error(f"加密失败，错误码: {ret}")
                                 # 加密失败时，直接返回原始流作为文本响应
-                                return Response(response=stream, mimetype="application/json")
+                                return Response(response=make_stream(), mimetype="application/json")
                             # logger.info(f"加密成功，返回企业微信标准格式响应")
                             # EncryptMsg返回的已经是一个完整的JSON字符串，直接返回
                             return Response(response=resp, mimetype="application/json")
@@ -1,13 +1,18 @@
 import os
-import subprocess
+import sys
 import signal
-from flask import Flask, Blueprint
+from flask import Flask, Blueprint, Response
 from chatBot import chatBot_callback
 from callback import wechat_callback
 from WeCom_Bot import Bot,logger
 from datetime import datetime
 from flask_apscheduler import APScheduler
 from sqlalchemy import text
+from utils.retention import purge_expired_messages, is_partitioned, DAY_MS
+from utils.partitions import ensure_future_partitions
+from utils.db import pool_metrics
+from utils.metrics import registry
+from utils.supervisor import ProcessSupervisor
 
 
 # 创建Flask应用实例
@@ -20,6 +25,14 @@ wechat.route('/callback', methods=['GET', 'POST'])(wechat_callback)
 wechat.route('/callback/chatBot', methods=['GET', 'POST'])(chatBot_callback)
 app.register_blueprint(wechat, url_prefix='/wechat')
 
+# 运行指标
+registry.gauge("db_pool_checked_out", "数据库连接池已借出的连接数", lambda: pool_metrics(Bot.sql_db)["checked_out"])
+registry.gauge("db_pool_wait_max_ms", "数据库连接池最大等待时间(毫秒)", lambda: pool_metrics(Bot.sql_db).get("wait_max_ms", 0.0))
+
+@app.route('/metrics')
+def metrics():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
 # # 定时执行
 # @scheduler.task('cron', id='summarize_schedule', hour=11, minute=55, timezone='Asia/Shanghai')
 # def summarize_schedule():
@@ -49,51 +62,99 @@ app.register_blueprint(wechat, url_prefix='/wechat')
 #     logger.info(f"已完成{len(chatidlist)}个群聊的总结,当前时间为: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
 
+# 低峰期推进群聊总结检查点
+@scheduler.task('cron', id='summary_checkpoint_schedule', hour=2, minute=0, timezone='Asia/Shanghai')
+def summary_checkpoint_schedule():
+    logger.info(f"总结检查点推进开始，当前时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    try:
+        advanced_count = Bot.AdvanceSummaryCheckpoints()
+        logger.info(f"已推进 {advanced_count} 个群聊的总结检查点")
+    except Exception as e:
+        logger.error(f"推进总结检查点时出错: {e}")
+
+# 定时记录数据库连接池指标
+@scheduler.task('interval', id='pool_metrics_schedule', minutes=5)
+def pool_metrics_schedule():
+    metrics = pool_metrics(Bot.sql_db)
+    logger.info(f"数据库连接池: 大小={metrics['size']}, 已借出={metrics['checked_out']}, 溢出={metrics['overflow']}, "
+                f"平均等待={metrics.get('wait_avg_ms', 0):.1f}ms, 最大等待={metrics.get('wait_max_ms', 0):.1f}ms, 超时={metrics.get('timeouts', 0)}")
+
+# 定时写回问答缓存的命中次数
+@scheduler.task('interval', id='answer_cache_hits_schedule', minutes=5)
+def answer_cache_hits_schedule():
+    if Bot.answer_cache is not None:
+        Bot.answer_cache.flush_hits()
+
+# 分区表预创建未来分区
+@scheduler.task('cron', id='partition_schedule', hour=1, minute=0, timezone='Asia/Shanghai')
+def partition_schedule():
+    db = Bot.sql_db
+    try:
+        with db.connect() as con:
+            if not is_partitioned(con):
+                return
+        created = ensure_future_partitions(
+            db,
+            interval=os.getenv('partition_interval', 'day'),
+            ahead=int(os.getenv('partition_premake', 7))
+        )
+        logger.info(f"分区预创建完成，新建 {len(created)} 个分区")
+    except Exception as e:
+        logger.error(f"预创建分区时出错: {e}")
+
 # 定时清理
 @scheduler.task('cron', id='clean_schedule', hour=3, minute=0, timezone='Asia/Shanghai')
 def clean_schedule():
     logger.info(f"定时清理开始，当前日期: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     db = Bot.sql_db
-    # 定义时间戳阈值，计算7天前的毫秒时间戳
-    time_threshold = "EXTRACT(EPOCH FROM CURRENT_TIMESTAMP) * 1000 - 7 * 24 * 60 * 60 * 1000"
-    
-    with db.connect() as con:
-        count_result = con.execute(text(f"SELECT COUNT(*) FROM wecom_messages WHERE wecom_messages.msgtime < ({time_threshold})"))
-        pending_delete_count = count_result.scalar()
-        if pending_delete_count > 0:
-            logger.info(f"将清理 {pending_delete_count} 条7天前的记录")
-            delete_result = con.execute(text(f"DELETE FROM wecom_messages WHERE wecom_messages.msgtime < ({time_threshold}) RETURNING msgid"))
-            deleted_count = len(delete_result.fetchall())
-            con.commit()  # 提交事务
-            logger.info(f"成功删除了 {deleted_count} 条7天前的记录")
-        else:
-            con.commit()  # 提交事务
-            logger.info("没有需要清理的记录")
+    retention_days = int(os.getenv('retention_days', 7))
+    # 分批删除过期记录，分区表直接删除过期分区
+    stats = purge_expired_messages(
+        db,
+        retention_days=retention_days,
+        batch_size=int(os.getenv('retention_batch_size', 5000))
+    )
+    if stats["dropped_partitions"]:
+        logger.info(f"删除了 {len(stats['dropped_partitions'])} 个{retention_days}天前的分区")
+    if stats["deleted_rows"] > 0:
+        logger.info(f"成功删除了 {stats['deleted_rows']} 条{retention_days}天前的记录, 批次: {stats['batches']}, 耗时: {stats['elapsed']:.1f}秒")
+    elif not stats["dropped_partitions"]:
+        logger.info("没有需要清理的记录")
+    # 总结检查点覆盖的消息已被清理时，删除检查点，下次汇总重新生成
+    time_threshold = int(datetime.now().timestamp() * 1000) - retention_days * DAY_MS
+    try:
+        with db.begin() as con:
+            checkpoint_result = con.execute(
+                text("DELETE FROM wecom_summary_checkpoints WHERE first_msgtime < :threshold"),
+                {"threshold": time_threshold}
+            )
+        if checkpoint_result.rowcount:
+            logger.info(f"清理了 {checkpoint_result.rowcount} 个过期的总结检查点")
+    except Exception as e:
+        logger.error(f"清理总结检查点失败: {str(e)}")
+    if Bot.answer_cache is not None:
+        try:
+            purged = Bot.answer_cache.purge()
+            if purged:
+                logger.info(f"清理了 {purged} 条过期或超出上限的缓存回答")
+        except Exception as e:
+            logger.error(f"清理问答缓存失败: {str(e)}")
     logger.info(f"定时清理完成，当前日期: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
-save_process = None
+# 会话存档子进程，输出写入日志，退出后按退避时间自动重启
+save_supervisor = ProcessSupervisor(
+    "save_chat.py",
+    [sys.executable, os.path.join(os.path.dirname(__file__), 'save_chat.py')],
+    min_backoff=float(os.getenv('save_chat_min_backoff', 1)),
+    max_backoff=float(os.getenv('save_chat_max_backoff', 60))
+)
+registry.gauge("save_chat_alive", "会话存档子进程是否在运行", lambda: int(save_supervisor.alive))
+registry.gauge("save_chat_restarts", "会话存档子进程的重启次数", lambda: save_supervisor.restarts)
 
 def start_and_manage_services():
     """
     启动和管理所有服务，包括子进程启动和信号处理
     """
-    global save_process
-    
-    def _start_save_process():
-        save_chat_path = os.path.join(os.path.dirname(__file__), 'save_chat.py')
-        try:
-            process = subprocess.Popen(
-                ['python', save_chat_path],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                universal_newlines=True
-            )
-            logger.info(f"已启动save_chat.py，进程ID: {process.pid}")
-            return process
-        except Exception as e:
-            logger.error(f"启动save_chat.py失败: {str(e)}")
-            return None
-    
     # 关闭所有服务
     def _shutdown_services():
         # 关闭调度器（先检查是否正在运行）
@@ -106,15 +167,7 @@ def start_and_manage_services():
         except Exception as e:
             logger.error(f"关闭调度器时出错: {str(e)}")
         # 关闭子进程
-        if save_process and save_process.poll() is None:
-            logger.info(f"关闭会话存档进程 (PID: {save_process.pid})")
-            try:
-                save_process.terminate()
-                save_process.wait(timeout=5)
-            except subprocess.TimeoutExpired:
-                # 超时则强制终止
-                logger.warning("会话存档进程终止超时，强制终止")
-                save_process.kill()
+        save_supervisor.stop(timeout=5)
     
     # 定义信号处理函数
     def _signal_handler(signum, frame):
@@ -125,7 +178,7 @@ def start_and_manage_services():
     signal.signal(signal.SIGTERM, _signal_handler)
     
     # 启动子进程
-    save_process = _start_save_process()
+    save_supervisor.start()
     
     # 启动调度器
     scheduler.init_app(app)
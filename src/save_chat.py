@@ -9,15 +9,32 @@ import json
 import base64
 import time
 import requests
-import sqlalchemy
+from concurrent.futures import ThreadPoolExecutor
 from Crypto.PublicKey import RSA
 from Crypto.Cipher import PKCS1_v1_5
-from sqlalchemy import text
-from chatBot import logger
-from utils.WeComFinanceSdk_python import WeWorkFinanceSdk
+from utils.logger import logger
+from utils.WeComFinanceSdk_python.WeWorkFinanceSdk import WeWorkFinanceSdk, WeWorkFinanceSdkPool
+from utils.db import get_engine, execute_statement
 from dotenv import load_dotenv
 load_dotenv()
 
+# 需要拉取媒体文件的消息类型
+MEDIA_MSGTYPES = ('image', 'file')
+
+
+def default_sdk_factory(corp_id, corp_key):
+    """
+    创建基于原生库的企业微信会话存档SDK实例
+    
+    Args:
+        corp_id: 企业ID
+        corp_key: 会话存档密钥
+    
+    Returns:
+        WeWorkFinanceSdk: SDK实例
+    """
+    return WeWorkFinanceSdk(corp_id, corp_key)
+
 
 class WecomChatArchiver:
     """
@@ -25,7 +42,7 @@ class WecomChatArchiver:
     用于从企业微信API获取会话数据并保存到本地和数据库
     """
     
-    def __init__(self, corp_id=None, corp_key=None, prikey_path=None, db_url=None):
+    def __init__(self, corp_id=None, corp_key=None, prikey_path=None, db_url=None, sdk_factory=None):
         """
         初始化企业微信会话存档服务
         
@@ -34,6 +51,8 @@ class WecomChatArchiver:
             corp_key: 企业密钥，默认为None时从环境变量获取
             prikey_path: 私钥文件路径，默认为None时从环境变量获取
             db_url: 数据库连接URL，默认为None时从环境变量获取
+            sdk_factory: SDK工厂函数，以(corp_id, corp_key)调用，返回的对象需提供
+                get_chat_data/decrypt_data/pull_media_file/destroy_sdk方法，默认使用原生SDK
         """
         self.corp_id = corp_id or os.environ.get('corpid', '')
         self.corp_key = corp_key or os.environ.get('secret', '')
@@ -49,12 +68,18 @@ class WecomChatArchiver:
         self.access_token = self._get_access_token()
         
         # 初始化数据库连接
-        self.sql_db = sqlalchemy.create_engine(self.db_url)
+        self.sql_db = get_engine(self.db_url)
         
         # 初始化SDK和相关变量
+        self.sdk_factory = sdk_factory or default_sdk_factory
         self.sdk = None
         self.has_prikey = False
         self.cipher = None
+        # 媒体文件由独立的SDK实例池并行拉取，不阻塞消息轮询，media_workers为0时不拉取
+        self.media_workers = int(os.getenv('media_workers', 0))
+        self.sdk_health_interval = int(os.getenv('sdk_health_interval', 300))
+        self.media_pool = None
+        self.media_executor = None
         
     def initialize_sdk(self):
         """
@@ -64,7 +89,11 @@ class WecomChatArchiver:
             bool: 初始化是否成功
         """
         try:
-            self.sdk = WeWorkFinanceSdk.WeWorkFinanceSdk(self.corp_id, self.corp_key)
+            self.sdk = self.sdk_factory(self.corp_id, self.corp_key)
+            if self.media_workers > 0:
+                self.media_pool = WeWorkFinanceSdkPool(self.corp_id, self.corp_key, size=self.media_workers, factory=self.sdk_factory)
+                self.media_executor = ThreadPoolExecutor(max_workers=self.media_workers, thread_name_prefix='media_pull')
+                logger.info(f"媒体文件并行拉取已开启，SDK实例数: {self.media_workers}")
             
             if os.path.exists(self.prikey_path):
                 with open(self.prikey_path) as pk_file:
@@ -79,16 +108,18 @@ class WecomChatArchiver:
             logger.error(f"初始化SDK时出错: {e}")
             return False
     
-    def process_message_by_type(self, data_details):
+    def process_message_by_type(self, data_details, sdk=None):
         """
         根据消息类型处理消息数据
         
         Args:
             data_details: 解密后的消息详情
+            sdk: 拉取媒体文件使用的SDK实例，默认为self.sdk
         
         Returns:
             dict: 处理结果，包含状态和相关信息
         """
+        sdk = sdk or self.sdk
         try:
             msgtype = data_details.get('msgtype')
             if msgtype is None:
@@ -106,7 +137,7 @@ class WecomChatArchiver:
                 filelen = file_info.get('filesize')
                 md5sum = file_info.get('md5sum')
                 
-                file_content, length = self.sdk.pull_media_file(file_id=fileid)
+                file_content, length = sdk.pull_media_file(file_id=fileid)
                 if len(file_content) == filelen:
                     with open(f'./{filename}', 'wb') as dstf:
                         dstf.write(file_content)
@@ -122,7 +153,7 @@ class WecomChatArchiver:
                 
                 # 使用md5sum作为文件名，避免重复
                 filename = f"image_{md5sum}.jpg"
-                image_content, length = self.sdk.pull_media_file(file_id=fileid)
+                image_content, length = sdk.pull_media_file(file_id=fileid)
                 
                 if len(image_content) == filesize:
                     with open(f'./{filename}', 'wb') as dstf:
@@ -137,7 +168,24 @@ class WecomChatArchiver:
                 
         except Exception as e:
             print(f"处理消息时出错: {e}")
-            return {"status": "error", "error": str(e)}
+            return {"status": "error", "error": str(e), "code": getattr(e, "code", None)}
+    
+    def _pull_media(self, data_details):
+        """
+        从SDK实例池借出实例拉取媒体文件，在media_executor中执行
+        
+        Args:
+            data_details: 解密后的消息详情
+        """
+        sdk = self.media_pool.checkout()
+        result = {}
+        try:
+            result = self.process_message_by_type(data_details, sdk=sdk)
+        finally:
+            self.media_pool.checkin(sdk, result.get("code"))
+        if result.get("status") == "error":
+            logger.error(f"拉取媒体文件失败: msgid={data_details.get('msgid')}, 错误: {result.get('error')}")
+        return result
     
     def _get_message_content(self, data_details):
         """
@@ -236,8 +284,9 @@ class WecomChatArchiver:
             
             with self.sql_db.connect() as con:
                 with con.begin():
-                    con.execute(
-                        text("INSERT INTO wecom_messages (msgid, action, \"from\", tolist, roomid, chat_name, msgtime, msgtype, content) VALUES (:msgid, :action, :from_userid, :tolist, :roomid, :chat_name, :msgtime, :msgtype, :content)"),
+                    execute_statement(
+                        con,
+                        "wecom_insert_message",
                         {
                             "msgid": msgid,
                             "action": action,
@@ -268,8 +317,9 @@ class WecomChatArchiver:
         """
         try:
             with self.sql_db.connect() as con:
-                result = con.execute(
-                    text("SELECT 1 FROM wecom_messages WHERE msgid = :msgid AND msgtype = :msgtype"), 
+                result = execute_statement(
+                    con,
+                    "wecom_message_exists",
                     {"msgid": msgid, "msgtype": msgtype}
                 ).fetchone()
                 return result is not None
@@ -334,6 +384,8 @@ class WecomChatArchiver:
                 msgtype=msgtype,
                 content=content
             )   
+            if self.media_executor and msgtype in MEDIA_MSGTYPES:
+                self.media_executor.submit(self._pull_media, data_details)
             return True
             
         except Exception as e:
@@ -341,6 +393,36 @@ class WecomChatArchiver:
             logger.error(f'解密失败，当前密钥版本: {pubkey_ver}, 错误: {str(e)}')
             return False
     
+    def pull_once(self, current_seq, record_limit=50):
+        """
+        拉取并处理一页聊天数据
+        
+        Args:
+            current_seq: 当前序列号
+            record_limit: 获取的记录数量
+        
+        Returns:
+            int: 下次请求使用的序列号
+            int: 本页的消息数量
+        """
+        chat_data, length = self.sdk.get_chat_data(seq=current_seq, limit=record_limit)
+        if chat_data is None:
+            logger.error(f"获取聊天数据失败")
+            return current_seq, 0
+        ret_data = json.loads(chat_data)
+        if ret_data.get("errcode") != 0:
+            logger.error(f"调用接口失败:{ret_data}")
+            return current_seq, 0
+        origin_data_list = ret_data.get("chatdata")
+        if len(origin_data_list) <= 0:
+            return current_seq, 0
+        # 获取最新的seq，用于下次请求
+        current_seq = max([p.get('seq') for p in origin_data_list])
+
+        for chat_data in origin_data_list:
+            self.process_chat_data(chat_data)
+        return current_seq, len(origin_data_list)
+
     def run(self, start_seq=0, record_limit=50, sleep_time=1):
         """
         运行主循环，持续获取并处理聊天数据
@@ -355,27 +437,18 @@ class WecomChatArchiver:
                 raise Exception("SDK初始化失败")
             
             current_seq = start_seq
+            last_health_check = time.time()
             logger.info("企业微信会话存档服务已启动...")
             
             while True:
-                # 获取聊天数据
-                chat_data, length = self.sdk.get_chat_data(seq=current_seq, limit=record_limit)
-                if chat_data is None:
-                    logger.error(f"获取聊天数据失败")
-                    continue
-                ret_data = json.loads(chat_data)
-                if ret_data.get("errcode") != 0:
-                    logger.error(f"调用接口失败:{ret_data}")
-                    continue
-                origin_data_list = ret_data.get("chatdata")
-                if len(origin_data_list) <= 0:
-                    time.sleep(sleep_time)
-                    continue
-                # 获取最新的seq，用于下次请求
-                current_seq = max([p.get('seq') for p in origin_data_list])
-
-                for chat_data in origin_data_list:
-                    self.process_chat_data(chat_data)
+                # 获取并处理聊天数据
+                current_seq, _ = self.pull_once(current_seq, record_limit)
+                # 定期检查媒体SDK实例，异常的实例重新初始化
+                if self.media_pool and time.time() - last_health_check > self.sdk_health_interval:
+                    reinitialized = self.media_pool.health_check(current_seq)
+                    if reinitialized:
+                        logger.info(f"已重新初始化 {reinitialized} 个媒体SDK实例")
+                    last_health_check = time.time()
                 # 一分钟内不得超过4000次调用，当前设置3000
                 time.sleep(sleep_time)
                 
@@ -385,6 +458,10 @@ class WecomChatArchiver:
             logger.error(f"Error: {e}")
         finally:
             # 清理SDK资源
+            if self.media_executor:
+                self.media_executor.shutdown(wait=True, cancel_futures=True)
+            if self.media_pool:
+                self.media_pool.close()
             if self.sdk:
                 self.sdk.destroy_sdk()
                 logger.info("SDK已回收")
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ChunkCoalescer合并写入测试
+"""
+import time
+import threading
+import unittest
+from utils.stream_utils import ChunkCoalescer
+
+
+class Sink:
+    """记录写入流的(stream_id, 内容, 是否完成)"""
+
+    def __init__(self):
+        self.writes = []
+        self.written = threading.Event()
+
+    def __call__(self, stream_id, content, is_finished):
+        self.writes.append((stream_id, content, is_finished))
+        self.written.set()
+
+
+class ChunkCoalescerTest(unittest.TestCase):
+
+    def test_buffers_until_max_chars(self):
+        sink = Sink()
+        coalescer = ChunkCoalescer(sink, interval=60, max_chars=5)
+        coalescer("s", "ab")
+        coalescer("s", "cd")
+        self.assertEqual(sink.writes, [])
+        coalescer("s", "ef")
+        self.assertEqual(sink.writes, [("s", "abcdef", False)])
+        coalescer.flush()
+        self.assertEqual(len(sink.writes), 1)
+
+    def test_finish_flushes_immediately(self):
+        sink = Sink()
+        coalescer = ChunkCoalescer(sink, interval=60, max_chars=100)
+        coalescer("s", "ab")
+        coalescer("s", "", True)
+        self.assertEqual(sink.writes, [("s", "ab", True)])
+        self.assertIsNone(coalescer.timer)
+
+    def test_finish_without_content(self):
+        sink = Sink()
+        coalescer = ChunkCoalescer(sink, interval=60, max_chars=100)
+        coalescer("s", "", True)
+        self.assertEqual(sink.writes, [("s", "", True)])
+
+    def test_explicit_flush(self):
+        sink = Sink()
+        coalescer = ChunkCoalescer(sink, interval=60, max_chars=100)
+        coalescer("s", "ab")
+        coalescer.flush()
+        coalescer("s", "cd", True)
+        self.assertEqual(sink.writes, [("s", "ab", False), ("s", "cd", True)])
+
+    def test_timer_flushes_when_generation_stalls(self):
+        sink = Sink()
+        coalescer = ChunkCoalescer(sink, interval=0.05, max_chars=100)
+        coalescer.last_flush = time.monotonic()
+        coalescer("s", "ab")
+        self.assertEqual(sink.writes, [])
+        self.assertTrue(sink.written.wait(2))
+        self.assertEqual(sink.writes, [("s", "ab", False)])
+        self.assertIsNone(coalescer.timer)
+
+
+if __name__ == "__main__":
+    unittest.main()
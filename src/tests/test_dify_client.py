@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+parse_endpoints与DifyClient节点选择、熔断测试
+"""
+import unittest
+from unittest import mock
+from utils.dify_client import DifyClient, parse_endpoints
+
+
+class ParseEndpointsTest(unittest.TestCase):
+
+    def test_single_key_shared(self):
+        self.assertEqual(
+            parse_endpoints(" http://a/v1/ , http://b/v1", "app-x"),
+            [("http://a/v1", "app-x"), ("http://b/v1", "app-x")]
+        )
+
+    def test_keys_match_urls(self):
+        self.assertEqual(
+            parse_endpoints("http://a,http://b", "k1, k2"),
+            [("http://a", "k1"), ("http://b", "k2")]
+        )
+
+    def test_key_count_mismatch(self):
+        with self.assertRaises(ValueError):
+            parse_endpoints("http://a,http://b,http://c", "k1,k2")
+
+    def test_empty(self):
+        self.assertEqual(parse_endpoints("", "k"), [])
+        self.assertEqual(parse_endpoints(None, None), [])
+        self.assertEqual(parse_endpoints("http://a", ""), [("http://a", "")])
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("utils.dify_client.time.monotonic", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = DifyClient([("http://a", "k"), ("http://b", "k")], failure_threshold=2, cooldown=30)
+        self.a, self.b = self.client.endpoints
+
+    def fail(self, endpoint, times):
+        for _ in range(times):
+            self.client.record_failure(endpoint, Exception("down"))
+
+    def test_opens_after_threshold(self):
+        self.fail(self.a, 1)
+        self.assertEqual(self.client.open_circuits(), 0)
+        self.fail(self.a, 1)
+        self.assertEqual(self.client.open_circuits(), 1)
+        # 熔断中的节点不再被选中
+        for _ in range(3):
+            endpoint = self.client.acquire()
+            self.assertIs(endpoint, self.b)
+            self.client.release(endpoint)
+
+    def test_success_resets_failures(self):
+        self.fail(self.a, 1)
+        self.client.record_success(self.a)
+        self.fail(self.a, 1)
+        self.assertEqual(self.client.open_circuits(), 0)
+
+    def test_single_probe_after_cooldown(self):
+        self.fail(self.a, 2)
+        self.now += 31
+        # b负载更高时，到期的a只放行一个试探请求
+        self.b.in_flight = 5
+        probe = self.client.acquire()
+        self.assertIs(probe, self.a)
+        self.assertTrue(self.a.probing)
+        second = self.client.acquire()
+        self.assertIs(second, self.b)
+        self.client.release(second)
+        self.client.record_success(probe)
+        self.client.release(probe)
+        self.assertEqual(self.client.open_circuits(), 0)
+        self.assertFalse(self.a.probing)
+
+    def test_all_open_picks_earliest(self):
+        self.fail(self.a, 2)
+        self.now += 10
+        self.fail(self.b, 2)
+        self.assertEqual(self.client.open_circuits(), 2)
+        self.assertIs(self.client.acquire(), self.a)
+        # 已尝试过的节点不再重选
+        self.assertIsNone(self.client.acquire(exclude=[self.a]))
+
+    def test_prefers_lower_score(self):
+        self.client.record_ttft(self.a, 5.0)
+        endpoint = self.client.acquire()
+        self.assertIs(endpoint, self.b)
+        self.assertEqual(self.b.in_flight, 1)
+        self.client.release(endpoint)
+        self.assertEqual(self.b.in_flight, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
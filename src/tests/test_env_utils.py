@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+env_flag测试
+"""
+import os
+import unittest
+from unittest import mock
+from utils.env_utils import env_flag
+
+
+class EnvFlagTest(unittest.TestCase):
+
+    def test_true_values(self):
+        for value in ("1", "true", "TRUE", "Yes", " yes "):
+            with mock.patch.dict(os.environ, {"test_flag": value}):
+                self.assertTrue(env_flag("test_flag"), value)
+
+    def test_false_values(self):
+        for value in ("0", "false", "no", "", "on"):
+            with mock.patch.dict(os.environ, {"test_flag": value}):
+                self.assertFalse(env_flag("test_flag", "1"), value)
+
+    def test_default(self):
+        with mock.patch.dict(os.environ):
+            os.environ.pop("test_flag", None)
+            self.assertFalse(env_flag("test_flag"))
+            self.assertTrue(env_flag("test_flag", "1"))
+
+
+if __name__ == "__main__":
+    unittest.main()
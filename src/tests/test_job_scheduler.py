@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LLMScheduler并发、配额与优先级测试
+"""
+import time
+import threading
+import unittest
+from utils.job_scheduler import (
+    LLMScheduler, PRIORITY_QA, PRIORITY_SUMMARY,
+    QUEUE_FULL_MESSAGE, USER_QUOTA_MESSAGE, CHAT_QUOTA_MESSAGE
+)
+
+
+class Gate:
+    """阻塞任务，直到测试放行"""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.started.set()
+        self.release.wait(5)
+
+
+class LLMSchedulerTest(unittest.TestCase):
+
+    def wait_idle(self, scheduler):
+        for _ in range(500):
+            with scheduler.lock:
+                if not scheduler.running and not scheduler.queue:
+                    return
+            time.sleep(0.01)
+        self.fail("调度器未在5秒内空闲")
+
+    def test_user_quota_counts_running_and_queued(self):
+        scheduler = LLMScheduler(max_concurrency=1, max_queue=8, user_quota=2, chat_quota=0)
+        gate = Gate()
+        self.assertEqual(scheduler.submit(gate, user_id="u1"), (0, None))
+        self.assertTrue(gate.started.wait(5))
+        self.assertEqual(scheduler.submit(lambda: None, user_id="u1"), (1, None))
+        self.assertEqual(scheduler.submit(lambda: None, user_id="u1"), (None, USER_QUOTA_MESSAGE))
+        # 其他用户不受影响
+        self.assertEqual(scheduler.submit(lambda: None, user_id="u2"), (2, None))
+        gate.release.set()
+        self.wait_idle(scheduler)
+        self.assertEqual(scheduler.user_jobs, {})
+        self.assertEqual(scheduler.submit(lambda: None, user_id="u1")[1], None)
+
+    def test_chat_quota(self):
+        scheduler = LLMScheduler(max_concurrency=4, max_queue=8, user_quota=0, chat_quota=2)
+        gate = Gate()
+        self.assertIsNone(scheduler.submit(gate, user_id="u1", chat_id="c1")[1])
+        self.assertIsNone(scheduler.submit(gate, user_id="u2", chat_id="c1")[1])
+        self.assertEqual(scheduler.submit(gate, user_id="u3", chat_id="c1"), (None, CHAT_QUOTA_MESSAGE))
+        self.assertIsNone(scheduler.submit(gate, user_id="u3", chat_id="c2")[1])
+        gate.release.set()
+        self.wait_idle(scheduler)
+        self.assertEqual(scheduler.chat_jobs, {})
+
+    def test_queue_full(self):
+        scheduler = LLMScheduler(max_concurrency=1, max_queue=1, user_quota=0, chat_quota=0)
+        gate = Gate()
+        scheduler.submit(gate)
+        self.assertTrue(gate.started.wait(5))
+        self.assertEqual(scheduler.submit(lambda: None), (1, None))
+        self.assertEqual(scheduler.submit(lambda: None), (None, QUEUE_FULL_MESSAGE))
+        gate.release.set()
+        self.wait_idle(scheduler)
+
+    def test_qa_runs_before_summary(self):
+        scheduler = LLMScheduler(max_concurrency=1, max_queue=8, user_quota=0, chat_quota=0)
+        gate = Gate()
+        order = []
+        scheduler.submit(gate)
+        self.assertTrue(gate.started.wait(5))
+        scheduler.submit(lambda: order.append("summary"), PRIORITY_SUMMARY)
+        position, _ = scheduler.submit(lambda: order.append("qa"), PRIORITY_QA)
+        self.assertEqual(position, 1)
+        gate.release.set()
+        self.wait_idle(scheduler)
+        self.assertEqual(order, ["qa", "summary"])
+
+    def test_position_follows_queue(self):
+        scheduler = LLMScheduler(max_concurrency=1, max_queue=8, user_quota=0, chat_quota=0)
+        gate = Gate()
+        second = Gate()
+        scheduler.submit(gate, job_key="s0")
+        self.assertTrue(gate.started.wait(5))
+        scheduler.submit(second, job_key="s1")
+        scheduler.submit(lambda: None, job_key="s2")
+        self.assertEqual(scheduler.position("s0"), 0)
+        self.assertEqual(scheduler.position("s1"), 1)
+        self.assertEqual(scheduler.position("s2"), 2)
+        self.assertEqual(scheduler.position("missing"), 0)
+        gate.release.set()
+        self.assertTrue(second.started.wait(5))
+        self.assertEqual(scheduler.position("s1"), 0)
+        self.assertEqual(scheduler.position("s2"), 1)
+        second.release.set()
+        self.wait_idle(scheduler)
+        self.assertEqual(scheduler.position("s2"), 0)
+
+    def test_failed_job_releases_quota(self):
+        scheduler = LLMScheduler(max_concurrency=1, max_queue=8, user_quota=1, chat_quota=1)
+
+        def fail():
+            raise RuntimeError("boom")
+
+        scheduler.submit(fail, user_id="u1", chat_id="c1")
+        self.wait_idle(scheduler)
+        self.assertEqual(scheduler.user_jobs, {})
+        self.assertEqual(scheduler.chat_jobs, {})
+
+    def test_run_waits_for_completion(self):
+        scheduler = LLMScheduler(max_concurrency=1, max_queue=8, user_quota=1, chat_quota=0)
+        done = []
+        self.assertIsNone(scheduler.run(lambda: done.append(1), PRIORITY_SUMMARY, "schedule"))
+        self.assertEqual(done, [1])
+        gate = Gate()
+        scheduler.submit(gate, user_id="schedule")
+        self.assertTrue(gate.started.wait(5))
+        self.assertEqual(scheduler.run(lambda: None, PRIORITY_SUMMARY, "schedule"), USER_QUOTA_MESSAGE)
+        gate.release.set()
+        self.wait_idle(scheduler)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SingleFlight与normalize_query测试
+"""
+import time
+import threading
+import unittest
+from utils.single_flight import SingleFlight, normalize_query
+
+
+class Recorder:
+    """记录每个stream_id收到的chunk"""
+
+    def __init__(self):
+        self.chunks = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, stream_id, chunk):
+        with self.lock:
+            self.chunks.setdefault(stream_id, []).append(chunk)
+
+    def text(self, stream_id):
+        return "".join(self.chunks.get(stream_id, []))
+
+
+class NormalizeQueryTest(unittest.TestCase):
+
+    def test_strips_punctuation_whitespace_and_case(self):
+        self.assertEqual(normalize_query("  SPD系统  如何\t登录？ "), "spd系统 如何 登录")
+        self.assertEqual(normalize_query("SPD系统 如何 登录"), normalize_query("spd系统 如何 登录!"))
+
+    def test_empty(self):
+        self.assertEqual(normalize_query(None), "")
+        self.assertEqual(normalize_query("？？"), "")
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def test_concurrent_callers_share_one_call(self):
+        flights = SingleFlight()
+        recorder = Recorder()
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def generate(emit):
+            calls.append(1)
+            emit(None, "a")
+            started.set()
+            release.wait(5)
+            emit(None, "b")
+            return "ab"
+
+        results = {}
+
+        def caller(stream_id):
+            results[stream_id] = flights.run("k", recorder, stream_id, generate)
+
+        leader = threading.Thread(target=caller, args=("s0",))
+        leader.start()
+        self.assertTrue(started.wait(5))
+        followers = [threading.Thread(target=caller, args=(f"s{i}",)) for i in range(1, 4)]
+        for thread in followers:
+            thread.start()
+        # 等待所有后来者完成订阅后再继续生成
+        deadline = time.monotonic() + 5
+        while len(flights._flights["k"].subscribers) < 4 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(flights), 0)
+        for i in range(4):
+            self.assertEqual(results[f"s{i}"], "ab")
+            self.assertEqual(recorder.text(f"s{i}"), "ab")
+
+    def test_error_propagates_to_followers(self):
+        flights = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        errors = []
+
+        def generate(emit):
+            started.set()
+            release.wait(5)
+            raise RuntimeError("boom")
+
+        def caller():
+            try:
+                flights.run("k", lambda *args: None, "", generate)
+            except RuntimeError as e:
+                errors.append(e)
+
+        leader = threading.Thread(target=caller)
+        leader.start()
+        self.assertTrue(started.wait(5))
+        wait = flights.join("k", lambda *args: None, "follower")
+        self.assertIsNotNone(wait)
+        release.set()
+        leader.join(5)
+        self.assertRaises(RuntimeError, wait)
+        self.assertEqual(len(errors), 1)
+
+    def test_join_without_flight_returns_none(self):
+        flights = SingleFlight()
+        self.assertIsNone(flights.join("k", lambda *args: None, ""))
+
+    def test_join_replays_and_counts(self):
+        flights = SingleFlight()
+        recorder = Recorder()
+        joined = []
+        waits = []
+
+        def generate(emit):
+            emit(None, "x")
+            waits.append(flights.join("k", recorder, "late", on_join=lambda: joined.append(1)))
+            emit(None, "y")
+            return "xy"
+
+        self.assertEqual(flights.run("k", recorder, "leader", generate), "xy")
+        self.assertEqual(waits[0](), "xy")
+        self.assertEqual(recorder.text("late"), "xy")
+        self.assertEqual(joined, [1])
+
+    def test_different_keys_do_not_share(self):
+        flights = SingleFlight()
+        self.assertEqual(flights.run("a", lambda *args: None, "", lambda emit: 1), 1)
+        self.assertEqual(flights.run("b", lambda *args: None, "", lambda emit: 2), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -245,11 +245,27 @@ class WXBizJsonMsgCrypt(object):
         #@param sNonce: 随机串，可以自己生成，也可以用URL参数的nonce
         #sEncryptMsg: 加密后的可以直接回复用户的密文，包括msg_signature, timestamp, nonce, encrypt的json格式的字符串,
         #return：成功0，sEncryptMsg,失败返回对应的错误码None     
+        ret,encrypt = self.EncryptBody(sReplyMsg)
+        if ret != 0:
+            return ret,None
+        return self.PackMsg(encrypt, sNonce, timestamp)
+
+    def EncryptBody(self, sReplyMsg):
+        #只加密消息体，结果与nonce/timestamp无关，内容不变时可以复用
+        #@param sReplyMsg: 企业号待回复用户的消息，json格式的字符串
+        #return：成功0，base64编码的密文字符串,失败返回对应的错误码None
         pc = Prpcrypt(self.key) 
         ret,encrypt = pc.encrypt(sReplyMsg, self.m_sReceiveId)
-        encrypt = encrypt.decode('utf-8')
         if ret != 0:
             return ret,None
+        return ret,encrypt.decode('utf-8')
+
+    def PackMsg(self, encrypt, sNonce, timestamp = None):
+        #对已加密的消息体生成安全签名并打包
+        #@param encrypt: EncryptBody返回的密文
+        #@param sNonce: 随机串，可以自己生成，也可以用URL参数的nonce
+        #@param sTimeStamp: 时间戳，如为None则自动用当前时间
+        #return：成功0，sEncryptMsg,失败返回对应的错误码None
         if timestamp is None:
             timestamp = str(int(time.time()))
         # 生成安全签名 
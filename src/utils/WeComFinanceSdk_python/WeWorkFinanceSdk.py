@@ -4,24 +4,20 @@ import json
 import os
 import time
 import hashlib
+import platform
+import functools
+import queue
+import threading
+import weakref
+from contextlib import contextmanager
 
-from Crypto.Cipher import PKCS1_v1_5
-from Crypto.PublicKey import RSA
 from dotenv import load_dotenv
 load_dotenv()
 
-# 请注意更改路径
-if os.name == "nt":
-    sdk_dll = ctypes.CDLL("src/utils/WeComFinanceSdk_python/windows/WeWorkFinanceSdk.dll")
-elif os.name == 'posix':
-    sdk_dll = ctypes.CDLL("src/utils/WeComFinanceSdk_python/linux-x86/libWeWorkFinanceSdk_C.so")
-else:
-    raise NotImplementedError("Unsupported OS")
-
-
 # 定义SDK结构体
 class Slice(ctypes.Structure):
-    _fields_ = [("buf", ctypes.c_char_p),
+    # buf 使用 c_void_p，按len读取，避免 c_char_p 的额外拷贝和遇到\0截断
+    _fields_ = [("buf", ctypes.c_void_p),
                 ("len", ctypes.c_int)]
 
 class MediaData(ctypes.Structure):
@@ -32,164 +28,354 @@ class MediaData(ctypes.Structure):
                 ("data_len", ctypes.c_int),
                 ("is_finish", ctypes.c_int)]
 
-# 定义SDK函数原型
-sdk_dll.NewSdk.restype = ctypes.c_void_p
-
-"""	/**
-	 * 初始化函数
-	 * Return值=0表示该API调用成功
-	 * 
-	 * @param [in]  sdk			NewSdk返回的sdk指针
-	 * @param [in]  corpid      调用企业的企业id，例如：wwd08c8exxxx5ab44d，可以在企业微信管理端--我的企业--企业信息查看
-	 * @param [in]  secret		聊天内容存档的Secret，可以在企业微信管理端--管理工具--聊天内容存档查看
-	 *						
-	 *
-	 * @return 返回是否初始化成功
-	 *      0   - 成功
-	 *      !=0 - 失败
-	 */
-	 int Init(WeWorkFinanceSdk_t* sdk, const char* corpid, const char* secret);
-"""
-sdk_dll.Init.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p]
-sdk_dll.Init.restype = ctypes.c_int
-
-"""
-	/**
-	 * 拉取聊天记录函数
-	 * Return值=0表示该API调用成功
-	 * 
-	 *
-	 * @param [in]  sdk				NewSdk返回的sdk指针
-	 * @param [in]  seq				从指定的seq开始拉取消息，注意的是返回的消息从seq+1开始返回，seq为之前接口返回的最大seq值。首次使用请使用seq:0
-	 * @param [in]  limit			一次拉取的消息条数，最大值1000条，超过1000条会返回错误
-	 * @param [in]  proxy			使用代理的请求，需要传入代理的链接。如：socks5://10.0.0.1:8081 或者 http://10.0.0.1:8081
-	 * @param [in]  passwd			代理账号密码，需要传入代理的账号密码。如 user_name:passwd_123
-	 * @param [in]  timeout			超时时间，单位秒
-	 * @param [out] chatDatas		返回本次拉取消息的数据，slice结构体.内容包括errcode/errmsg，以及每条消息内容。示例如下：
-
-	 {"errcode":0,"errmsg":"ok","chatdata":[{"seq":196,"msgid":"CAQQ2fbb4QUY0On2rYSAgAMgip/yzgs=","publickey_ver":3,"encrypt_random_key":"ftJ+uz3n/z1DsxlkwxNgE+mL38H42/KCvN8T60gbbtPD+Rta1hKTuQPzUzO6Hzne97MgKs7FfdDxDck/v8cDT6gUVjA2tZ/M7euSD0L66opJ/IUeBtpAtvgVSD5qhlaQjvfKJc/zPMGNK2xCLFYqwmQBZXbNT7uA69Fflm512nZKW/piK2RKdYJhRyvQnA1ISxK097sp9WlEgDg250fM5tgwMjujdzr7ehK6gtVBUFldNSJS7ndtIf6aSBfaLktZgwHZ57ONewWq8GJe7WwQf1hwcDbCh7YMG8nsweEwhDfUz+u8rz9an+0lgrYMZFRHnmzjgmLwrR7B/32Qxqd79A==","encrypt_chat_msg":"898WSfGMnIeytTsea7Rc0WsOocs0bIAerF6de0v2cFwqo9uOxrW9wYe5rCjCHHH5bDrNvLxBE/xOoFfcwOTYX0HQxTJaH0ES9OHDZ61p8gcbfGdJKnq2UU4tAEgGb8H+Q9n8syRXIjaI3KuVCqGIi4QGHFmxWenPFfjF/vRuPd0EpzUNwmqfUxLBWLpGhv+dLnqiEOBW41Zdc0OO0St6E+JeIeHlRZAR+E13Isv9eS09xNbF0qQXWIyNUi+ucLr5VuZnPGXBrSfvwX8f0QebTwpy1tT2zvQiMM2MBugKH6NuMzzuvEsXeD+6+3VRqL"}]}
-
-	 *
-	 * @return 返回是否调用成功
-	 *      0   - 成功
-	 *      !=0 - 失败	
-	 */		
-	 int GetChatData(WeWorkFinanceSdk_t* sdk, unsigned long long seq, unsigned int limit, const char *proxy,const char* passwd, int timeout,Slice_t* chatDatas);
-"""
-sdk_dll.GetChatData.argtypes = [ctypes.c_void_p, ctypes.c_ulonglong, ctypes.c_int, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int, ctypes.POINTER(Slice)]
-sdk_dll.GetChatData.restype = ctypes.c_int
-
-"""
-	/**
-     * @brief 解析密文.企业微信自有解密内容
-     * @param [in]  encrypt_key, getchatdata返回的encrypt_random_key,使用企业自持对应版本秘钥RSA解密后的内容
-     * @param [in]  encrypt_msg, getchatdata返回的encrypt_chat_msg
-     * @param [out] msg, 解密的消息明文
-	 * @return 返回是否调用成功
-	 *      0   - 成功
-	 *      !=0 - 失败
-     */
-	 int DecryptData(const char* encrypt_key, const char* encrypt_msg, Slice_t* msg);
-"""
-sdk_dll.DecryptData.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.POINTER(Slice)]
-sdk_dll.DecryptData.restype = ctypes.c_int
-
-"""
-	/**
-	 * 拉取媒体消息函数
-	 * Return值=0表示该API调用成功
-	 * 
-	 *
-	 * @param [in]  sdk				NewSdk返回的sdk指针
-	 * @param [in]  sdkFileid		从GetChatData返回的聊天消息中，媒体消息包括的sdkfileid
-	 * @param [in]  proxy			使用代理的请求，需要传入代理的链接。如：socks5://10.0.0.1:8081 或者 http://10.0.0.1:8081
-	 * @param [in]  passwd			代理账号密码，需要传入代理的账号密码。如 user_name:passwd_123
-	 * @param [in]  indexbuf		媒体消息分片拉取，需要填入每次拉取的索引信息。首次不需要填写，默认拉取512k，后续每次调用只需要将上次调用返回的outindexbuf填入即可。
-	 * @param [in]  timeout			超时时间，单位秒
-	 * @param [out] media_data		返回本次拉取的媒体数据.MediaData结构体.内容包括data(数据内容)/outindexbuf(下次索引)/is_finish(拉取完成标记)
-	 
-	 *
-	 * @return 返回是否调用成功
-	 *      0   - 成功
-	 *      !=0 - 失败
-	 */
-	 int GetMediaData(WeWorkFinanceSdk_t* sdk, const char* indexbuf,
-                     const char* sdkFileid,const char *proxy,const char* passwd, int timeout, MediaData_t* media_data);
-"""
-sdk_dll.GetMediaData.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int, ctypes.POINTER(MediaData)]
-sdk_dll.GetMediaData.restype = ctypes.c_int
-
-"""
-    /**
-     * @brief 释放sdk，和NewSdk成对使用
-     * @return 
-     */
-	 void DestroySdk(WeWorkFinanceSdk_t* sdk);
-"""
-sdk_dll.DestroySdk.argtypes = [ctypes.c_void_p]
-
-"""
-    //--------------下面接口为了其他语言例如python等调用c接口，酌情使用--------------
-    Slice_t* NewSlice();
-"""
-sdk_dll.NewSlice.restype = ctypes.POINTER(Slice)
-"""
-    /**
-     * @brief 释放slice，和NewSlice成对使用
-     * @return 
-     */
-	 void FreeSlice(Slice_t* slice);
-"""
-sdk_dll.FreeSlice.argtypes = [ctypes.POINTER(Slice)]
-
-"""
-    /**
-     * @brief 为其他语言提供读取接口
-     * @return 返回buf指针
-     *     !=NULL - 成功
-     *     NULL   - 失败
-     */
-	 char* GetContentFromSlice(Slice_t* slice);
-"""
-sdk_dll.GetContentFromSlice.argtypes = [ctypes.POINTER(Slice)]
-sdk_dll.GetContentFromSlice.restype = ctypes.c_char_p
-
-"""
-	 int GetSliceLen(Slice_t* slice);
-"""
-sdk_dll.GetSliceLen.argtypes = [ctypes.POINTER(Slice)]
-sdk_dll.GetSliceLen.restype = ctypes.c_int
-
-
-"""
-     // 媒体记录工具
-     MediaData_t*  NewMediaData();
-     void FreeMediaData(MediaData_t* media_data);
-	 char* GetOutIndexBuf(MediaData_t* media_data);
-	 char* GetData(MediaData_t* media_data);
-	 int GetIndexLen(MediaData_t* media_data);
-	 int GetDataLen(MediaData_t* media_data);
-	 int IsMediaDataFinish(MediaData_t* media_data);
-"""
-sdk_dll.NewMediaData.restype = ctypes.POINTER(MediaData)
-sdk_dll.FreeMediaData.argtypes = [ctypes.POINTER(MediaData)]
-sdk_dll.GetOutIndexBuf.argtypes = [ctypes.POINTER(MediaData)]
-sdk_dll.GetOutIndexBuf.restype = ctypes.c_char_p
-sdk_dll.GetData.argtypes = [ctypes.POINTER(MediaData)]
-sdk_dll.GetData.restype = ctypes.c_void_p
-sdk_dll.GetIndexLen.argtypes = [ctypes.POINTER(MediaData)]
-sdk_dll.GetIndexLen.restype = ctypes.c_int
-sdk_dll.GetDataLen.argtypes = [ctypes.POINTER(MediaData)]
-sdk_dll.GetDataLen.restype = ctypes.c_int
-sdk_dll.IsMediaDataFinish.argtypes = [ctypes.POINTER(MediaData)]
-sdk_dll.IsMediaDataFinish.restype = ctypes.c_int
+# SDK目录，原生库按平台放在对应子目录中
+SDK_DIR = os.path.dirname(os.path.abspath(__file__))
+ARM_MACHINES = ("aarch64", "arm64", "armv7l", "armv8l")
+
+
+def sdk_library_path():
+    """
+    获取当前平台的原生SDK库路径
+    可通过环境变量finance_sdk_path指定，否则按操作系统与CPU架构从SDK目录中选择
+
+    Returns:
+        str: 原生库路径
+    """
+    custom_path = os.getenv('finance_sdk_path')
+    if custom_path:
+        return custom_path
+    if os.name == "nt":
+        return os.path.join(SDK_DIR, "windows", "WeWorkFinanceSdk.dll")
+    elif os.name == 'posix':
+        arch_dir = "linux-arm" if platform.machine().lower() in ARM_MACHINES else "linux-x86"
+        return os.path.join(SDK_DIR, arch_dir, "libWeWorkFinanceSdk_C.so")
+    else:
+        raise NotImplementedError("Unsupported OS")
+
+
+@functools.lru_cache(maxsize=None)
+def load_sdk():
+    """
+    加载原生SDK库并声明函数原型，首次调用时加载，之后返回同一实例
+
+    Returns:
+        ctypes.CDLL: 原生SDK库
+    """
+    dll = ctypes.CDLL(sdk_library_path())
+    # 定义SDK函数原型
+    dll.NewSdk.restype = ctypes.c_void_p
+
+    """	/**
+    	 * 初始化函数
+    	 * Return值=0表示该API调用成功
+    	 * 
+    	 * @param [in]  sdk			NewSdk返回的sdk指针
+    	 * @param [in]  corpid      调用企业的企业id，例如：wwd08c8exxxx5ab44d，可以在企业微信管理端--我的企业--企业信息查看
+    	 * @param [in]  secret		聊天内容存档的Secret，可以在企业微信管理端--管理工具--聊天内容存档查看
+    	 *						
+    	 *
+    	 * @return 返回是否初始化成功
+    	 *      0   - 成功
+    	 *      !=0 - 失败
+    	 */
+    	 int Init(WeWorkFinanceSdk_t* sdk, const char* corpid, const char* secret);
+    """
+    dll.Init.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p]
+    dll.Init.restype = ctypes.c_int
+
+    """
+    	/**
+    	 * 拉取聊天记录函数
+    	 * Return值=0表示该API调用成功
+    	 * 
+    	 *
+    	 * @param [in]  sdk				NewSdk返回的sdk指针
+    	 * @param [in]  seq				从指定的seq开始拉取消息，注意的是返回的消息从seq+1开始返回，seq为之前接口返回的最大seq值。首次使用请使用seq:0
+    	 * @param [in]  limit			一次拉取的消息条数，最大值1000条，超过1000条会返回错误
+    	 * @param [in]  proxy			使用代理的请求，需要传入代理的链接。如：socks5://10.0.0.1:8081 或者 http://10.0.0.1:8081
+    	 * @param [in]  passwd			代理账号密码，需要传入代理的账号密码。如 user_name:passwd_123
+    	 * @param [in]  timeout			超时时间，单位秒
+    	 * @param [out] chatDatas		返回本次拉取消息的数据，slice结构体.内容包括errcode/errmsg，以及每条消息内容。示例如下：
+
+    	 {"errcode":0,"errmsg":"ok","chatdata":[{"seq":196,"msgid":"CAQQ2fbb4QUY0On2rYSAgAMgip/yzgs=","publickey_ver":3,"encrypt_random_key":"ftJ+uz3n/z1DsxlkwxNgE+mL38H42/KCvN8T60gbbtPD+Rta1hKTuQPzUzO6Hzne97MgKs7FfdDxDck/v8cDT6gUVjA2tZ/M7euSD0L66opJ/IUeBtpAtvgVSD5qhlaQjvfKJc/zPMGNK2xCLFYqwmQBZXbNT7uA69Fflm512nZKW/piK2RKdYJhRyvQnA1ISxK097sp9WlEgDg250fM5tgwMjujdzr7ehK6gtVBUFldNSJS7ndtIf6aSBfaLktZgwHZ57ONewWq8GJe7WwQf1hwcDbCh7YMG8nsweEwhDfUz+u8rz9an+0lgrYMZFRHnmzjgmLwrR7B/32Qxqd79A==","encrypt_chat_msg":"898WSfGMnIeytTsea7Rc0WsOocs0bIAerF6de0v2cFwqo9uOxrW9wYe5rCjCHHH5bDrNvLxBE/xOoFfcwOTYX0HQxTJaH0ES9OHDZ61p8gcbfGdJKnq2UU4tAEgGb8H+Q9n8syRXIjaI3KuVCqGIi4QGHFmxWenPFfjF/vRuPd0EpzUNwmqfUxLBWLpGhv+dLnqiEOBW41Zdc0OO0St6E+JeIeHlRZAR+E13Isv9eS09xNbF0qQXWIyNUi+ucLr5VuZnPGXBrSfvwX8f0QebTwpy1tT2zvQiMM2MBugKH6NuMzzuvEsXeD+6+3VRqL"}]}
+
+    	 *
+    	 * @return 返回是否调用成功
+    	 *      0   - 成功
+    	 *      !=0 - 失败	
+    	 */		
+    	 int GetChatData(WeWorkFinanceSdk_t* sdk, unsigned long long seq, unsigned int limit, const char *proxy,const char* passwd, int timeout,Slice_t* chatDatas);
+    """
+    dll.GetChatData.argtypes = [ctypes.c_void_p, ctypes.c_ulonglong, ctypes.c_int, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int, ctypes.POINTER(Slice)]
+    dll.GetChatData.restype = ctypes.c_int
+
+    """
+    	/**
+         * @brief 解析密文.企业微信自有解密内容
+         * @param [in]  encrypt_key, getchatdata返回的encrypt_random_key,使用企业自持对应版本秘钥RSA解密后的内容
+         * @param [in]  encrypt_msg, getchatdata返回的encrypt_chat_msg
+         * @param [out] msg, 解密的消息明文
+    	 * @return 返回是否调用成功
+    	 *      0   - 成功
+    	 *      !=0 - 失败
+         */
+    	 int DecryptData(const char* encrypt_key, const char* encrypt_msg, Slice_t* msg);
+    """
+    dll.DecryptData.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.POINTER(Slice)]
+    dll.DecryptData.restype = ctypes.c_int
+
+    """
+    	/**
+    	 * 拉取媒体消息函数
+    	 * Return值=0表示该API调用成功
+    	 * 
+    	 *
+    	 * @param [in]  sdk				NewSdk返回的sdk指针
+    	 * @param [in]  sdkFileid		从GetChatData返回的聊天消息中，媒体消息包括的sdkfileid
+    	 * @param [in]  proxy			使用代理的请求，需要传入代理的链接。如：socks5://10.0.0.1:8081 或者 http://10.0.0.1:8081
+    	 * @param [in]  passwd			代理账号密码，需要传入代理的账号密码。如 user_name:passwd_123
+    	 * @param [in]  indexbuf		媒体消息分片拉取，需要填入每次拉取的索引信息。首次不需要填写，默认拉取512k，后续每次调用只需要将上次调用返回的outindexbuf填入即可。
+    	 * @param [in]  timeout			超时时间，单位秒
+    	 * @param [out] media_data		返回本次拉取的媒体数据.MediaData结构体.内容包括data(数据内容)/outindexbuf(下次索引)/is_finish(拉取完成标记)
+
+    	 *
+    	 * @return 返回是否调用成功
+    	 *      0   - 成功
+    	 *      !=0 - 失败
+    	 */
+    	 int GetMediaData(WeWorkFinanceSdk_t* sdk, const char* indexbuf,
+                         const char* sdkFileid,const char *proxy,const char* passwd, int timeout, MediaData_t* media_data);
+    """
+    dll.GetMediaData.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int, ctypes.POINTER(MediaData)]
+    dll.GetMediaData.restype = ctypes.c_int
+
+    """
+        /**
+         * @brief 释放sdk，和NewSdk成对使用
+         * @return 
+         */
+    	 void DestroySdk(WeWorkFinanceSdk_t* sdk);
+    """
+    dll.DestroySdk.argtypes = [ctypes.c_void_p]
+
+    """
+        //--------------下面接口为了其他语言例如python等调用c接口，酌情使用--------------
+        Slice_t* NewSlice();
+    """
+    dll.NewSlice.restype = ctypes.POINTER(Slice)
+    """
+        /**
+         * @brief 释放slice，和NewSlice成对使用
+         * @return 
+         */
+    	 void FreeSlice(Slice_t* slice);
+    """
+    dll.FreeSlice.argtypes = [ctypes.POINTER(Slice)]
+
+    """
+        /**
+         * @brief 为其他语言提供读取接口
+         * @return 返回buf指针
+         *     !=NULL - 成功
+         *     NULL   - 失败
+         */
+    	 char* GetContentFromSlice(Slice_t* slice);
+    """
+    dll.GetContentFromSlice.argtypes = [ctypes.POINTER(Slice)]
+    dll.GetContentFromSlice.restype = ctypes.c_char_p
+
+    """
+    	 int GetSliceLen(Slice_t* slice);
+    """
+    dll.GetSliceLen.argtypes = [ctypes.POINTER(Slice)]
+    dll.GetSliceLen.restype = ctypes.c_int
+
+
+    """
+         // 媒体记录工具
+         MediaData_t*  NewMediaData();
+         void FreeMediaData(MediaData_t* media_data);
+    	 char* GetOutIndexBuf(MediaData_t* media_data);
+    	 char* GetData(MediaData_t* media_data);
+    	 int GetIndexLen(MediaData_t* media_data);
+    	 int GetDataLen(MediaData_t* media_data);
+    	 int IsMediaDataFinish(MediaData_t* media_data);
+    """
+    dll.NewMediaData.restype = ctypes.POINTER(MediaData)
+    dll.FreeMediaData.argtypes = [ctypes.POINTER(MediaData)]
+    dll.GetOutIndexBuf.argtypes = [ctypes.POINTER(MediaData)]
+    dll.GetOutIndexBuf.restype = ctypes.c_char_p
+    dll.GetData.argtypes = [ctypes.POINTER(MediaData)]
+    dll.GetData.restype = ctypes.c_void_p
+    dll.GetIndexLen.argtypes = [ctypes.POINTER(MediaData)]
+    dll.GetIndexLen.restype = ctypes.c_int
+    dll.GetDataLen.argtypes = [ctypes.POINTER(MediaData)]
+    dll.GetDataLen.restype = ctypes.c_int
+    dll.IsMediaDataFinish.argtypes = [ctypes.POINTER(MediaData)]
+    dll.IsMediaDataFinish.restype = ctypes.c_int
+    return dll
+
+
+def slice_bytes(slice_ptr):
+    """
+    读取Slice中的数据，只拷贝一次
+
+    Args:
+        slice_ptr: NewSlice返回的Slice指针
+
+    Returns:
+        bytes: Slice中的数据
+    """
+    length = slice_ptr.contents.len
+    if not slice_ptr.contents.buf or length <= 0:
+        return b""
+    return ctypes.string_at(slice_ptr.contents.buf, length)
+
+
+def media_chunk_view(media_data):
+    """
+    以memoryview直接引用MediaData中的分片数据，不做拷贝
+    返回的memoryview只在FreeMediaData之前有效，必须在释放前用完
+
+    Args:
+        media_data: NewMediaData返回的MediaData指针
+
+    Returns:
+        memoryview: 分片数据
+    """
+    length = media_data.contents.data_len
+    if not media_data.contents.data or length <= 0:
+        return memoryview(b"")
+    return memoryview((ctypes.c_char * length).from_address(media_data.contents.data)).cast("B")
+
+
+# 需要销毁并重新初始化SDK实例的错误码: 10001网络错误, 10003系统失败
+REINIT_ERROR_CODES = (10001, 10003)
+# 每个线程复用的索引缓冲区初始大小，indexbuf一般形如"Range:bytes=524288-1048575"
+INDEX_BUF_SIZE = 256
+
+
+@functools.lru_cache(maxsize=256)
+def _encode_arg(value):
+    # proxy/passwd等参数每次调用都相同，编码结果缓存复用
+    return value.encode()
+
+
+def _reuse_handles_enabled():
+    # 句柄复用依赖下方NativeHandles说明的所有权假设，验证之前默认关闭
+    # 本模块可脱离项目单独运行(见文件末尾示例)，开关在此直接解析，不依赖utils包
+    return os.getenv('finance_sdk_reuse_handles', '0').lower() in ('1', 'true', 'yes')
+
+
+def _free_handles(sdk_dll, slice_ptr, media_data):
+    if slice_ptr is not None:
+        sdk_dll.FreeSlice(slice_ptr)
+    if media_data is not None:
+        sdk_dll.FreeMediaData(media_data)
+
+
+class FinanceSdkError(Exception):
+    """
+    会话存档SDK调用失败，code为SDK返回的错误码
+    """
+
+    def __init__(self, message, code):
+        super().__init__(message)
+        self.code = code
+
+
+class NativeHandles:
+    """
+    单个线程复用的Slice/MediaData与索引缓冲区
+    线程结束或对象被回收时释放原生内存，调用出错时丢弃对应句柄，下次使用时重新创建
+    默认每次SDK调用后释放，媒体文件的每个分片都使用新的MediaData，环境变量finance_sdk_reuse_handles=1时开启复用
+
+    复用基于以下所有权假设，SDK文档并未明确保证，换用新版本SDK时需要重新验证:
+    1. GetChatData/GetMediaData每次调用都会覆盖Slice/MediaData中的buf并自行释放上一次的内容，
+       不会因为重复传入同一个句柄而泄漏或重复释放
+    2. Slice/MediaData只由本对象通过FreeSlice/FreeMediaData释放，SDK不会在内部保留或释放它们
+    3. GetContentFromSlice与MediaData.data返回的指针在下一次调用前有效，
+       调用方必须在同一线程的下一次调用之前复制出内容，不能持有指针
+    4. 句柄只在创建它的线程中使用(由threading.local保证)，不与其他线程或SDK实例共享
+    """
+
+    def __init__(self):
+        self.sdk_dll = load_sdk()
+        self.slice_ptr = None
+        self.media_data = None
+        self.index_buf = ctypes.create_string_buffer(INDEX_BUF_SIZE)
+        self._finalizer = None
+
+    def _refresh_finalizer(self):
+        if self._finalizer is not None:
+            self._finalizer.detach()
+        self._finalizer = weakref.finalize(self, _free_handles, self.sdk_dll, self.slice_ptr, self.media_data)
+
+    def get_slice(self):
+        if self.slice_ptr is None:
+            self.slice_ptr = self.sdk_dll.NewSlice()
+            self._refresh_finalizer()
+        return self.slice_ptr
+
+    def get_media_data(self):
+        if self.media_data is None:
+            self.media_data = self.sdk_dll.NewMediaData()
+            self._refresh_finalizer()
+        return self.media_data
+
+    def discard_slice(self):
+        if self.slice_ptr is not None:
+            self.sdk_dll.FreeSlice(self.slice_ptr)
+            self.slice_ptr = None
+            self._refresh_finalizer()
+
+    def discard_media_data(self):
+        if self.media_data is not None:
+            self.sdk_dll.FreeMediaData(self.media_data)
+            self.media_data = None
+            self._refresh_finalizer()
+
+    def reset_index(self):
+        self.index_buf.value = b""
+
+    def set_index(self, media_data):
+        """保存下一次调用的indexbuf，超出缓冲区大小时扩容"""
+        out_len = media_data.contents.out_len
+        if out_len + 1 > ctypes.sizeof(self.index_buf):
+            self.index_buf = ctypes.create_string_buffer(out_len * 2)
+        self.index_buf.value = media_data.contents.outindexbuf[:out_len]
+
+    def release(self):
+        """不复用句柄时，每次调用结束(媒体文件为每个分片读取完)后释放"""
+        if not _reuse_handles_enabled():
+            self.discard_slice()
+            self.discard_media_data()
+
+
+_thread_handles = threading.local()
+
+
+def thread_handles():
+    """
+    获取当前线程的原生句柄
+
+    Returns:
+        NativeHandles: 当前线程复用的句柄
+    """
+    handles = getattr(_thread_handles, "handles", None)
+    if handles is None:
+        handles = NativeHandles()
+        _thread_handles.handles = handles
+    return handles
+
 
 class WeWorkFinanceSdk:
     def __init__(self, corp_id_, corp_key_):
+        sdk_dll = load_sdk()
         self.sdk = sdk_dll.NewSdk()
         ret = sdk_dll.Init(self.sdk, corp_id_.encode(), corp_key_.encode())
         if ret != 0:
-            raise Exception(f"Init SDK failed with error code: {ret}")
+            raise FinanceSdkError(f"Init SDK failed with error code: {ret}", ret)
 
 
     def get_chat_data(self, seq, limit, proxy="", passwd="", timeout=30, max_retries=3):
@@ -202,83 +388,102 @@ class WeWorkFinanceSdk:
         :param timeout:
         :return:
         """
-        chat_datas = sdk_dll.NewSlice()
-        ret = sdk_dll.GetChatData(self.sdk, seq, limit, proxy.encode(), passwd.encode(), timeout, chat_datas)
+        sdk_dll = load_sdk()
+        handles = thread_handles()
+        proxy_, passwd_ = _encode_arg(proxy), _encode_arg(passwd)
+        chat_datas = handles.get_slice()
+        ret = sdk_dll.GetChatData(self.sdk, seq, limit, proxy_, passwd_, timeout, chat_datas)
         retries = 0
         while ret != 0 and ret == 10001 and retries < max_retries:
             print(f"GetChatData err ret: {ret}, retrying ({retries + 1}/{max_retries})...")
             time.sleep(3)
-            ret = sdk_dll.GetChatData(self.sdk, seq, limit, proxy.encode(), passwd.encode(), timeout, chat_datas)
+            ret = sdk_dll.GetChatData(self.sdk, seq, limit, proxy_, passwd_, timeout, chat_datas)
             retries += 1
 
         if ret != 0:
             print(f"Get data failed, return code: {ret}.")
-            sdk_dll.FreeSlice(chat_datas)
-            raise Exception(f"Get data failed with error code: {ret}")
-        data = chat_datas.contents.buf[:chat_datas.contents.len]
-        length_ = chat_datas.contents.len
-        sdk_dll.FreeSlice(chat_datas)
-        return data, length_
+            handles.discard_slice()
+            raise FinanceSdkError(f"Get data failed with error code: {ret}", ret)
+        try:
+            data = slice_bytes(chat_datas)
+        finally:
+            handles.release()
+        return data, len(data)
 
 
     def pull_media_file(self, file_id:str, proxy="", passwd="", timeout=30, max_retries=3):
-        index_buf = ctypes.create_string_buffer(512 * 1024)
+        sdk_dll = load_sdk()
+        handles = thread_handles()
+        handles.reset_index()
+        file_id_, proxy_, passwd_ = file_id.encode(), _encode_arg(proxy), _encode_arg(passwd)
         total_data = bytearray()
         is_finish = 0
         retries = 0
+        ret = 0
         while not is_finish and retries < max_retries:
-            media_data = sdk_dll.NewMediaData()
-            ret = sdk_dll.GetMediaData(self.sdk, index_buf.raw, file_id.encode(), proxy.encode(), passwd.encode(), timeout, media_data)
-            if ret != 0:
-                print(f"PullMediaData err ret: {ret}, retrying ({retries + 1}/{max_retries})...")
-                retries += 1
-                sdk_dll.FreeMediaData(media_data)
-                time.sleep(3)
-                continue
-            # 获取二进制数据
-            data = ctypes.string_at(media_data.contents.data, media_data.contents.data_len)
-            # 存放到内存中
-            total_data.extend(data)
-            # 获取下一次调用的index_buf
-            index_buf.raw = media_data.contents.outindexbuf[:media_data.contents.out_len]
-            # 获取finish标记
-            is_finish = media_data.contents.is_finish
-            # 释放内存
-            sdk_dll.FreeMediaData(media_data)
-        return bytes(total_data), len(total_data)
+            media_data = handles.get_media_data()
+            try:
+                ret = sdk_dll.GetMediaData(self.sdk, handles.index_buf, file_id_, proxy_, passwd_, timeout, media_data)
+                if ret != 0:
+                    print(f"PullMediaData err ret: {ret}, retrying ({retries + 1}/{max_retries})...")
+                    retries += 1
+                    handles.discard_media_data()
+                    time.sleep(3)
+                    continue
+                # 二进制数据直接从SDK内存拷贝到total_data
+                total_data.extend(media_chunk_view(media_data))
+                # 获取下一次调用的index_buf
+                handles.set_index(media_data)
+                # 获取finish标记
+                is_finish = media_data.contents.is_finish
+            finally:
+                # 不复用句柄时每个分片读取完即释放，下一个分片使用新的MediaData
+                handles.release()
+        if not is_finish:
+            raise FinanceSdkError(f"Pull media data failed with error code: {ret}", ret)
+        # 直接返回bytearray，避免再拷贝一次
+        return total_data, len(total_data)
 
 
     def download_media_file(self, file_id:str, file_save_path:str, md5sum="", proxy="", passwd="", timeout=30, max_retries=3):
+        sdk_dll = load_sdk()
         # 媒体文件每次拉取的最大size为512k，因此超过512k的文件需要分片拉取。若该文件未拉取完整，mediaData中的is_finish会返回0，同时mediaData中的outindexbuf会返回下次拉取需要传入GetMediaData的indexbuf。
         # indexbuf一般格式如右侧所示，”Range:bytes=524288-1048575“，表示这次拉取的是从524288到1048575的分片。单个文件首次拉取填写的indexbuf为空字符串，拉取后续分片时直接填入上次返回的indexbuf即可。
-        index_buf, is_finish, retries = ctypes.create_string_buffer(512 * 1024), 0, 0
+        handles, is_finish, retries = thread_handles(), 0, 0
+        handles.reset_index()
+        file_id_, proxy_, passwd_ = file_id.encode(), _encode_arg(proxy), _encode_arg(passwd)
         file_save_path_tmp = f'{file_save_path}.wxtmp'
         if len(md5sum) > 0:
             hmd5 = hashlib.md5()
 
-        while not is_finish and retries < max_retries:
-            media_data = sdk_dll.NewMediaData()
-            ret = sdk_dll.GetMediaData(self.sdk, index_buf.raw, file_id.encode(), proxy.encode(), passwd.encode(), timeout, media_data)
-            if ret != 0:
-                print(f"PullMediaData err ret: {ret}, retrying ({retries + 1}/{max_retries})...")
-                retries += 1
-                # 单个分片拉取失败建议重试拉取该分片，避免从头开始拉取。
-                sdk_dll.FreeMediaData(media_data)
-                time.sleep(3)
-                continue
-             # 二进制数据写入文件
-            with open(file_save_path_tmp, 'ab') as dstf:
-                data = ctypes.string_at(media_data.contents.data, media_data.contents.data_len)
-                dstf.write(ctypes.string_at(media_data.contents.data, media_data.contents.data_len))
-                if len(md5sum) > 0:
-                    hmd5.update(data)
-            
-            # 获取下一次调用的index_buf
-            index_buf.raw = media_data.contents.outindexbuf[:media_data.contents.out_len]
-            # 获取finish标记
-            is_finish = media_data.contents.is_finish
-            # 释放内存
-            sdk_dll.FreeMediaData(media_data)
+        with open(file_save_path_tmp, 'wb') as dstf:
+            while not is_finish and retries < max_retries:
+                media_data = handles.get_media_data()
+                try:
+                    ret = sdk_dll.GetMediaData(self.sdk, handles.index_buf, file_id_, proxy_, passwd_, timeout, media_data)
+                    if ret != 0:
+                        print(f"PullMediaData err ret: {ret}, retrying ({retries + 1}/{max_retries})...")
+                        retries += 1
+                        # 单个分片拉取失败建议重试拉取该分片，避免从头开始拉取。
+                        handles.discard_media_data()
+                        time.sleep(3)
+                        continue
+                    # 二进制数据直接从SDK内存写入文件
+                    data = media_chunk_view(media_data)
+                    try:
+                        dstf.write(data)
+                        if len(md5sum) > 0:
+                            hmd5.update(data)
+                    finally:
+                        data.release()
+
+                    # 获取下一次调用的index_buf
+                    handles.set_index(media_data)
+                    # 获取finish标记
+                    is_finish = media_data.contents.is_finish
+                finally:
+                    # 不复用句柄时每个分片写入完即释放，下一个分片使用新的MediaData
+                    handles.release()
 
         md5_check_success = True
         if len(md5sum) > 0:
@@ -302,24 +507,162 @@ class WeWorkFinanceSdk:
         :param encrypt_chat_msg:
         :return:
         """
-        msgs = sdk_dll.NewSlice()
+        sdk_dll = load_sdk()
+        handles = thread_handles()
+        msgs = handles.get_slice()
         ret = sdk_dll.DecryptData(encrypt_key.encode(), encrypt_chat_msg.encode(), msgs)
         if ret != 0:
             print("Decrypt data failed.")
-            sdk_dll.FreeSlice(msgs)
-            raise Exception(f"Decrypt data failed with error code: {ret}")
+            handles.discard_slice()
+            raise FinanceSdkError(f"Decrypt data failed with error code: {ret}", ret)
 
-        data = msgs.contents.buf[:msgs.contents.len]
-        length_ = msgs.contents.len
-        sdk_dll.FreeSlice(msgs)
-        return data, length_
+        try:
+            data = slice_bytes(msgs)
+        finally:
+            handles.release()
+        return data, len(data)
 
     def destroy_sdk(self):
+        sdk_dll = load_sdk()
         sdk_dll.DestroySdk(self.sdk)
 
 
+class WeWorkFinanceSdkPool:
+    """
+    会话存档SDK实例池
+    每个实例独立NewSdk+Init，同一时刻只借给一个线程使用，用于并行拉取媒体文件
+    调用返回网络/系统类错误码的实例在归还时销毁并重新初始化
+    """
+
+    def __init__(self, corp_id_, corp_key_, size=2, factory=None):
+        """
+        初始化SDK实例池
+
+        Args:
+            corp_id_: 企业ID
+            corp_key_: 会话存档密钥
+            size (int): 实例数量
+            factory (callable, optional): 以(corp_id, corp_key)调用创建实例，默认使用WeWorkFinanceSdk
+        """
+        self.corp_id = corp_id_
+        self.corp_key = corp_key_
+        self.size = size
+        self.factory = factory or WeWorkFinanceSdk
+        self.reinit_count = 0
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        for _ in range(size):
+            self._idle.put(self.factory(corp_id_, corp_key_))
+
+    def checkout(self, timeout=None):
+        """
+        借出一个SDK实例，没有空闲实例时等待
+
+        Args:
+            timeout (float, optional): 最长等待时间(秒)，默认一直等待
+
+        Returns:
+            SDK实例
+        """
+        if self._closed:
+            raise RuntimeError("SDK pool is closed")
+        return self._idle.get(timeout=timeout)
+
+    def checkin(self, sdk, error_code=None):
+        """
+        归还SDK实例，error_code为需要重新初始化的错误码时先重建实例
+
+        Args:
+            sdk: checkout借出的实例
+            error_code (int, optional): 使用该实例时SDK返回的错误码
+        """
+        if self._closed:
+            self._destroy(sdk)
+            return
+        if error_code in REINIT_ERROR_CODES:
+            sdk = self.reinit(sdk)
+        self._idle.put(sdk)
+
+    def reinit(self, sdk):
+        """
+        销毁实例并重新初始化，初始化失败时继续使用原实例
+
+        Returns:
+            SDK实例
+        """
+        try:
+            new_sdk = self.factory(self.corp_id, self.corp_key)
+        except Exception as e:
+            print(f"Reinit SDK failed: {e}")
+            return sdk
+        self._destroy(sdk)
+        with self._lock:
+            self.reinit_count += 1
+        return new_sdk
+
+    def health_check(self, seq=0, timeout=10):
+        """
+        逐个检查空闲实例，拉取1条消息失败的实例重新初始化
+
+        Args:
+            seq (int): 检查时使用的seq，建议传入当前已处理的最大seq
+            timeout (int): 单次调用超时(秒)
+
+        Returns:
+            int: 重新初始化的实例数量
+        """
+        reinitialized = 0
+        for _ in range(self._idle.qsize()):
+            try:
+                sdk = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                sdk.get_chat_data(seq, 1, timeout=timeout, max_retries=0)
+                self._idle.put(sdk)
+            except Exception:
+                self._idle.put(self.reinit(sdk))
+                reinitialized += 1
+        return reinitialized
+
+    @contextmanager
+    def instance(self, timeout=None):
+        """
+        借出实例的上下文管理器，退出时自动归还，发生FinanceSdkError时按错误码决定是否重建
+        """
+        sdk = self.checkout(timeout)
+        error_code = None
+        try:
+            yield sdk
+        except FinanceSdkError as e:
+            error_code = e.code
+            raise
+        finally:
+            self.checkin(sdk, error_code)
+
+    @staticmethod
+    def _destroy(sdk):
+        try:
+            sdk.destroy_sdk()
+        except Exception as e:
+            print(f"Destroy SDK failed: {e}")
+
+    def close(self):
+        """销毁所有空闲实例，借出中的实例在归还时销毁"""
+        self._closed = True
+        while True:
+            try:
+                self._destroy(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+
 # 示例调用
 if __name__ == "__main__":
+    from Crypto.Cipher import PKCS1_v1_5
+    from Crypto.PublicKey import RSA
+
     corp_id = os.environ.get('corpid', '')
     corp_key = os.environ.get('secret', '')
     # 有私钥才能看明文
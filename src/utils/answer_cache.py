@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+知识库问答缓存
+按归一化后的问题与知识库版本缓存Dify回答，进程内LRU缓存在前，wecom_answer_cache表持久化在后
+知识库更新后修改kb_version即可使旧回答全部失效，也可按问题单独失效
+进程内缓存只保留memory_ttl秒，其他进程(如下方命令行)失效的回答在此时间内对运行中的机器人生效
+命中次数在内存中累计，由flush_hits批量写回数据库，查询缓存时不写数据库
+
+用法(在src目录下):
+    python -m utils.answer_cache invalidate                       # 失效当前知识库版本的全部回答
+    python -m utils.answer_cache invalidate --query "SPD系统如何登录"  # 失效单个问题
+    python -m utils.answer_cache purge                            # 清理过期与超出数量上限的回答
+"""
+import os
+import hashlib
+import threading
+import logging
+import argparse
+from sqlalchemy import text
+from dotenv import load_dotenv
+from utils.cache_utils import TTLCache
+from utils.single_flight import normalize_query
+
+load_dotenv()
+logger = logging.getLogger('WeComBot')
+
+
+def query_key(query):
+    """
+    计算问题的缓存键
+
+    Args:
+        query (str): 用户问题
+
+    Returns:
+        str: 归一化问题的sha1
+    """
+    return hashlib.sha1(normalize_query(query).encode('utf-8')).hexdigest()
+
+
+class AnswerCache:
+    """
+    问答缓存
+    """
+
+    def __init__(self, engine_getter, kb_version="1", ttl=24 * 60 * 60, maxsize=512, max_rows=10000, memory_ttl=60):
+        """
+        初始化问答缓存
+
+        Args:
+            engine_getter (callable): 返回sqlalchemy引擎的函数，首次使用数据库时调用
+            kb_version (str): 知识库版本，参与缓存键
+            ttl (int): 回答的存活时间(秒)
+            maxsize (int): 进程内缓存的最大条目数
+            max_rows (int): 数据库中保留的最大条目数，超出时按最近命中时间淘汰
+            memory_ttl (int): 进程内缓存的存活时间(秒)，决定其他进程的失效操作多久后生效
+        """
+        self.engine_getter = engine_getter
+        self.kb_version = kb_version
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.memory_ttl = min(memory_ttl, ttl)
+        self.memory = TTLCache(maxsize=maxsize, ttl=self.memory_ttl)
+        # 尚未写回数据库的命中次数，query_key -> 次数
+        self.pending_hits = {}
+        self.hits_lock = threading.Lock()
+
+    def _record_hit(self, key):
+        with self.hits_lock:
+            self.pending_hits[key] = self.pending_hits.get(key, 0) + 1
+
+    def get(self, query):
+        """
+        查询缓存的回答
+
+        Args:
+            query (str): 用户问题
+
+        Returns:
+            str: 缓存的回答，未命中时为None
+        """
+        key = query_key(query)
+        answer = self.memory.get(key)
+        if answer is not None:
+            self._record_hit(key)
+            return answer
+        try:
+            with self.engine_getter().connect() as con:
+                row = con.execute(
+                    text("SELECT answer, EXTRACT(EPOCH FROM expires_at - CURRENT_TIMESTAMP) FROM wecom_answer_cache "
+                         "WHERE query_key = :query_key AND kb_version = :kb_version AND expires_at > CURRENT_TIMESTAMP"),
+                    {"query_key": key, "kb_version": self.kb_version}
+                ).fetchone()
+        except Exception as e:
+            logger.error(f"读取问答缓存失败: {str(e)}")
+            return None
+        if row is None:
+            return None
+        self._record_hit(key)
+        # 进程内缓存不超过memory_ttl与数据库中剩余的存活时间
+        self.memory.set(key, row[0], ttl=max(min(float(row[1]), self.memory_ttl), 1.0))
+        return row[0]
+
+    def flush_hits(self):
+        """
+        将累计的命中次数批量写回数据库，最近命中时间记为写回时间
+
+        Returns:
+            int: 写回的问题数
+        """
+        with self.hits_lock:
+            pending, self.pending_hits = self.pending_hits, {}
+        if not pending:
+            return 0
+        try:
+            with self.engine_getter().begin() as con:
+                con.execute(
+                    text("UPDATE wecom_answer_cache SET hits = hits + :hits, last_hit_at = CURRENT_TIMESTAMP "
+                         "WHERE query_key = :query_key AND kb_version = :kb_version"),
+                    [{"query_key": key, "kb_version": self.kb_version, "hits": hits} for key, hits in pending.items()]
+                )
+        except Exception as e:
+            logger.error(f"写回问答缓存命中次数失败: {str(e)}")
+            return 0
+        return len(pending)
+
+    def set(self, query, answer):
+        """
+        写入回答
+
+        Args:
+            query (str): 用户问题
+            answer (str): 完整回答
+        """
+        key = query_key(query)
+        self.memory.set(key, answer)
+        try:
+            with self.engine_getter().begin() as con:
+                con.execute(
+                    text("INSERT INTO wecom_answer_cache (query_key, kb_version, query, answer, expires_at) "
+                         "VALUES (:query_key, :kb_version, :query, :answer, CURRENT_TIMESTAMP + make_interval(secs => :ttl)) "
+                         "ON CONFLICT (query_key, kb_version) DO UPDATE SET "
+                         "query = EXCLUDED.query, answer = EXCLUDED.answer, created_at = CURRENT_TIMESTAMP, "
+                         "last_hit_at = CURRENT_TIMESTAMP, expires_at = EXCLUDED.expires_at"),
+                    {"query_key": key, "kb_version": self.kb_version, "query": normalize_query(query),
+                     "answer": answer, "ttl": self.ttl}
+                )
+        except Exception as e:
+            logger.error(f"写入问答缓存失败: {str(e)}")
+
+    def invalidate(self, query=None):
+        """
+        使回答失效
+
+        Args:
+            query (str, optional): 指定问题，为None时失效当前知识库版本的全部回答
+
+        Returns:
+            int: 删除的数据库条目数
+        """
+        params = {"kb_version": self.kb_version}
+        sql = "DELETE FROM wecom_answer_cache WHERE kb_version = :kb_version"
+        if query is None:
+            self.memory.clear()
+        else:
+            params["query_key"] = query_key(query)
+            self.memory.pop(params["query_key"])
+            sql += " AND query_key = :query_key"
+        with self.engine_getter().begin() as con:
+            return con.execute(text(sql), params).rowcount
+
+    def purge(self):
+        """
+        删除过期的回答、旧知识库版本的回答，以及超出max_rows的最久未命中的回答
+
+        Returns:
+            int: 删除的数据库条目数
+        """
+        # 先写回命中次数，按最近命中时间淘汰时不误删近期常用的回答
+        self.flush_hits()
+        with self.engine_getter().begin() as con:
+            deleted = con.execute(
+                text("DELETE FROM wecom_answer_cache WHERE expires_at <= CURRENT_TIMESTAMP OR kb_version <> :kb_version"),
+                {"kb_version": self.kb_version}
+            ).rowcount
+            deleted += con.execute(
+                text("DELETE FROM wecom_answer_cache WHERE (query_key, kb_version) IN ("
+                     "SELECT query_key, kb_version FROM wecom_answer_cache ORDER BY last_hit_at DESC OFFSET :max_rows)"),
+                {"max_rows": self.max_rows}
+            ).rowcount
+        return deleted
+
+
+def create_answer_cache(engine_getter):
+    """
+    按环境变量创建问答缓存，answer_cache_ttl为0时不启用
+
+    Args:
+        engine_getter (callable): 返回sqlalchemy引擎的函数
+
+    Returns:
+        AnswerCache: 问答缓存，未启用时为None
+    """
+    ttl = int(os.getenv('answer_cache_ttl', 24 * 60 * 60))
+    if ttl <= 0:
+        return None
+    return AnswerCache(
+        engine_getter,
+        kb_version=os.getenv('kb_version', '1'),
+        ttl=ttl,
+        maxsize=int(os.getenv('answer_cache_size', 512)),
+        max_rows=int(os.getenv('answer_cache_max_rows', 10000)),
+        memory_ttl=int(os.getenv('answer_cache_memory_ttl', 60))
+    )
+
+
+if __name__ == "__main__":
+    from utils.db import get_engine
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="知识库问答缓存工具")
+    parser.add_argument("command", choices=["invalidate", "purge"])
+    parser.add_argument("--query", help="只失效指定问题")
+    args = parser.parse_args()
+
+    cache = create_answer_cache(get_engine) or AnswerCache(get_engine, kb_version=os.getenv('kb_version', '1'))
+    if args.command == "invalidate":
+        logger.info(f"已失效 {cache.invalidate(args.query)} 条回答")
+    else:
+        logger.info(f"已清理 {cache.purge()} 条回答")
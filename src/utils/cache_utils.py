@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+缓存工具
+提供线程安全、容量有上限、支持过期时间的LRU缓存
+"""
+import time
+import threading
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    线程安全的LRU缓存
+    超过容量时淘汰最久未使用的条目，超过ttl的条目在访问时视为不存在
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, refresh_on_get=False):
+        """
+        初始化缓存
+
+        Args:
+            maxsize (int): 最大条目数
+            ttl (float, optional): 条目存活时间(秒)，为None时不过期
+            refresh_on_get (bool): 命中时是否刷新过期时间，为True时ttl即空闲超时时间
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.refresh_on_get = refresh_on_get
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _expired(self, expire_at, now):
+        return expire_at is not None and expire_at <= now
+
+    def get(self, key, default=None):
+        """
+        获取缓存值
+
+        Args:
+            key: 缓存键
+            default: 未命中时的返回值
+
+        Returns:
+            缓存值或default
+        """
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or self._expired(item[1], now):
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            value, expire_at = item
+            if self.refresh_on_get and self.ttl is not None:
+                self._data[key] = (value, now + self.ttl)
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        写入缓存值
+
+        Args:
+            key: 缓存键
+            value: 缓存值
+            ttl (float, optional): 覆盖默认的存活时间(秒)
+        """
+        ttl = self.ttl if ttl is None else ttl
+        expire_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expire_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def setdefault(self, key, value, ttl=None):
+        """
+        键不存在或已过期时写入value，检查与写入在同一把锁内完成
+
+        Args:
+            key: 缓存键
+            value: 要写入的值
+            ttl (float, optional): 覆盖默认的存活时间(秒)
+
+        Returns:
+            tuple: (缓存中的值, 是否为本次写入)
+        """
+        ttl = self.ttl if ttl is None else ttl
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and not self._expired(item[1], now):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[0], False
+            self.misses += 1
+            self._data[key] = (value, now + ttl if ttl is not None else None)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            return value, True
+
+    def pop(self, key, default=None):
+        """删除并返回缓存值"""
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[0]
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            return item is not None and not self._expired(item[1], now)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
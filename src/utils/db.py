@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数据库连接层
+同一进程内按db_url共享一个sqlalchemy引擎，统一连接池大小、溢出、预检测和语句超时配置
+可选对高频插入/查询使用服务端预编译语句，并统计连接池指标
+"""
+import os
+import re
+import time
+import threading
+import logging
+import sqlalchemy
+from sqlalchemy import event, text
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from dotenv import load_dotenv
+from utils.env_utils import env_flag
+
+load_dotenv()
+logger = logging.getLogger('WeComBot')
+
+# 高频语句，开启db_prepared_statements时在每个新连接上PREPARE
+HOT_STATEMENTS = {
+    "wecom_insert_message": (
+        "INSERT INTO wecom_messages (msgid, action, \"from\", tolist, roomid, chat_name, msgtime, msgtype, content) "
+        "VALUES (:msgid, :action, :from_userid, :tolist, :roomid, :chat_name, :msgtime, :msgtype, :content)"
+    ),
+    "wecom_message_exists": "SELECT 1 FROM wecom_messages WHERE msgid = :msgid AND msgtype = :msgtype",
+}
+PARAM_PATTERN = re.compile(r"(?<!:):(\w+)")
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+class MeteredQueuePool(QueuePool):
+    """
+    记录获取连接等待时间的连接池
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._metrics_lock = threading.Lock()
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+
+    def _do_get(self):
+        start_time = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            with self._metrics_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start_time
+            with self._metrics_lock:
+                self.wait_count += 1
+                self.wait_total += elapsed
+                self.wait_max = max(self.wait_max, elapsed)
+
+
+def _positional_sql(sql):
+    """将:name形式的参数转换为PREPARE使用的$n形式，返回(sql, 参数名顺序)"""
+    names = []
+    def replace(match):
+        name = match.group(1)
+        if name not in names:
+            names.append(name)
+        return f"${names.index(name) + 1}"
+    return PARAM_PATTERN.sub(replace, sql), names
+
+
+def _create_engine(db_url):
+    connect_args = {}
+    statement_timeout = int(os.getenv('db_statement_timeout', 30000))
+    if statement_timeout > 0:
+        # 单位毫秒，防止慢查询长期占用连接
+        connect_args["options"] = f"-c statement_timeout={statement_timeout}"
+    engine = sqlalchemy.create_engine(
+        db_url,
+        poolclass=MeteredQueuePool,
+        pool_size=int(os.getenv('db_pool_size', 5)),
+        max_overflow=int(os.getenv('db_max_overflow', 10)),
+        pool_timeout=float(os.getenv('db_pool_timeout', 30)),
+        pool_recycle=int(os.getenv('db_pool_recycle', 1800)),
+        pool_pre_ping=env_flag('db_pool_pre_ping', "1"),
+        connect_args=connect_args
+    )
+    engine.prepared_statements = env_flag('db_prepared_statements')
+    if engine.prepared_statements:
+        @event.listens_for(engine, "connect")
+        def _prepare_hot_statements(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            try:
+                for name, sql in HOT_STATEMENTS.items():
+                    cursor.execute(f"PREPARE {name} AS {_positional_sql(sql)[0]}")
+            finally:
+                cursor.close()
+            # PREPARE不需要保留在事务中
+            dbapi_connection.commit()
+    logger.info(f"数据库引擎已创建: pool_size={engine.pool.size()}, 预编译语句={engine.prepared_statements}")
+    return engine
+
+
+def get_engine(db_url=None):
+    """
+    获取共享的数据库引擎，同一db_url只创建一次
+
+    Args:
+        db_url (str, optional): 数据库连接URL，默认为None时从环境变量获取
+
+    Returns:
+        sqlalchemy.engine.Engine: 数据库引擎
+    """
+    db_url = db_url or os.getenv('db_url')
+    engine = _engines.get(db_url)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(db_url)
+            if engine is None:
+                engine = _create_engine(db_url)
+                _engines[db_url] = engine
+    return engine
+
+
+def execute_statement(con, name, params):
+    """
+    执行HOT_STATEMENTS中的高频语句，开启预编译时使用EXECUTE
+
+    Args:
+        con: 数据库连接
+        name (str): 语句名
+        params (dict): 语句参数
+
+    Returns:
+        sqlalchemy.engine.CursorResult: 执行结果
+    """
+    sql = HOT_STATEMENTS[name]
+    if getattr(con.engine, "prepared_statements", False):
+        _, names = _positional_sql(sql)
+        return con.execute(text(f"EXECUTE {name}({', '.join(':' + n for n in names)})"), params)
+    return con.execute(text(sql), params)
+
+
+def pool_metrics(engine=None):
+    """
+    获取连接池指标
+
+    Args:
+        engine (optional): 数据库引擎，默认为共享引擎
+
+    Returns:
+        dict: 连接池大小、已借出连接数、溢出数、等待次数与等待时间等
+    """
+    engine = engine or get_engine()
+    pool = engine.pool
+    metrics = {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": pool.overflow(),
+    }
+    if isinstance(pool, MeteredQueuePool):
+        with pool._metrics_lock:
+            metrics.update({
+                "wait_count": pool.wait_count,
+                "wait_avg_ms": pool.wait_total / pool.wait_count * 1000 if pool.wait_count else 0.0,
+                "wait_max_ms": pool.wait_max * 1000,
+                "timeouts": pool.timeouts,
+            })
+    return metrics
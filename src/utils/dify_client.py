@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多节点Dify客户端
+按节点的进行中请求数与首token耗时(EWMA)选择节点，连续失败的节点熔断一段时间后再试探
+可选在首个token超时后向另一个节点发起对冲请求，先输出token的一方胜出
+各节点应为同一Dify应用的副本，会话id在节点之间通用
+"""
+import json
+import time
+import queue
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from utils.metrics import DIFY_HEDGED_REQUESTS, DIFY_FAILOVERS
+
+logger = logging.getLogger('WeComBot')
+
+
+class DifyRequestError(Exception):
+    """
+    Dify返回4xx，请求本身有误(如会话不存在)，换节点重试也不会成功，不计入节点失败
+    """
+
+
+def parse_endpoints(base_urls, api_keys):
+    """
+    解析逗号分隔的节点地址与密钥
+
+    Args:
+        base_urls (str): 逗号分隔的Dify地址
+        api_keys (str): 逗号分隔的密钥，只有一个时所有节点共用
+
+    Returns:
+        list: [(地址, 密钥)]
+    """
+    urls = [url.strip().rstrip('/') for url in (base_urls or "").split(',') if url.strip()]
+    keys = [key.strip() for key in (api_keys or "").split(',') if key.strip()] or [""]
+    if len(keys) not in (1, len(urls)):
+        raise ValueError(f"dify_key数量({len(keys)})与dify_url数量({len(urls)})不一致")
+    return [(url, keys[0] if len(keys) == 1 else keys[i]) for i, url in enumerate(urls)]
+
+
+class DifyEndpoint:
+    """
+    单个Dify节点及其负载、延迟与熔断状态，由DifyClient加锁访问
+    """
+
+    def __init__(self, base_url, api_key, initial_ttft=1.0):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.in_flight = 0
+        self.ewma_ttft = initial_ttft
+        self.failures = 0
+        # 熔断截止时间，为0时节点正常
+        self.open_until = 0.0
+        # 熔断到期后只放行一个试探请求
+        self.probing = False
+
+    def available(self, now):
+        """节点是否可以接收请求"""
+        if not self.open_until:
+            return True
+        return now >= self.open_until and not self.probing
+
+    def score(self):
+        """负载评分，越小越优先"""
+        return (self.in_flight + 1) * self.ewma_ttft
+
+    def __repr__(self):
+        return self.base_url
+
+
+class _Attempt:
+    """
+    向某个节点发起的一次流式请求，在独立线程中读取SSE事件放入共享队列
+    """
+
+    def __init__(self, client, endpoint, payload, user_id, events):
+        self.client = client
+        self.endpoint = endpoint
+        self.cancelled = threading.Event()
+        self.response = None
+        # 成为胜出请求之前收到的事件
+        self.buffer = []
+        self.thread = threading.Thread(target=self._run, args=(payload, user_id, events), daemon=True, name="dify_stream")
+        self.thread.start()
+
+    def cancel(self):
+        self.cancelled.set()
+        response = self.response
+        if response is not None:
+            try:
+                response.close()
+            except Exception:
+                pass
+
+    def _run(self, payload, user_id, events):
+        start_time = time.perf_counter()
+        first_token = False
+        try:
+            self.response = self.client.session.post(
+                f"{self.endpoint.base_url}/chat-messages?user={user_id}",
+                headers={
+                    "Authorization": f"Bearer {self.endpoint.api_key}",
+                    "Content-Type": "application/json"
+                },
+                json=payload,
+                stream=True,
+                timeout=self.client.timeout
+            )
+            if 400 <= self.response.status_code < 500:
+                raise DifyRequestError(f"Dify接口返回异常状态码: {self.response.status_code}")
+            if self.response.status_code != 200:
+                raise Exception(f"Dify接口返回异常状态码: {self.response.status_code}")
+            for line in self.response.iter_lines():
+                if self.cancelled.is_set():
+                    return
+                if not line:
+                    continue
+                line = line.decode('utf-8')
+                if line.startswith("data: "):
+                    line = line[6:]
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if not first_token and event.get('event') == 'message' and event.get('answer'):
+                    first_token = True
+                    self.client.record_ttft(self.endpoint, time.perf_counter() - start_time)
+                events.put((self, "event", event))
+            if not self.cancelled.is_set():
+                self.client.record_success(self.endpoint)
+                events.put((self, "done", None))
+        except Exception as e:
+            if not self.cancelled.is_set():
+                if not isinstance(e, DifyRequestError):
+                    self.client.record_failure(self.endpoint, e)
+                events.put((self, "error", e))
+        finally:
+            self.client.release(self.endpoint)
+            if self.response is not None:
+                self.response.close()
+
+
+class DifyClient:
+    """
+    多节点Dify客户端
+    """
+
+    def __init__(self, endpoints, failure_threshold=3, cooldown=30, hedge_after=0, ewma_alpha=0.3,
+                 connect_timeout=10, read_timeout=120):
+        """
+        初始化客户端
+
+        Args:
+            endpoints (list): [(地址, 密钥)]
+            failure_threshold (int): 连续失败多少次后熔断节点
+            cooldown (float): 熔断时间(秒)，到期后放行一个试探请求
+            hedge_after (float): 首个token超过此时间(秒)未到达时向另一节点发起对冲请求，0为不对冲
+            ewma_alpha (float): 首token耗时EWMA的平滑系数
+            connect_timeout (float): 连接超时(秒)
+            read_timeout (float): 两次读取之间的最长等待时间(秒)
+        """
+        self.endpoints = [DifyEndpoint(url, key) for url, key in endpoints]
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.hedge_after = hedge_after
+        self.ewma_alpha = ewma_alpha
+        self.timeout = (connect_timeout, read_timeout)
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=32)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def open_circuits(self):
+        """当前处于熔断状态的节点数"""
+        with self.lock:
+            return sum(1 for endpoint in self.endpoints if endpoint.open_until)
+
+    def acquire(self, exclude=()):
+        """
+        选择负载评分最低的可用节点并占用一个进行中请求
+
+        Args:
+            exclude (iterable): 本次请求已经尝试过的节点
+
+        Returns:
+            DifyEndpoint: 选中的节点，没有可选节点时返回None
+        """
+        now = time.monotonic()
+        with self.lock:
+            candidates = [e for e in self.endpoints if e not in exclude and e.available(now)]
+            if not candidates and not exclude and self.endpoints:
+                # 所有节点都在熔断中时仍选择最早到期的节点，不直接拒绝用户
+                candidates = [min(self.endpoints, key=lambda e: e.open_until)]
+            if not candidates:
+                return None
+            endpoint = min(candidates, key=DifyEndpoint.score)
+            if endpoint.open_until:
+                endpoint.probing = True
+            endpoint.in_flight += 1
+            return endpoint
+
+    def release(self, endpoint):
+        with self.lock:
+            endpoint.in_flight -= 1
+            endpoint.probing = False
+
+    def record_ttft(self, endpoint, seconds):
+        with self.lock:
+            endpoint.ewma_ttft += self.ewma_alpha * (seconds - endpoint.ewma_ttft)
+
+    def record_success(self, endpoint):
+        with self.lock:
+            if endpoint.open_until:
+                logger.info(f"Dify节点恢复: {endpoint}")
+            endpoint.failures = 0
+            endpoint.open_until = 0.0
+
+    def record_failure(self, endpoint, error):
+        with self.lock:
+            endpoint.failures += 1
+            logger.warning(f"Dify节点请求失败: {endpoint}, 连续失败 {endpoint.failures} 次, {error}")
+            if endpoint.failures >= self.failure_threshold:
+                endpoint.open_until = time.monotonic() + self.cooldown
+                logger.error(f"Dify节点熔断 {self.cooldown} 秒: {endpoint}")
+
+    def stream_events(self, payload, user_id=""):
+        """
+        调用聊天流接口，逐个返回SSE事件
+        输出首个token之前失败时自动切换到其他节点，之后失败直接抛出异常
+
+        Args:
+            payload (dict): 请求体
+            user_id (str): 用户id
+
+        Yields:
+            dict: 解析后的SSE事件
+        """
+        events = queue.Queue()
+        attempts = []
+        tried = []
+        winner = None
+        last_error = None
+
+        def launch():
+            endpoint = self.acquire(tried)
+            if endpoint is None:
+                return False
+            tried.append(endpoint)
+            attempts.append(_Attempt(self, endpoint, payload, user_id, events))
+            return True
+
+        if not launch():
+            raise Exception("没有可用的Dify节点")
+        hedge_deadline = time.monotonic() + self.hedge_after if self.hedge_after > 0 and len(self.endpoints) > 1 else None
+        try:
+            while True:
+                timeout = None
+                if winner is None and hedge_deadline is not None:
+                    timeout = max(hedge_deadline - time.monotonic(), 0)
+                try:
+                    attempt, kind, item = events.get(timeout=timeout)
+                except queue.Empty:
+                    # 首个token迟迟未到，向另一个节点发起对冲请求
+                    hedge_deadline = None
+                    if launch():
+                        DIFY_HEDGED_REQUESTS.inc()
+                        logger.info(f"Dify首个token超过 {self.hedge_after} 秒，发起对冲请求: {tried[-1]}")
+                    continue
+                if winner is not None and attempt is not winner:
+                    continue
+                if kind == "error":
+                    if attempt is winner or isinstance(item, DifyRequestError):
+                        raise item
+                    last_error = item
+                    attempts.remove(attempt)
+                    if not attempts:
+                        if not launch():
+                            raise last_error
+                        DIFY_FAILOVERS.inc()
+                    continue
+                if winner is None:
+                    if kind == "event" and not (item.get('event') == 'message' and item.get('answer')):
+                        attempt.buffer.append(item)
+                        continue
+                    # 先输出token或先完成的请求胜出，取消其余请求
+                    winner = attempt
+                    for other in attempts:
+                        if other is not winner:
+                            other.cancel()
+                    yield from winner.buffer
+                    winner.buffer = []
+                if kind == "done":
+                    return
+                yield item
+        finally:
+            for attempt in attempts:
+                if attempt is not winner:
+                    attempt.cancel()
+            if winner is not None:
+                winner.cancel()
@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+环境变量工具
+统一解析开关类环境变量，1/true/yes(不区分大小写)为开启
+"""
+import os
+
+TRUE_VALUES = ("1", "true", "yes")
+
+
+def env_flag(name, default="0"):
+    """
+    读取开关类环境变量
+
+    Args:
+        name (str): 环境变量名
+        default (str): 未设置时的默认值
+
+    Returns:
+        bool: 是否开启
+    """
+    return os.getenv(name, default).strip().lower() in TRUE_VALUES
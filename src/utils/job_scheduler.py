@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大模型任务调度
+限制同时调用Dify的任务数，按用户/群聊限制排队与执行中的任务数，问答优先于汇总执行
+队列已满或超出配额时直接拒绝，避免少数用户占满Dify导致所有人等待
+只有需要调用Dify的任务才提交到调度器，加入进行中相同问题的提问不占用并发与配额
+"""
+import os
+import time
+import heapq
+import logging
+import itertools
+import threading
+from dotenv import load_dotenv
+from utils.metrics import registry, LLM_QUEUE_WAIT_SECONDS, LLM_JOBS_REJECTED
+
+load_dotenv()
+logger = logging.getLogger('WeComBot')
+
+# 数值越小越先执行
+PRIORITY_QA = 0
+PRIORITY_SUMMARY = 1
+
+QUEUE_FULL_MESSAGE = "当前提问人数较多，米小度忙不过来了，请稍后再试。"
+USER_QUOTA_MESSAGE = "您还有问题正在处理中，请等回答完成后再提问。"
+CHAT_QUOTA_MESSAGE = "本群还有较多问题正在处理中，请稍后再试。"
+
+
+class LLMScheduler:
+    """
+    大模型任务调度器
+    执行线程按需创建，队列为空时退出
+    """
+
+    def __init__(self, max_concurrency=4, max_queue=32, user_quota=2, chat_quota=4):
+        """
+        初始化调度器
+
+        Args:
+            max_concurrency (int): 同时执行的任务数上限
+            max_queue (int): 排队任务数上限
+            user_quota (int): 单个用户排队与执行中的任务数上限，0为不限制
+            chat_quota (int): 单个群聊排队与执行中的任务数上限，0为不限制
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.user_quota = user_quota
+        self.chat_quota = chat_quota
+        # 排队任务堆，元素为(优先级, 序号, 任务)
+        self.queue = []
+        self.running = 0
+        self.user_jobs = {}
+        self.chat_jobs = {}
+        self._seq = itertools.count()
+        self.lock = threading.Lock()
+
+    def _check_quota(self, user_id, chat_id):
+        """检查是否可以接收新任务，返回拒绝原因，可以接收时返回None"""
+        if user_id and self.user_quota and self.user_jobs.get(user_id, 0) >= self.user_quota:
+            return USER_QUOTA_MESSAGE
+        if chat_id and self.chat_quota and self.chat_jobs.get(chat_id, 0) >= self.chat_quota:
+            return CHAT_QUOTA_MESSAGE
+        if len(self.queue) >= self.max_queue and self.running >= self.max_concurrency:
+            return QUEUE_FULL_MESSAGE
+        return None
+
+    @staticmethod
+    def _acquire(counts, key):
+        if key:
+            counts[key] = counts.get(key, 0) + 1
+
+    @staticmethod
+    def _release(counts, key):
+        if key:
+            remaining = counts.get(key, 0) - 1
+            if remaining > 0:
+                counts[key] = remaining
+            else:
+                counts.pop(key, None)
+
+    def _position(self, job):
+        # 排在此任务之前的任务数(含自身)，优先级更高的任务之后仍可能插队
+        return sum(1 for queued in self.queue if queued[:2] <= job[:2])
+
+    def position(self, job_key):
+        """
+        查询任务当前的排队位置，供轮询时展示
+
+        Args:
+            job_key (str): 提交任务时的job_key
+
+        Returns:
+            int: 排队位置，已开始执行、已结束或不存在时为0
+        """
+        if not job_key:
+            return 0
+        with self.lock:
+            for job in self.queue:
+                if job[2][4] == job_key:
+                    return self._position(job)
+        return 0
+
+    def submit(self, fn, priority=PRIORITY_QA, user_id="", chat_id="", job_key=None):
+        """
+        提交任务
+
+        Args:
+            fn (callable): 任务函数，无参数
+            priority (int): PRIORITY_QA/PRIORITY_SUMMARY
+            user_id (str): 提问用户id
+            chat_id (str): 群聊id，单聊为空
+            job_key (str, optional): 任务标识(如stream_id)，用于之后查询排队位置
+
+        Returns:
+            tuple: (排队位置, 拒绝原因)，立即执行时位置为0，被拒绝时位置为None
+        """
+        with self.lock:
+            reason = self._check_quota(user_id, chat_id)
+            if reason is not None:
+                LLM_JOBS_REJECTED.inc()
+                logger.warning("大模型任务被拒绝: user=%s, chat=%s, 原因=%s", user_id, chat_id, reason)
+                return None, reason
+            self._acquire(self.user_jobs, user_id)
+            self._acquire(self.chat_jobs, chat_id)
+            job = (priority, next(self._seq), (fn, user_id, chat_id, time.perf_counter(), job_key))
+            heapq.heappush(self.queue, job)
+            if self.running < self.max_concurrency:
+                self.running += 1
+                threading.Thread(target=self._worker, daemon=True, name="llm_job").start()
+                return 0, None
+            position = self._position(job)
+        logger.info("大模型任务排队: user=%s, chat=%s, 位置=%d", user_id, chat_id, position)
+        return position, None
+
+    def run(self, fn, priority=PRIORITY_QA, user_id="", chat_id=""):
+        """
+        提交任务并等待执行完成，供定时任务等后台调用方使用
+
+        Args:
+            fn (callable): 任务函数，无参数
+            priority (int): PRIORITY_QA/PRIORITY_SUMMARY
+            user_id (str): 提交任务的用户id
+            chat_id (str): 群聊id
+
+        Returns:
+            str: 拒绝原因，任务执行完成时为None
+        """
+        done = threading.Event()
+
+        def job():
+            try:
+                fn()
+            finally:
+                done.set()
+
+        _, reason = self.submit(job, priority, user_id, chat_id)
+        if reason is None:
+            done.wait()
+        return reason
+
+    def _worker(self):
+        """执行线程，依次取出优先级最高的任务，队列为空时退出"""
+        while True:
+            with self.lock:
+                if not self.queue:
+                    self.running -= 1
+                    return
+                _, _, (fn, user_id, chat_id, submit_time, _) = heapq.heappop(self.queue)
+            LLM_QUEUE_WAIT_SECONDS.observe(time.perf_counter() - submit_time)
+            try:
+                fn()
+            except Exception as e:
+                logger.error(f"大模型任务执行失败: {str(e)}")
+            finally:
+                with self.lock:
+                    self._release(self.user_jobs, user_id)
+                    self._release(self.chat_jobs, chat_id)
+
+
+# 创建全局的大模型任务调度器实例
+llm_scheduler = LLMScheduler(
+    max_concurrency=int(os.getenv('llm_max_concurrency', 4)),
+    max_queue=int(os.getenv('llm_max_queue', 32)),
+    user_quota=int(os.getenv('llm_user_quota', 2)),
+    chat_quota=int(os.getenv('llm_chat_quota', 4))
+)
+registry.gauge("llm_jobs_running", "正在执行的大模型任务数", lambda: llm_scheduler.running)
+registry.gauge("llm_jobs_queued", "排队中的大模型任务数", lambda: len(llm_scheduler.queue))
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+日志配置
+WeComBot日志写入项目根目录下的log/WeComBot.log，机器人服务与会话存档子进程共用
+请求线程只把日志记录放入内存队列，格式化、写文件与轮转都在后台的QueueListener线程中完成
+"""
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+from logging import handlers, getLogger, Filter, Formatter
+from dotenv import load_dotenv
+from utils.env_utils import env_flag
+
+load_dotenv()
+
+# 每次轮询都会产生的日志使用extra=SAMPLED，只按比例记录
+SAMPLED = {"sampled": True}
+
+
+class SamplingFilter(Filter):
+    """
+    按消息模板采样标记了sampled的日志，每every条记录1条，未标记的日志不受影响
+    计数每window秒清零，模板数超过max_keys时也提前清零，避免误用f-string时计数无限增长
+    """
+
+    def __init__(self, every=100, window=60, max_keys=1024):
+        super().__init__()
+        self.every = every
+        self.window = window
+        self.max_keys = max_keys
+        self.counts = {}
+        self.window_start = time.monotonic()
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if not getattr(record, "sampled", False) or self.every <= 1:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= self.window or len(self.counts) >= self.max_keys:
+                self.counts.clear()
+                self.window_start = now
+            count = self.counts.get(record.msg, 0)
+            self.counts[record.msg] = count + 1
+        return count % self.every == 0
+
+
+class JsonFormatter(Formatter):
+    """
+    每条日志输出为一行JSON，便于日志系统采集
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "name": record.name,
+            "level": record.levelname,
+            "thread": record.threadName,
+            "module": record.module,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class DeferredQueueHandler(handlers.QueueHandler):
+    """
+    只在调用线程中快照消息内容的QueueHandler，时间、JSON等格式化与写文件推迟到后台线程进行
+    %参数与异常堆栈在入队前转为文本，避免参数对象在写入前被修改，或堆栈帧被队列长时间引用
+    """
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.exc_formatter = Formatter()
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self.exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+# 配置日志记录到文件
+logger = getLogger('WeComBot')
+logger.setLevel(os.getenv('log_level', 'INFO').upper())
+for handler in logger.handlers[:]:
+    logger.removeHandler(handler)
+
+# 获取项目根目录
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 使用相对路径
+log_file_path = os.path.join(project_root, 'log/WeComBot.log')
+log_dir = os.path.dirname(log_file_path)
+os.makedirs(log_dir, exist_ok=True)
+
+file_handler = handlers.RotatingFileHandler(
+    filename=log_file_path,
+    maxBytes=1024*1024*20,  # 最多存储20MB日志
+    backupCount=5,
+    encoding='utf-8'
+)
+
+# 设置日志格式，log_json=1时输出JSON
+if env_flag('log_json'):
+    formatter = JsonFormatter()
+else:
+    formatter = Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+file_handler.setFormatter(formatter)
+
+sampling_filter = SamplingFilter(
+    every=int(os.getenv('log_sample_every', 100)),
+    window=float(os.getenv('log_sample_window', 60))
+)
+listener = None
+if env_flag('log_async', '1'):
+    handler = DeferredQueueHandler(queue.SimpleQueue())
+    listener = handlers.QueueListener(handler.queue, file_handler, respect_handler_level=True)
+    listener.start()
+    # 退出时写完队列中剩余的日志
+    atexit.register(listener.stop)
+else:
+    handler = file_handler
+handler.addFilter(sampling_filter)
+logger.addHandler(handler)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+运行指标
+线程安全的直方图与计数器，以Prometheus文本格式在/metrics接口输出
+"""
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# 耗时类直方图的默认分桶(秒)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """
+    直方图指标
+    """
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """记录一个观测值"""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    @contextmanager
+    def time(self):
+        """记录代码块的耗时(秒)"""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time)
+
+    def render(self):
+        with self._lock:
+            counts, total, count = list(self._counts), self._sum, self._count
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            lines.append(f'{self.name}_bucket{{le="{_format_value(bound)}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {_format_value(total)}")
+        lines.append(f"{self.name}_count {count}")
+        return lines
+
+
+class Counter:
+    """
+    计数器指标
+    """
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def render(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter", f"{self.name} {self._value}"]
+
+
+class Gauge:
+    """
+    瞬时值指标，在输出时调用回调函数取值
+    """
+
+    def __init__(self, name, documentation, callback):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+
+    def render(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge", f"{self.name} {_format_value(self.callback())}"]
+
+
+class MetricsRegistry:
+    """
+    指标注册表
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def histogram(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, buckets))
+
+    def counter(self, name, documentation):
+        return self._register(Counter(name, documentation))
+
+    def gauge(self, name, documentation, callback):
+        return self._register(Gauge(name, documentation, callback))
+
+    def render(self):
+        """
+        以Prometheus文本格式输出所有指标
+
+        Returns:
+            str: 指标文本
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                # 单个指标取值失败不影响其他指标输出
+                continue
+        return "\n".join(lines) + "\n"
+
+
+# 创建全局的指标注册表实例
+registry = MetricsRegistry()
+
+# chatBot回调各阶段耗时
+CALLBACK_DECRYPT_SECONDS = registry.histogram("wecom_callback_decrypt_seconds", "chatBot回调消息解密耗时")
+CALLBACK_PARSE_SECONDS = registry.histogram("wecom_callback_parse_seconds", "chatBot回调消息解析耗时")
+STREAM_CREATE_SECONDS = registry.histogram("wecom_stream_create_seconds", "创建流式任务耗时")
+DUPLICATE_MESSAGES = registry.counter("wecom_duplicate_messages_total", "企业微信重试推送的重复文本消息数")
+ENCRYPT_SECONDS = registry.histogram("wecom_encrypt_seconds", "回复消息加密耗时")
+ENCRYPT_CACHE_HITS = registry.counter("wecom_encrypt_cache_hits_total", "流式轮询内容未变化、复用已加密消息体的次数")
+# 流式任务
+STREAM_POLLS = registry.histogram("wecom_stream_polls", "每个流式任务的企业微信轮询次数", buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+STREAM_POLL_TOTAL = registry.counter("wecom_stream_poll_total", "企业微信流式轮询总次数")
+STREAM_CHUNKS_COALESCED = registry.counter("wecom_stream_chunks_coalesced_total", "生成端合并写入、未单独写入流的chunk数")
+# Dify
+DIFY_FIRST_TOKEN_SECONDS = registry.histogram("dify_time_to_first_token_seconds", "Dify首个token耗时")
+DIFY_CHUNKS_PER_SECOND = registry.histogram("dify_chunks_per_second", "Dify首个token之后每秒收到的message事件数(一个事件可能包含多个token)", buckets=(1, 5, 10, 20, 50, 100, 200, 500))
+DIFY_RESPONSE_SECONDS = registry.histogram("dify_response_seconds", "Dify完整回答耗时")
+DIFY_HEDGED_REQUESTS = registry.counter("dify_hedged_requests_total", "首个token超时后向另一节点发起的对冲请求数")
+DIFY_FAILOVERS = registry.counter("dify_failovers_total", "输出前失败后切换到其他节点重试的次数")
+DIFY_COALESCED_REQUESTS = registry.counter("dify_coalesced_requests_total", "与进行中的相同问题合并、未单独调用Dify的请求数")
+ANSWER_CACHE_HITS = registry.counter("answer_cache_hits_total", "命中问答缓存、未调用Dify的请求数")
+# 大模型任务调度
+LLM_QUEUE_WAIT_SECONDS = registry.histogram("llm_queue_wait_seconds", "大模型任务排队等待耗时")
+LLM_JOBS_REJECTED = registry.counter("llm_jobs_rejected_total", "队列已满或超出配额而被拒绝的大模型任务数")
+# 图片
+IMAGE_FETCH_SECONDS = registry.histogram("mixed_stream_image_fetch_seconds", "构建图文混合消息时等待图片的耗时")
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+wecom_messages分区表工具
+按msgtime创建按天/按周的范围分区，索引与实际查询对齐，并提前创建未来的分区
+
+用法(在src目录下):
+    python -m utils.partitions create --interval day --ahead 7     # 新建分区表
+    python -m utils.partitions migrate --interval day --ahead 7    # 将现有普通表迁移为分区表(需先停止run.py与save_chat.py)
+    python -m utils.partitions premake --ahead 7                   # 预创建未来分区
+"""
+import os
+import argparse
+import logging
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import text
+from dotenv import load_dotenv
+from utils.db import get_engine
+from utils.retention import is_partitioned, list_partitions
+
+load_dotenv()
+logger = logging.getLogger('WeComBot')
+
+# 分区按北京时间的自然日/自然周划分
+PARTITION_TZ = timezone(timedelta(hours=8))
+PARTITION_INTERVALS = {"day": 1, "week": 7}
+
+
+def _to_ms(dt):
+    return int(dt.timestamp() * 1000)
+
+
+def partition_start(dt, interval="day"):
+    """
+    获取某一时间所在分区的起始时间
+
+    Args:
+        dt (datetime): 时间
+        interval (str): day/week
+
+    Returns:
+        datetime: 分区起始时间(北京时间零点，按周分区时为周一)
+    """
+    start = dt.astimezone(PARTITION_TZ).replace(hour=0, minute=0, second=0, microsecond=0)
+    if interval == "week":
+        start -= timedelta(days=start.weekday())
+    return start
+
+
+def partition_ranges(start, count, interval="day", table="wecom_messages"):
+    """
+    生成从start开始的count个分区的名称与边界
+
+    Args:
+        start (datetime): 起始时间
+        count (int): 分区数量
+        interval (str): day/week
+        table (str): 分区表名
+
+    Returns:
+        list: [(分区名, 下界msgtime, 上界msgtime)]
+    """
+    step = timedelta(days=PARTITION_INTERVALS[interval])
+    lower = partition_start(start, interval)
+    ranges = []
+    for _ in range(count):
+        upper = lower + step
+        ranges.append((f"{table}_p{lower.strftime('%Y%m%d')}", _to_ms(lower), _to_ms(upper)))
+        lower = upper
+    return ranges
+
+
+def create_partitioned_table(con, table="wecom_messages"):
+    """
+    创建按msgtime范围分区的消息表及其索引
+    只保留与实际查询匹配的复合索引，不再为action/msgtype等低基数字段单独建索引
+
+    Args:
+        con: 数据库连接(处于事务中)
+        table (str): 表名
+    """
+    con.execute(text(f"""
+        CREATE TABLE {table}(
+            msgid varchar(255) NOT NULL,
+            action varchar(50) NOT NULL,
+            "from" varchar(255) NOT NULL,
+            tolist text[] NOT NULL,
+            roomid varchar(255),
+            chat_name varchar(255),
+            msgtime bigint NOT NULL,
+            msgtype varchar(50) NOT NULL,
+            content jsonb NOT NULL,
+            PRIMARY KEY (msgid, msgtime)
+        ) PARTITION BY RANGE (msgtime)
+    """))
+    # 汇总按群聊id/群聊名称加时间范围查询
+    con.execute(text(f"CREATE INDEX idx_{table}_roomid_msgtime ON {table} USING btree (roomid, msgtime)"))
+    con.execute(text(f"CREATE INDEX idx_{table}_chat_name_msgtime ON {table} USING btree (chat_name, msgtime)"))
+    # 不落在任何范围分区内的消息写入默认分区，避免写入失败
+    con.execute(text(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT"))
+    con.execute(text(f"COMMENT ON TABLE {table} IS '企业微信消息表，存储企业微信用户会话消息记录，按msgtime范围分区'"))
+
+
+def create_partitions(con, ranges, table="wecom_messages"):
+    """
+    在当前事务中创建尚不存在的分区，任何分区创建失败都直接抛出异常
+
+    Args:
+        con: 数据库连接(处于事务中)
+        ranges (list): [(分区名, 下界msgtime, 上界msgtime)]
+        table (str): 分区表名
+
+    Returns:
+        list: 新创建的分区名
+    """
+    existing = {name for name, _, _ in list_partitions(con, table)}
+    created = []
+    for name, lower, upper in ranges:
+        if name in existing:
+            continue
+        con.execute(text(f'CREATE TABLE "{name}" PARTITION OF {table} FOR VALUES FROM ({lower}) TO ({upper})'))
+        created.append(name)
+    return created
+
+
+def ensure_partitions(engine, ranges, table="wecom_messages"):
+    """
+    创建尚不存在的分区
+
+    Args:
+        engine: sqlalchemy引擎
+        ranges (list): [(分区名, 下界msgtime, 上界msgtime)]
+        table (str): 分区表名
+
+    Returns:
+        list: 新创建的分区名
+    """
+    with engine.connect() as con:
+        existing = {name for name, _, _ in list_partitions(con, table)}
+    created = []
+    for name, lower, upper in ranges:
+        if name in existing:
+            continue
+        try:
+            with engine.begin() as con:
+                con.execute(text(f'CREATE TABLE "{name}" PARTITION OF {table} FOR VALUES FROM ({lower}) TO ({upper})'))
+            created.append(name)
+        except Exception as e:
+            # 默认分区中已有该范围的数据时无法创建，需要人工处理
+            logger.error(f"创建分区 {name} 失败: {e}")
+    if created:
+        logger.info(f"已创建分区: {', '.join(created)}")
+    return created
+
+
+def ensure_future_partitions(engine, interval="day", ahead=7, table="wecom_messages"):
+    """
+    预创建从当前周期开始的ahead个分区
+
+    Args:
+        engine: sqlalchemy引擎
+        interval (str): day/week
+        ahead (int): 预创建的分区数量
+        table (str): 分区表名
+
+    Returns:
+        list: 新创建的分区名
+    """
+    return ensure_partitions(engine, partition_ranges(datetime.now(PARTITION_TZ), ahead, interval, table), table)
+
+
+def create_schema(engine, interval="day", ahead=7, table="wecom_messages"):
+    """
+    新建分区表并预创建未来分区
+
+    Args:
+        engine: sqlalchemy引擎
+        interval (str): day/week
+        ahead (int): 预创建的分区数量
+        table (str): 表名
+    """
+    with engine.begin() as con:
+        create_partitioned_table(con, table)
+    ensure_future_partitions(engine, interval, ahead, table)
+
+
+def migration_ranges(min_msgtime, max_msgtime, interval="day", ahead=7, table="wecom_messages"):
+    """
+    迁移需要的全部分区：从最早的历史消息到当前周期之后的ahead个周期，中间不留空缺
+
+    Args:
+        min_msgtime (int): 原表最早的msgtime，原表为空时为None
+        max_msgtime (int): 原表最晚的msgtime，原表为空时为None
+        interval (str): day/week
+        ahead (int): 当前周期开始预创建的分区数量
+        table (str): 表名
+
+    Returns:
+        list: [(分区名, 下界msgtime, 上界msgtime)]
+    """
+    now = datetime.now(PARTITION_TZ)
+    first = last = now
+    if min_msgtime is not None:
+        first = min(datetime.fromtimestamp(min_msgtime / 1000, PARTITION_TZ), now)
+        last = max(datetime.fromtimestamp(max_msgtime / 1000, PARTITION_TZ), now)
+    periods = (partition_start(last, interval) - partition_start(first, interval)).days // PARTITION_INTERVALS[interval]
+    # 当前周期之后至少保留ahead个周期
+    periods = max(periods, (partition_start(now, interval) - partition_start(first, interval)).days // PARTITION_INTERVALS[interval] + ahead - 1)
+    return partition_ranges(first, periods + 1, interval, table)
+
+
+def table_exists(con, table):
+    """判断表是否存在"""
+    return con.execute(text("SELECT to_regclass(:table)"), {"table": table}).scalar() is not None
+
+
+def migrate_to_partitioned(engine, interval="day", ahead=7, table="wecom_messages", lock_timeout=10000):
+    """
+    将现有普通表迁移为分区表
+    原表重命名为{table}_heap并保留，确认数据无误后可手动删除
+    迁移前应停止会话存档服务；重命名、建表以及历史与未来分区的创建在同一个持有ACCESS EXCLUSIVE锁的事务中完成，
+    等待锁的写入在提交后写入新表对应的范围分区而不是默认分区，任一分区创建失败时整个迁移回滚
+    按分区复制时跳过已存在的消息，中断后重新执行会从{table}_heap继续复制
+
+    Args:
+        engine: sqlalchemy引擎
+        interval (str): day/week
+        ahead (int): 预创建的未来分区数量
+        table (str): 表名
+        lock_timeout (int): 等待表锁的最长时间(毫秒)，超时后放弃迁移
+    """
+    heap_table = f"{table}_heap"
+    with engine.begin() as con:
+        if is_partitioned(con, table):
+            if not table_exists(con, heap_table):
+                logger.info(f"{table} 已经是分区表，无需迁移")
+                return
+            logger.info(f"{table} 已经是分区表，继续从 {heap_table} 复制数据")
+        else:
+            con.execute(text(f"SET LOCAL lock_timeout = {int(lock_timeout)}"))
+            # 显式加锁，重命名与建表期间没有写入落到原表
+            con.execute(text(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE"))
+            con.execute(text(f"ALTER TABLE {table} RENAME TO {heap_table}"))
+            con.execute(text(f"ALTER INDEX IF EXISTS {table}_pkey RENAME TO {heap_table}_pkey"))
+            create_partitioned_table(con, table)
+        min_msgtime, max_msgtime = con.execute(text(f"SELECT MIN(msgtime), MAX(msgtime) FROM {heap_table}")).fetchone()
+        ranges = migration_ranges(min_msgtime, max_msgtime, interval, ahead, table)
+        # 提交前创建全部范围分区，失败时抛出异常回滚重命名与建表，避免数据写入默认分区后无法再建分区
+        created = create_partitions(con, ranges, table)
+    if created:
+        logger.info(f"已创建分区: {', '.join(created)}")
+
+    # 按分区逐段复制历史数据，每段一个事务
+    if min_msgtime is not None:
+        for name, lower, upper in ranges:
+            if upper <= min_msgtime or lower > max_msgtime:
+                continue
+            with engine.begin() as con:
+                # 单个分区的复制可能超过共享引擎的语句超时
+                con.execute(text("SET LOCAL statement_timeout = 0"))
+                copied = con.execute(
+                    text(f"INSERT INTO {table} SELECT * FROM {heap_table} WHERE msgtime >= :lower AND msgtime < :upper "
+                         f"ON CONFLICT DO NOTHING"),
+                    {"lower": lower, "upper": upper}
+                ).rowcount
+            logger.info(f"已迁移分区 {name}: {copied} 条")
+    logger.info(f"迁移完成，原表保留为 {heap_table}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="wecom_messages分区表工具",
+        epilog="migrate会重命名正在使用的wecom_messages表，执行前请先停止run.py与save_chat.py；中断后可重新执行以继续复制"
+    )
+    parser.add_argument("command", choices=["create", "migrate", "premake"])
+    parser.add_argument("--interval", choices=list(PARTITION_INTERVALS), default=os.getenv("partition_interval", "day"))
+    parser.add_argument("--ahead", type=int, default=int(os.getenv("partition_premake", 7)))
+    args = parser.parse_args()
+
+    db = get_engine()
+    if args.command == "create":
+        create_schema(db, args.interval, args.ahead)
+    elif args.command == "migrate":
+        migrate_to_partitioned(db, args.interval, args.ahead)
+    else:
+        ensure_future_partitions(db, args.interval, args.ahead)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+聊天记录保留策略
+按批次删除过期消息，每批独立短事务，避免长时间锁表和表膨胀
+wecom_messages为按msgtime分区的表时，优先直接删除整个过期分区
+"""
+import re
+import time
+import logging
+from sqlalchemy import text
+
+logger = logging.getLogger('WeComBot')
+
+DAY_MS = 24 * 60 * 60 * 1000
+# 分区边界表达式，例如 FOR VALUES FROM ('1762000000000') TO ('1762086400000')
+PARTITION_BOUND_PATTERN = re.compile(r"FROM \('?(-?\d+)'?\) TO \('?(-?\d+)'?\)")
+
+
+def is_partitioned(con, table="wecom_messages"):
+    """
+    判断表是否为分区表
+
+    Args:
+        con: 数据库连接
+        table (str): 表名
+
+    Returns:
+        bool: 是否为分区表
+    """
+    result = con.execute(
+        text("SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = :table"),
+        {"table": table}
+    ).fetchone()
+    return result is not None
+
+
+def list_partitions(con, table="wecom_messages"):
+    """
+    列出分区表的所有范围分区，默认分区不在其中
+
+    Args:
+        con: 数据库连接
+        table (str): 分区表名
+
+    Returns:
+        list: [(分区名, 下界msgtime, 上界msgtime)]，按下界升序
+    """
+    rows = con.execute(
+        text("SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+             "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+             "WHERE p.relname = :table"),
+        {"table": table}
+    ).fetchall()
+    partitions = []
+    for name, bound in rows:
+        match = PARTITION_BOUND_PATTERN.search(bound or "")
+        if match:
+            partitions.append((name, int(match.group(1)), int(match.group(2))))
+    return sorted(partitions, key=lambda item: item[1])
+
+
+def drop_expired_partitions(engine, threshold, table="wecom_messages"):
+    """
+    删除上界不晚于阈值的分区，每个分区先分离再删除
+
+    Args:
+        engine: sqlalchemy引擎
+        threshold (int): 毫秒时间戳阈值
+        table (str): 分区表名
+
+    Returns:
+        list: 已删除的分区名
+    """
+    with engine.connect() as con:
+        expired = [name for name, _, upper in list_partitions(con, table) if upper <= threshold]
+    dropped = []
+    for name in expired:
+        with engine.begin() as con:
+            con.execute(text(f'ALTER TABLE {table} DETACH PARTITION "{name}"'))
+            con.execute(text(f'DROP TABLE "{name}"'))
+        dropped.append(name)
+        logger.info(f"已删除过期分区: {name}")
+    return dropped
+
+
+def purge_expired_messages(engine, retention_days=7, batch_size=5000, pause=0.1, progress_every=20, progress=None, table="wecom_messages"):
+    """
+    清理超过保留天数的消息
+    分区表先删除整个过期分区，剩余的过期行按批次删除
+
+    Args:
+        engine: sqlalchemy引擎
+        retention_days (int): 保留天数
+        batch_size (int): 每批删除的最大行数
+        pause (float): 批次之间的等待时间(秒)，让出锁给存档写入
+        progress_every (int): 每隔多少批记录一次进度日志
+        progress (callable, optional): 进度回调，每批结束后以统计字典调用
+        table (str): 消息表名
+
+    Returns:
+        dict: 清理统计，包含deleted_rows/batches/dropped_partitions/elapsed
+    """
+    start_time = time.time()
+    threshold = int(time.time() * 1000) - retention_days * DAY_MS
+    stats = {"deleted_rows": 0, "batches": 0, "dropped_partitions": [], "elapsed": 0.0}
+
+    with engine.connect() as con:
+        partitioned = is_partitioned(con, table)
+    if partitioned:
+        stats["dropped_partitions"] = drop_expired_partitions(engine, threshold, table)
+
+    delete_sql = text(
+        f"DELETE FROM {table} WHERE msgtime < :threshold AND msgid IN ("
+        f"SELECT msgid FROM {table} WHERE msgtime < :threshold LIMIT :batch_size)"
+    )
+    while True:
+        with engine.begin() as con:
+            deleted = con.execute(delete_sql, {"threshold": threshold, "batch_size": batch_size}).rowcount
+        stats["deleted_rows"] += deleted
+        stats["batches"] += 1
+        stats["elapsed"] = time.time() - start_time
+        if progress:
+            progress(dict(stats))
+        if progress_every and stats["batches"] % progress_every == 0:
+            logger.info(f"清理进度: 已删除 {stats['deleted_rows']} 条, 批次 {stats['batches']}, 耗时 {stats['elapsed']:.1f}秒")
+        if deleted < batch_size:
+            break
+        time.sleep(pause)
+
+    stats["elapsed"] = time.time() - start_time
+    return stats
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+相同问题的并发请求合并
+同一键的并发调用只向上游发起一次生成，生成过程中的每个chunk分发给所有订阅的流，后加入的流先补发已生成的内容
+"""
+import re
+import threading
+
+# 归一化时去掉的首尾标点
+QUERY_STRIP_CHARS = " \t\r\n?？!！。.,，~～"
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_query(query):
+    """
+    归一化用户问题，用于判断两个问题是否相同
+
+    Args:
+        query (str): 用户问题
+
+    Returns:
+        str: 去掉首尾空白与标点、合并连续空白并转为小写后的问题
+    """
+    return WHITESPACE_PATTERN.sub(" ", (query or "").strip(QUERY_STRIP_CHARS)).lower()
+
+
+class _Flight:
+    """
+    一次进行中的上游生成
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.chunks = []
+        self.subscribers = []
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    单飞调用
+    第一个调用者执行生成函数，同一键的后续调用者订阅其输出并等待同一结果
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._flights)
+
+    @staticmethod
+    def _subscribe(flight, stream, stream_id):
+        # 补发已生成的内容并订阅，与分发在同一把锁内，保证顺序且不重复
+        with flight.lock:
+            for chunk in flight.chunks:
+                stream(stream_id, chunk)
+            flight.subscribers.append((stream, stream_id))
+
+    @staticmethod
+    def _wait(flight):
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def join(self, key, stream, stream_id, on_join=None):
+        """
+        只加入键为key的进行中生成，不存在时不发起新的生成
+        订阅在调用时立即完成，生成恰好结束时也会补发全部内容
+
+        Args:
+            key: 合并键
+            stream (callable): 流式输出回调，以(stream_id, chunk)调用
+            stream_id (str): 当前调用者的流ID
+            on_join (callable, optional): 加入已有生成时调用，用于统计
+
+        Returns:
+            callable: 无参数，等待并返回生成结果；没有进行中的生成时返回None
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+        if flight is None:
+            return None
+        self._subscribe(flight, stream, stream_id)
+        if on_join:
+            on_join()
+        return lambda: self._wait(flight)
+
+    def run(self, key, stream, stream_id, fn, on_join=None):
+        """
+        执行或加入键为key的生成
+
+        Args:
+            key: 合并键，相同的并发调用共享一次生成
+            stream (callable): 流式输出回调，以(stream_id, chunk)调用
+            stream_id (str): 当前调用者的流ID
+            fn (callable): 生成函数，以分发回调emit调用，emit的签名与stream相同，返回完整结果
+            on_join (callable, optional): 加入已有生成时调用，用于统计
+
+        Returns:
+            生成函数的返回值
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+
+        self._subscribe(flight, stream, stream_id)
+
+        if not leader:
+            if on_join:
+                on_join()
+            return self._wait(flight)
+
+        def emit(_, chunk):
+            with flight.lock:
+                flight.chunks.append(chunk)
+                for subscriber, subscriber_id in flight.subscribers:
+                    subscriber(subscriber_id, chunk)
+
+        try:
+            flight.result = fn(emit)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
@@ -6,17 +6,249 @@
 支持队列式的消息处理机制
 """
 import json
+import time
 import base64
 import hashlib
+import os
 import re
 import requests
 import threading
 import logging
 from queue import Queue
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from io import BytesIO
+from requests.adapters import HTTPAdapter
+from utils.cache_utils import TTLCache
+from utils.logger import SAMPLED
+from utils.metrics import registry, ENCRYPT_SECONDS, ENCRYPT_CACHE_HITS, IMAGE_FETCH_SECONDS, STREAM_POLLS, STREAM_POLL_TOTAL, STREAM_CHUNKS_COALESCED
+try:
+    from PIL import Image
+except ImportError:
+    # 未安装Pillow时PNG/JPEG图片原样发送，其他格式与超过企业微信上限的图片直接丢弃
+    Image = None
 
 logger = logging.getLogger('WeComBot')
+
+# markdown格式的图片链接"![image](/files/...)"，拼接前缀得到完整的图片URL
+IMG_PREFIX = "https://manage.midoclouds.com/files/"
+IMAGE_PATTERN = re.compile(r'!\[image\]\(/files/([^)]+)\)')
+# 图片链接的最大长度，用于增量扫描时保留可能被截断的尾部
+IMAGE_SCAN_OVERLAP = 512
+# 企业微信图文混排单张图片上限10M(base64编码前)
+WECOM_IMAGE_LIMIT = 10 * 1024 * 1024
+# 企业微信支持的图片格式的文件头，Pillow无法处理时只有这两种格式的原图可以直接发送
+IMAGE_SIGNATURES = (b"\x89PNG\r\n\x1a\n", b"\xff\xd8\xff")
+# 压缩目标：单张图片字节数与最长边像素
+IMG_MAX_BYTES = int(os.getenv('img_max_bytes', 512 * 1024))
+IMG_MAX_SIDE = int(os.getenv('img_max_side', 1280))
+JPEG_QUALITIES = (85, 70, 55, 40)
+# 生成端合并chunk的时间(秒)与字符数阈值
+STREAM_FLUSH_INTERVAL = float(os.getenv('stream_flush_interval', 0.2))
+STREAM_FLUSH_CHARS = int(os.getenv('stream_flush_chars', 256))
+
+def compress_image(raw):
+    """
+    将图片压缩到IMG_MAX_BYTES与IMG_MAX_SIDE以内
+    已满足限制的图片原样返回，否则缩放并重新编码为JPEG
+    Pillow无法解码或压缩后仍超限时，只有文件头为PNG/JPEG且不超过企业微信上限的原图照常发送
+
+    Args:
+        raw (bytes): 原始图片内容
+
+    Returns:
+        bytes: 压缩后的图片内容，无法满足企业微信限制时返回None
+
+    Raises:
+        ValueError: 无法压缩且原图不是PNG/JPEG(如错误页面)
+    """
+    if Image is not None:
+        try:
+            img = _reencode_image(raw)
+            if img is not None:
+                return img
+        except Exception as e:
+            logger.warning(f"图片压缩失败，尝试发送原图: {str(e)}")
+    if not raw.startswith(IMAGE_SIGNATURES):
+        raise ValueError("无法识别的图片格式，企业微信只支持PNG/JPEG")
+    return raw if len(raw) <= WECOM_IMAGE_LIMIT else None
+
+def _reencode_image(raw):
+    """使用Pillow缩放并重新编码图片，无法压缩到企业微信上限以内时返回None"""
+    with Image.open(BytesIO(raw)) as img:
+        if len(raw) <= IMG_MAX_BYTES and max(img.size) <= IMG_MAX_SIDE and img.format in ("JPEG", "PNG"):
+            return raw
+        img.thumbnail((IMG_MAX_SIDE, IMG_MAX_SIDE))
+        # JPEG不支持透明通道，透明部分填充白色
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+        while True:
+            for quality in JPEG_QUALITIES:
+                buffer = BytesIO()
+                img.save(buffer, format="JPEG", quality=quality, optimize=True)
+                if buffer.tell() <= IMG_MAX_BYTES:
+                    return buffer.getvalue()
+            # 最低质量仍超过限制时继续缩小尺寸
+            if max(img.size) <= 320:
+                data = buffer.getvalue()
+                return data if len(data) <= WECOM_IMAGE_LIMIT else None
+            img = img.resize((max(1, img.width // 2), max(1, img.height // 2)))
+
+class ImageFetcher:
+    """
+    图片获取器
+    使用连接池会话并行下载图片，压缩后按文件ID缓存(base64, md5)
+    流式输出中一出现图片链接即开始预取
+    """
+
+    def __init__(self, max_workers=4, cache_size=128, timeout=10):
+        """
+        初始化图片获取器
+
+        Args:
+            max_workers (int): 并行下载线程数
+            cache_size (int): 缓存的图片数量上限
+            timeout (float): 单张图片下载超时时间(秒)
+        """
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="img_fetch")
+        self.cache = TTLCache(maxsize=cache_size)
+        # 按原图md5缓存压缩结果，不同文件ID的相同图片只压缩一次
+        self.compressed = TTLCache(maxsize=cache_size)
+        # 正在下载的图片，文件ID -> Future
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def file_id(path):
+        """从/files/之后的路径中提取文件ID，签名参数每次不同，文件ID不变"""
+        return path.split('/', 1)[0]
+
+    def _fetch(self, key, img_url):
+        """
+        下载并压缩图片，只有成功的结果写入缓存
+
+        Args:
+            key (str): 缓存键，/files/下的图片为文件ID
+            img_url (str): 带签名的完整图片URL
+
+        Returns:
+            tuple: (base64, md5)，获取失败时为(None, None)
+        """
+        try:
+            response = self.session.get(img_url, timeout=self.timeout)
+            # 签名过期(403)、文件不存在(404)等返回的是错误页面，不能当作图片压缩和缓存
+            response.raise_for_status()
+            content_type = response.headers.get('Content-Type', '')
+            if not content_type.startswith('image/'):
+                raise ValueError(f"返回内容不是图片: {content_type or '未知类型'}")
+            ori_img = response.content
+            del response
+            source_md5 = hashlib.md5(ori_img).hexdigest()
+            result = self.compressed.get(source_md5)
+            if result is None:
+                img = compress_image(ori_img)
+                # 只保留base64结果，原图与压缩后的二进制内容立即释放
+                del ori_img
+                if img is None:
+                    logger.warning(f"图片超过企业微信大小限制，已忽略: {key}")
+                    return None, None
+                result = (base64.b64encode(img).decode('ascii'), hashlib.md5(img).hexdigest())
+                del img
+                self.compressed.set(source_md5, result)
+            self.cache.set(key, result)
+            return result
+        except Exception as e:
+            logger.error(f"获取图片内容失败: {str(e)}")
+            return None, None
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+
+    def fetch(self, img_url):
+        """
+        同步获取任意URL的图片，按完整URL缓存
+
+        Args:
+            img_url (str): 图片URL
+
+        Returns:
+            tuple: (base64, md5)，获取失败时为(None, None)
+        """
+        cached = self.cache.get(img_url)
+        if cached:
+            return cached
+        return self._fetch(img_url, img_url)
+
+    def prefetch(self, path):
+        """
+        后台预取图片，已缓存或正在下载时直接返回
+
+        Args:
+            path (str): /files/之后的图片路径
+
+        Returns:
+            Future: 下载任务，已缓存时返回None
+        """
+        key = self.file_id(path)
+        if key in self.cache:
+            return None
+        with self.lock:
+            future = self.pending.get(key)
+            if future is None:
+                future = self.executor.submit(self._fetch, key, IMG_PREFIX + path)
+                self.pending[key] = future
+            return future
+
+    def prefetch_text(self, content):
+        """预取文本中出现的所有图片，返回匹配到的最后位置"""
+        end = 0
+        for match in IMAGE_PATTERN.finditer(content):
+            self.prefetch(match.group(1))
+            end = match.end()
+        return end
+
+    def get_many(self, paths):
+        """
+        并行获取多张图片
+
+        Args:
+            paths (list): /files/之后的图片路径列表
+
+        Returns:
+            list: [(base64, md5)]，获取失败的为(None, None)
+        """
+        futures = [self.prefetch(path) for path in paths]
+        results = []
+        for path, future in zip(paths, futures):
+            cached = self.cache.get(self.file_id(path))
+            if cached:
+                results.append(cached)
+                continue
+            try:
+                results.append(future.result(timeout=self.timeout) if future else (None, None))
+            except Exception as e:
+                logger.error(f"获取图片内容超时: {str(e)}")
+                results.append((None, None))
+        return results
+
+# 创建全局的图片获取器实例
+image_fetcher = ImageFetcher(
+    max_workers=int(os.getenv('img_fetch_workers', 4)),
+    cache_size=int(os.getenv('img_cache_size', 128)),
+    timeout=float(os.getenv('img_fetch_timeout', 10))
+)
+
 # 流式消息管理类
 class StreamManager:
     """
@@ -63,7 +295,12 @@ class StreamManager:
                     "is_finished": False,
                     "msgid": msgid,
                     "chatid": chatid,
-                    "error_message": ""
+                    "error_message": "",
+                    "image_scan_pos": 0,  # 已扫描图片链接的位置
+                    "final_payload": None,  # 完成后的图文混合消息，只构建一次
+                    "poll_count": 0,  # 企业微信轮询次数
+                    "version": 0,  # 内容版本，内容或完成状态变化时递增
+                    "cipher_cache": None  # 最近一次加密的消息体: ((版本, 是否完成), 密文)
                 }
                 
                 # 初始化消息队列
@@ -72,7 +309,7 @@ class StreamManager:
                 # 设置任务状态
                 self.task_status[stream_id] = 'running'
                 
-                logger.info(f"创建流式任务: stream_id={stream_id}, content_length={len(content)}")
+                logger.info("创建流式任务: stream_id=%s, content_length=%d", stream_id, len(content))
             
             # 创建并启动处理线程
             thread = threading.Thread(
@@ -112,8 +349,9 @@ class StreamManager:
                     self.streams[stream_id]['status'] = 'error'
                     self.streams[stream_id]['error_message'] = str(e)
                     self.streams[stream_id]['is_finished'] = True
+                    self.streams[stream_id]['version'] += 1
                     self.task_status[stream_id] = 'failed'
-                    self.message_queues[stream_id].put((error_message, True))
+                    self.message_queues[stream_id].put((error_message, True, self.streams[stream_id]['version']))
         
         finally:
             # 清理线程引用（线程结束时）
@@ -139,7 +377,16 @@ class StreamManager:
                 if stream_id in self.streams:
                     # 累积内容
                     self.streams[stream_id]['accumulated_content'].append(chunk_content)
+                    # 内容变化后已构建的最终消息失效
+                    if chunk_content:
+                        self.streams[stream_id]['final_payload'] = None
+                    if chunk_content or is_finished:
+                        self.streams[stream_id]['version'] += 1
                     accumulated = ''.join(self.streams[stream_id]['accumulated_content'])
+                    # 只扫描新增部分的图片链接，发现后立即开始预取
+                    scan_pos = self.streams[stream_id]['image_scan_pos']
+                    match_end = image_fetcher.prefetch_text(accumulated[scan_pos:])
+                    self.streams[stream_id]['image_scan_pos'] = max(scan_pos + match_end, len(accumulated) - IMAGE_SCAN_OVERLAP, scan_pos)
                     
                     # 企业微信每次获取的都是完整的累积内容，避免覆盖问题
                     while not self.message_queues[stream_id].empty():
@@ -149,7 +396,7 @@ class StreamManager:
                             pass
                     
                     # 将累积的完整内容放入队列
-                    self.message_queues[stream_id].put((accumulated, is_finished))
+                    self.message_queues[stream_id].put((accumulated, is_finished, self.streams[stream_id]['version']))
                     
                     # logger.info(f"添加流数据块: stream_id={stream_id}, chunk长度={len(chunk_content)}")
                     # logger.info(f"添加文本块: {chunk_content[:5]}... 累积内容长度: {len(accumulated)}, 是否完成={is_finished}")
@@ -180,18 +427,22 @@ class StreamManager:
         """
         
         try:
+            # 在生成线程中提前构建最终的图文混合消息，轮询时直接返回
+            final_payload = MakeMixedStream(stream_id, full_message, finish=True)
             with self.lock:
                 if stream_id in self.streams:
  
                     # 更新累积内容
                     self.streams[stream_id]['accumulated_content'] = [full_message]                   
+                    self.streams[stream_id]['final_payload'] = final_payload
                     # 更新任务状态
                     self.streams[stream_id]['status'] = 'completed'
                     self.streams[stream_id]['is_finished'] = True
+                    self.streams[stream_id]['version'] += 1
                     self.task_status[stream_id] = 'completed'
                     
                     # 将完整内容放入队列
-                    self.message_queues[stream_id].put((full_message, True))
+                    self.message_queues[stream_id].put((full_message, True, self.streams[stream_id]['version']))
                     
                     # logger.info(f"更新完整消息:{full_message},消息长度={len(full_message)}")
                     return True
@@ -219,10 +470,11 @@ class StreamManager:
                     self.streams[stream_id]['status'] = 'error'
                     self.streams[stream_id]['error_message'] = error_message
                     self.streams[stream_id]['is_finished'] = True
+                    self.streams[stream_id]['version'] += 1
                     self.task_status[stream_id] = 'failed'
                     
                     # 添加错误消息到队列
-                    self.message_queues[stream_id].put((error_message, True))
+                    self.message_queues[stream_id].put((error_message, True, self.streams[stream_id]['version']))
                     
                     logger.info(f"处理流式任务错误: stream_id={stream_id}, {error_message}")
                     return True
@@ -237,6 +489,74 @@ class StreamManager:
                 return ''.join(self.streams[stream_id]['accumulated_content'])
         return ""
 
+    def get_final_payload(self, stream_id):
+        """
+        获取完成后的图文混合消息，未预先构建时构建一次并保存
+        
+        Args:
+            stream_id (str): 流ID
+            
+        Returns:
+            str: JSON格式的图文混合流式消息
+        """
+        with self.lock:
+            stream_data = self.streams.get(stream_id)
+            if stream_data is None:
+                return MakeMixedStream(stream_id, "", finish=True)
+            if stream_data['final_payload'] is not None:
+                return stream_data['final_payload']
+            full_content = ''.join(stream_data['accumulated_content'])
+        final_payload = MakeMixedStream(stream_id, full_content, finish=True)
+        with self.lock:
+            if stream_id in self.streams:
+                self.streams[stream_id]['final_payload'] = final_payload
+        return final_payload
+
+    def encrypt_reply(self, stream_id, version, is_finished, make_payload, wxcrypt, nonce, timestamp):
+        """
+        加密流式回复，同一内容版本的消息体只序列化和加密一次
+        内容未变化的轮询直接复用密文，只按本次的nonce/timestamp重新计算签名
+        
+        Args:
+            stream_id (str): 流ID
+            version (int): get_next_unread返回的内容版本，为None时不缓存
+            is_finished (bool): 是否是最终消息
+            make_payload (callable): 构建明文消息体的函数，未命中缓存时调用
+            wxcrypt: 加密对象
+            nonce: 随机字符串
+            timestamp: 时间戳
+            
+        Returns:
+            int: 错误码，成功为0
+            str: 打包后的加密消息
+        """
+        key = (version, is_finished)
+        encrypt = None
+        if version is not None:
+            with self.lock:
+                stream_data = self.streams.get(stream_id)
+                cached = stream_data['cipher_cache'] if stream_data else None
+            if cached and cached[0] == key:
+                encrypt = cached[1]
+                ENCRYPT_CACHE_HITS.inc()
+        # 加密耗时只统计EncryptBody与PackMsg，不含构建消息体与等待图片的时间
+        elapsed = 0.0
+        if encrypt is None:
+            payload = make_payload()
+            start_time = time.perf_counter()
+            ret, encrypt = wxcrypt.EncryptBody(payload)
+            elapsed = time.perf_counter() - start_time
+            if ret != 0:
+                return ret, None
+            if version is not None:
+                with self.lock:
+                    if stream_id in self.streams:
+                        self.streams[stream_id]['cipher_cache'] = (key, encrypt)
+        start_time = time.perf_counter()
+        result = wxcrypt.PackMsg(encrypt, nonce, timestamp)
+        ENCRYPT_SECONDS.observe(elapsed + time.perf_counter() - start_time)
+        return result
+
     def get_next_unread_message(self, stream_id):
         """
         获取下一条未读消息
@@ -248,18 +568,33 @@ class StreamManager:
         Returns:
             tuple: (stream_id, content, is_finished)
         """
+        return self.get_next_unread(stream_id)[:3]
+
+    def get_next_unread(self, stream_id):
+        """
+        获取下一条未读消息及其内容版本
+        
+        Args:
+            stream_id (str): 流ID
+            
+        Returns:
+            tuple: (stream_id, content, is_finished, version)，version为None时内容不可缓存
+        """
         try:
             
             # 检查流是否存在
             if stream_id not in self.streams:
                 logger.warning(f"流式任务不存在: {stream_id}")
-                return None, "", True
+                return None, "", True, None
             
             # 获取当前流信息
+            STREAM_POLL_TOTAL.inc()
             with self.lock:
                 stream_data = self.streams[stream_id]
+                stream_data['poll_count'] += 1
                 status = stream_data.get('status', 'processing')
                 is_finished = stream_data.get('is_finished', False)
+                version = stream_data['version']
                 
                 # 预先获取累积内容，避免在多处重复获取
                 accumulated_content_list = stream_data.get('accumulated_content', [])
@@ -267,31 +602,31 @@ class StreamManager:
             
             # 尝试从队列获取消息
             try:
-                content, is_finished = self.message_queues[stream_id].get(block=False)
-                return stream_id, content, is_finished
+                content, is_finished, version = self.message_queues[stream_id].get(block=False)
+                return stream_id, content, is_finished, version
             except Exception:
                 # 队列为空，检查任务状态
                 with self.lock:
                     # 无论任务状态如何，只要有累积内容就返回
                     if accumulated_content:
                         # logger.info(f"返回累积内容: stream_id={stream_id}, 长度={len(accumulated_content)}, 任务状态={status}")
-                        return stream_id, accumulated_content, is_finished
+                        return stream_id, accumulated_content, is_finished, version
                     elif status in ['completed', 'failed'] or is_finished:
-                        logger.info(f"任务已完成/失败: {status}, 但无累积内容")
+                        logger.info("任务已完成/失败: %s, 但无累积内容", status, extra=SAMPLED)
                         # 如果是错误状态，优先使用错误消息
                         if status == 'failed':
                             fallback_content = stream_data.get('error_message', "处理完成")
                         else:
                             fallback_content = "处理完成"
-                        return stream_id, fallback_content, True
+                        return stream_id, fallback_content, True, None
                     else:
-                        return stream_id, "", False
+                        return stream_id, "", False, None
             
         except Exception as e:
             logger.error(f"获取未读消息失败: {str(e)}")
             import traceback
             logger.error(f"异常堆栈: {traceback.format_exc()}")
-            return None, "处理消息时发生错误，请稍后重试。", True
+            return None, "处理消息时发生错误，请稍后重试。", True, None
     
     def cleanup_stream(self, stream_id):
         """
@@ -305,6 +640,7 @@ class StreamManager:
             with self.lock:
                 # 清理流信息
                 if stream_id in self.streams:
+                    STREAM_POLLS.observe(self.streams[stream_id]['poll_count'])
                     del self.streams[stream_id]
                     # logger.info(f"清理流信息: {stream_id}")
                 
@@ -335,6 +671,78 @@ class StreamManager:
 # 创建全局的流管理器实例
 stream_manager = StreamManager()
 
+
+class ChunkCoalescer:
+    """
+    生成端的chunk合并器
+    企业微信约每秒轮询一次，逐token写入流只会反复加锁、重建队列，
+    这里先缓冲，达到时间或字符数阈值、或完成时再一次性写入
+    调用签名与stream_manager.add_stream_chunk相同，可直接作为stream回调使用
+    """
+
+    def __init__(self, sink=None, interval=STREAM_FLUSH_INTERVAL, max_chars=STREAM_FLUSH_CHARS):
+        """
+        初始化合并器
+
+        Args:
+            sink (callable, optional): 实际写入的函数，默认为stream_manager.add_stream_chunk
+            interval (float): 缓冲的最长时间(秒)，生成停顿时由定时器写入
+            max_chars (int): 缓冲的最大字符数
+        """
+        self.sink = sink or stream_manager.add_stream_chunk
+        self.interval = interval
+        self.max_chars = max_chars
+        self.stream_id = None
+        self.buffer = []
+        self.buffered_chars = 0
+        self.last_flush = time.monotonic()
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def __call__(self, stream_id, chunk_content, is_finished=False):
+        """
+        写入一个chunk
+
+        Args:
+            stream_id (str): 流ID
+            chunk_content (str): 数据块内容
+            is_finished (bool): 是否是最后一个数据块，为True时立即写入
+        """
+        with self.lock:
+            self.stream_id = stream_id
+            if chunk_content:
+                self.buffer.append(chunk_content)
+                self.buffered_chars += len(chunk_content)
+            if is_finished or self.buffered_chars >= self.max_chars or time.monotonic() - self.last_flush >= self.interval:
+                self._flush(is_finished)
+            elif self.buffer and self.timer is None:
+                # 生成停顿时缓冲内容也在interval后写入
+                self.timer = threading.Timer(self.interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        """写入缓冲的内容"""
+        with self.lock:
+            if self.buffer:
+                self._flush(False)
+
+    def _flush(self, is_finished):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if len(self.buffer) > 1:
+            STREAM_CHUNKS_COALESCED.inc(len(self.buffer) - 1)
+        content = ''.join(self.buffer)
+        self.buffer = []
+        self.buffered_chars = 0
+        self.last_flush = time.monotonic()
+        if content or is_finished:
+            self.sink(self.stream_id, content, is_finished)
+
+registry.gauge("wecom_active_streams", "当前活跃的流式任务数", lambda: len(stream_manager.streams))
+registry.gauge("image_cache_entries", "已缓存的图片数", lambda: len(image_fetcher.cache))
+
 def MakeTextStream(stream_id, content, finish):
     """
     构建流式文本消息
@@ -366,7 +774,7 @@ def MakeTextStream(stream_id, content, finish):
         
         # 使用ensure_ascii=False确保中文正确编码
         result = json.dumps(plain, ensure_ascii=False)
-        logger.debug(f"文本流式消息构建成功: {result[:100]}...")
+        logger.debug("文本流式消息构建成功: %.100s...", result)
         return result
     except Exception as e:
         # 导入日志模块
@@ -393,17 +801,9 @@ def get_img(img_url):
         bytes: 图片内容的base64编码
         str: 图片内容的md5值
     """
-    try:
-        ori_img = requests.get(img_url).content
-
-        b64 = base64.b64encode(ori_img).decode('utf-8')
-        md5 = hashlib.md5(ori_img).hexdigest()
-        # 清除图片缓存
-        del ori_img
-        return b64,md5
-    except Exception as e:
-        logger.error(f"获取图片内容失败: {str(e)}")
-        return None, None
+    if img_url.startswith(IMG_PREFIX):
+        return image_fetcher.get_many([img_url[len(IMG_PREFIX):]])[0]
+    return image_fetcher.fetch(img_url)
         
 # To do
 def MakeMixedStream(stream_id,full_content,finish):
@@ -426,16 +826,13 @@ def MakeMixedStream(stream_id,full_content,finish):
         
         # 首先提取markdown格式的图片URL链接"![image](/files/)",示例 ![image](/files/0a29d152-de00-41a7-82bd-1b924877b42b/file-preview?timestamp=1762022993&nonce=4f55&sign=uGTp-w)
         # 然后拼接为完整的图片URL,示例 https://manage.midoclouds.com/files/0a29d152-de00-41a7-82bd-1b924877b42b/file-preview?timestamp=1762022993&nonce=4f55&sign=uGTp-w
-        img_prefix = "https://manage.midoclouds.com/files/"
-        image_pattern = r'!\[image\]\(/files/([^)]+)\)'
-        matches = re.finditer(image_pattern, full_content)
+        matches = list(IMAGE_PATTERN.finditer(full_content))
         if matches:
             msg_item = []
-            for match in matches:
-                # 通过url获取图片base64,md5编码
-                img_url = img_prefix + match.group(1)
-                # logger.info(f"获取图片URL: {img_url}")
-                img_b64,img_md5= get_img(img_url)
+            # 并行获取图片base64,md5编码，流式输出期间已预取的直接命中缓存
+            with IMAGE_FETCH_SECONDS.time():
+                images = image_fetcher.get_many([match.group(1) for match in matches])
+            for match, (img_b64, img_md5) in zip(matches, images):
                 if img_b64 and img_md5:
                     msg_item.append({
                         "msgtype": "image",
@@ -510,7 +907,8 @@ def EncryptMessage(wxcrypt, nonce, timestamp, stream):
         
         # 调用企业微信提供的加密方法
         # 注意：根据WXBizJsonMsgCrypt.py的实现，参数顺序可能需要调整
-        ret, resp = wxcrypt.EncryptMsg(stream, nonce, timestamp)
+        with ENCRYPT_SECONDS.time():
+            ret, resp = wxcrypt.EncryptMsg(stream, nonce, timestamp)
         
         if ret != 0:
             logger.error(f"加密失败，错误码: {ret}")
@@ -521,7 +919,7 @@ def EncryptMessage(wxcrypt, nonce, timestamp, stream):
         if isinstance(resp, str):
             resp = resp.encode('utf-8')
         
-        logger.info(f"加密成功: 响应长度={len(resp)}")
+        logger.info("加密成功: 响应长度=%d", len(resp), extra=SAMPLED)
         return resp
     except Exception as e:
         logger.error(f"加密过程异常: {str(e)}")
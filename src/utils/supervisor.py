@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+子进程守护
+启动子进程并在后台线程中逐行读取其输出写入日志，避免管道写满后子进程阻塞
+子进程退出后按指数退避自动重启，运行超过stable_after秒后退避时间重置
+"""
+import os
+import time
+import logging
+import threading
+import subprocess
+
+logger = logging.getLogger('WeComBot')
+
+
+class ProcessSupervisor:
+    """
+    子进程守护器
+    """
+
+    def __init__(self, name, args, min_backoff=1, max_backoff=60, stable_after=60, env=None):
+        """
+        初始化守护器
+
+        Args:
+            name (str): 子进程名称，用作日志前缀
+            args (list): 启动命令
+            min_backoff (float): 首次重启前的等待时间(秒)
+            max_backoff (float): 重启等待时间上限(秒)
+            stable_after (float): 子进程运行超过此时间(秒)后视为稳定，退避时间重置
+            env (dict, optional): 额外的环境变量
+        """
+        self.name = name
+        self.args = args
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.stable_after = stable_after
+        # 关闭子进程的输出缓冲，print的内容及时写入日志
+        self.env = dict(os.environ, PYTHONUNBUFFERED="1", **(env or {}))
+        self.process = None
+        self.restarts = 0
+        self._stopping = threading.Event()
+        self._monitor = None
+        # 保证stop与启动新进程不会交错
+        self._lock = threading.Lock()
+
+    @property
+    def alive(self):
+        """子进程是否在运行"""
+        process = self.process
+        return process is not None and process.poll() is None
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process is not None else None
+
+    def start(self):
+        """在后台线程中启动并守护子进程"""
+        self._stopping.clear()
+        self._monitor = threading.Thread(target=self._run, daemon=True, name=f"{self.name}_supervisor")
+        self._monitor.start()
+
+    def _spawn(self):
+        process = subprocess.Popen(
+            self.args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True,
+            encoding='utf-8',
+            errors='replace',
+            env=self.env
+        )
+        threading.Thread(target=self._pump, args=(process,), daemon=True, name=f"{self.name}_output").start()
+        logger.info("已启动%s，进程ID: %d", self.name, process.pid)
+        return process
+
+    def _pump(self, process):
+        """逐行读取子进程输出写入日志，子进程退出后管道关闭时结束"""
+        with process.stdout:
+            for line in process.stdout:
+                line = line.rstrip()
+                if line:
+                    logger.info("[%s] %s", self.name, line)
+
+    def _run(self):
+        backoff = self.min_backoff
+        while not self._stopping.is_set():
+            start_time = time.monotonic()
+            try:
+                with self._lock:
+                    if self._stopping.is_set():
+                        break
+                    self.process = self._spawn()
+                returncode = self.process.wait()
+            except Exception as e:
+                logger.error(f"启动{self.name}失败: {str(e)}")
+                returncode = None
+            if self._stopping.is_set():
+                break
+            if time.monotonic() - start_time >= self.stable_after:
+                backoff = self.min_backoff
+            logger.error(f"{self.name}已退出，返回码: {returncode}，{backoff}秒后重启")
+            if self._stopping.wait(backoff):
+                break
+            backoff = min(backoff * 2, self.max_backoff)
+            self.restarts += 1
+
+    def stop(self, timeout=5):
+        """
+        停止守护并终止子进程
+
+        Args:
+            timeout (float): 等待子进程退出的时间(秒)，超时后强制终止
+        """
+        with self._lock:
+            self._stopping.set()
+            process = self.process
+        if process is not None and process.poll() is None:
+            logger.info(f"关闭{self.name}进程 (PID: {process.pid})")
+            try:
+                process.terminate()
+                process.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                # 超时则强制终止
+                logger.warning(f"{self.name}进程终止超时，强制终止")
+                process.kill()
+        if self._monitor is not None:
+            self._monitor.join(timeout)